@@ -0,0 +1,242 @@
+"""Module used to pool the calibration of many fields. The per cell averages
+of each calibration value are added to accumulators that can be merged, so
+that fields processed by different workers can be combined, and that give
+the median of all the cells without keeping their pixels"""
+
+import bisect
+import numpy as np
+from collections import OrderedDict
+from calibration import CALIBRATION_VALUES, read_calibration
+
+
+def finite_values(values):
+    """Returns the values as a float array without NaN and inf, which come
+    from cells without any valid pixel"""
+
+    values = np.asarray(values, dtype=float).ravel()
+
+    return values[np.isfinite(values)]
+
+
+class ExactMedian(object):
+    """Keeps every value added and returns their exact median"""
+
+    def __init__(self):
+        self.values = np.zeros(0)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, values):
+        self.values = np.concatenate((self.values, finite_values(values)))
+
+    def merge(self, other):
+        self.values = np.concatenate((self.values, other.values))
+
+    def median(self):
+        if len(self.values) == 0:
+            return np.nan
+
+        return np.median(self.values)
+
+
+class MedianSketch(object):
+    """Approximate quantiles from a small set of weighted centroids, merged
+    following the t-digest scale so that the centroids near the tails stay
+    small. The number of centroids grows very slowly with the values added;
+    the error of the median is a small fraction of the spread of the values"""
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.buffer = []
+
+    def __len__(self):
+        return int(np.sum(self.weights)) + len(self.buffer)
+
+    def add(self, values):
+        self.buffer.extend(finite_values(values))
+
+        if len(self.buffer) > 5 * self.compression:
+            self.compress()
+
+    def merge(self, other):
+        other.compress()
+        self.compress()
+        self.compress_points(np.concatenate((self.means, other.means)),
+                             np.concatenate((self.weights, other.weights)))
+
+    def compress(self):
+        if len(self.buffer) > 0:
+            self.compress_points(np.concatenate((self.means, self.buffer)),
+                                 np.concatenate((self.weights,
+                                                 np.ones(len(self.buffer)))))
+            self.buffer = []
+
+    def compress_points(self, means, weights):
+        """Merges sorted points into centroids while the weight of each
+        centroid stays under the limit of its quantile"""
+
+        if len(means) == 0:
+            return
+
+        order = np.argsort(means, kind="mergesort")
+        means = means[order]
+        weights = weights[order]
+        total = np.sum(weights)
+
+        new_means = []
+        new_weights = []
+        cur_mean, cur_weight = means[0], weights[0]
+        before = 0.0
+
+        for mean, weight in zip(means[1:], weights[1:]):
+            q = (before + (cur_weight + weight) / 2.0) / total
+            limit = 4.0 * total * q * (1 - q) / self.compression
+
+            if cur_weight + weight <= max(limit, 1.0):
+                cur_mean = (cur_mean * cur_weight + mean * weight) / \
+                    (cur_weight + weight)
+                cur_weight += weight
+            else:
+                new_means.append(cur_mean)
+                new_weights.append(cur_weight)
+                before += cur_weight
+                cur_mean, cur_weight = mean, weight
+
+        new_means.append(cur_mean)
+        new_weights.append(cur_weight)
+
+        self.means = np.array(new_means)
+        self.weights = np.array(new_weights)
+
+    def quantile(self, q):
+        self.compress()
+
+        if len(self.means) == 0:
+            return np.nan
+
+        centers = np.cumsum(self.weights) - self.weights / 2.0
+
+        return np.interp(q * np.sum(self.weights), centers, self.means)
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+class CalibrationAccumulator(object):
+    """Pools the per cell averages of the autofluorescence, a, b, c, d and G
+    of many fields. Each field is added from a FRETManager or from a
+    calibration file; accumulators filled in parallel are combined with
+    merge. If sketch is True, MedianSketch is used instead of ExactMedian"""
+
+    def __init__(self, sketch=False, compression=100):
+        self.sketch = sketch
+        self.accumulators = OrderedDict()
+        self.fields = []
+
+        for name, attribute in CALIBRATION_VALUES:
+            if sketch:
+                self.accumulators[name] = MedianSketch(compression)
+            else:
+                self.accumulators[name] = ExactMedian()
+
+    def add_cell_averages(self, cell_averages, field=None):
+        for name in self.accumulators.keys():
+            self.accumulators[name].add(cell_averages.get(name, []))
+
+        self.fields.append(field)
+
+    def add_fret_manager(self, fret_manager, field=None):
+        """Adds the per cell averages of a field already calibrated"""
+        self.add_cell_averages(fret_manager.cell_averages, field)
+
+    def add_calibration(self, filename):
+        """Adds the per cell averages saved in a calibration file"""
+        record = read_calibration(filename)
+        self.add_cell_averages(record["cell_averages"], filename)
+
+    def merge(self, other):
+        """Adds the fields of another accumulator of the same kind"""
+        for name in self.accumulators.keys():
+            self.accumulators[name].merge(other.accumulators[name])
+
+        self.fields.extend(other.fields)
+
+    def values(self):
+        """Returns the pooled median of each calibration value"""
+        return OrderedDict([(name, acc.median()) for name, acc in
+                            self.accumulators.items()])
+
+    def provenance(self):
+        """Returns the fields and the number of cells pooled for each value,
+        to be saved with the pooled calibration"""
+        return OrderedDict([("fields", self.fields),
+                            ("cells", OrderedDict([(name, len(acc)) for name, acc in
+                                                   self.accumulators.items()])),
+                            ("sketch", self.sketch)])
+
+    def apply(self, fret_manager):
+        """Sets the pooled calibration values in a FRETManager. With exact
+        accumulators, the pooled per cell averages are also set"""
+        values = self.values()
+
+        for name, attribute in CALIBRATION_VALUES:
+            setattr(fret_manager, attribute, values[name])
+
+            if self.sketch:
+                fret_manager.cell_averages[name] = []
+            else:
+                fret_manager.cell_averages[name] = list(self.accumulators[name].values)
+            fret_manager.confidence_intervals.pop(name, None)
+
+
+class SortedAggregate(object):
+    """Value of each cell of a population, also kept in a sorted list so that
+    a cell can be added, replaced or removed and the median read without
+    going through the whole population again"""
+
+    def __init__(self):
+        self.cell_values = OrderedDict()
+        self.sorted_values = []
+        self.nan_count = 0
+
+    def __len__(self):
+        return len(self.cell_values)
+
+    def __contains__(self, key):
+        return key in self.cell_values
+
+    def set(self, key, value):
+        if key in self.cell_values:
+            self.remove(key)
+
+        self.cell_values[key] = value
+        if np.isnan(value):
+            self.nan_count += 1
+        else:
+            bisect.insort(self.sorted_values, value)
+
+    def remove(self, key):
+        if key not in self.cell_values:
+            return
+
+        value = self.cell_values.pop(key)
+        if np.isnan(value):
+            self.nan_count -= 1
+        else:
+            del self.sorted_values[bisect.bisect_left(self.sorted_values, value)]
+
+    def values(self):
+        """Returns the values in the order the cells were added"""
+        return self.cell_values.values()
+
+    def median(self):
+        """Same result as np.median of the values, NaN if any is NaN"""
+        n = len(self.sorted_values)
+
+        if n == 0 or self.nan_count > 0:
+            return np.nan
+
+        return (self.sorted_values[(n - 1) // 2] + self.sorted_values[n // 2]) / 2.0
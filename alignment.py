@@ -0,0 +1,95 @@
+"""Module used to reuse the alignment of the fluorescence channels across
+the fields of a batch. The offset of each channel is a property of the
+optics of the acquisition setup plus a slow drift, so the offsets found are
+kept for each setup and channel, and the offset of the next field is
+predicted from a linear drift model fitted to the last ones. A predicted
+offset is only checked against its neighbours; the full search is run when
+the check fails and every refresh_interval fields"""
+
+import json
+import os
+import numpy as np
+from collections import OrderedDict
+
+# number of offsets kept for each setup and channel
+MAX_RECORDS = 100
+
+
+class AlignmentCache(object):
+    """Offsets of each channel of each acquisition setup, as a list of
+    [time, dx, dy, estimated] records, where estimated is True if the offset
+    was found by the full search. If filename is given and exists, the
+    records are loaded from it"""
+
+    def __init__(self, filename=None, refresh_interval=20, window=5):
+        self.filename = filename
+        self.refresh_interval = refresh_interval
+        self.window = window
+        self.records = OrderedDict()
+
+        # alignments of each (setup, channel) since the last full search
+        self.since_estimate = {}
+        self.full_searches = 0
+        self.checks = 0
+
+        if filename is not None and os.path.exists(filename):
+            self.load(filename)
+
+    def channel_records(self, setup, channel):
+        return self.records.setdefault(setup, OrderedDict()).setdefault(channel, [])
+
+    def next_time(self, setup, channel):
+        """Time of the next field when the acquisition time is not known,
+        one after the last record"""
+
+        records = self.channel_records(setup, channel)
+        if len(records) == 0:
+            return 0.0
+
+        return records[-1][0] + 1
+
+    def predict(self, setup, channel, time):
+        """Returns the (dx, dy) offset at time from a line fitted to the last
+        window records, or None if there are no records"""
+
+        records = self.channel_records(setup, channel)[-self.window:]
+        if len(records) == 0:
+            return None
+
+        times = np.array([r[0] for r in records], dtype=float)
+        offsets = np.array([r[1:3] for r in records], dtype=float)
+
+        if np.ptp(times) == 0:
+            predicted = offsets[-1]
+        else:
+            slope, intercept = np.polyfit(times, offsets, 1)
+            predicted = slope * time + intercept
+
+        return int(round(predicted[0])), int(round(predicted[1]))
+
+    def refresh_due(self, setup, channel):
+        return self.since_estimate.get((setup, channel), 0) >= self.refresh_interval
+
+    def add(self, setup, channel, time, offset, estimated):
+        records = self.channel_records(setup, channel)
+        records.append([float(time), int(offset[0]), int(offset[1]), bool(estimated)])
+        del records[:-MAX_RECORDS]
+
+        if estimated:
+            self.since_estimate[(setup, channel)] = 0
+            self.full_searches += 1
+        else:
+            self.since_estimate[(setup, channel)] = \
+                self.since_estimate.get((setup, channel), 0) + 1
+            self.checks += 1
+
+    def save(self, filename=None):
+        if filename is None:
+            filename = self.filename
+
+        with open(filename, "w") as f:
+            json.dump(self.records, f, indent=2)
+
+    def load(self, filename):
+        with open(filename, "r") as f:
+            self.records = json.load(f, object_pairs_hook=OrderedDict)
@@ -0,0 +1,240 @@
+"""Benchmark of the pipeline stages on synthetic fields of increasing size.
+Times each stage with the instrumentation recorder and checks the
+alignment, the cell count, the autofluorescence, the correction factors, G
+and E against the ground truth used to generate the field. With
+--compare-precision, each field is also run in float32, its E values
+checked against the float64 ones and the time of each stage compared.
+
+usage: python benchmark.py --scales 100 1000 10000 --output results.json"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from setmanager import SetManager
+from syntheticdata import SyntheticField
+
+
+def relative_error(value, expected):
+    if expected == 0:
+        return abs(value)
+
+    return abs(value - expected) / abs(expected)
+
+
+def assign_truth_channels(app, field):
+    """Assigns the channel and septum of each cell from the ground truth,
+    replacing the manual picking step"""
+
+    x0, y0, x1, y1 = app.image_manager.clip
+
+    for key in app.cells_manager.cells.keys():
+        cell = app.cells_manager.cells[key]
+        y, lx1, lx2 = cell.lines[len(cell.lines) / 2]
+        truth = field.population_at((lx1 + lx2) / 2 + x0, y + y0)
+
+        if truth is None:
+            cell.channel = "discard"
+            cell.has_septum = False
+        else:
+            cell.channel = truth["channel"]
+            cell.has_septum = truth["has_septum"]
+        cell.stats["Has Septum"] = int(cell.has_septum)
+
+    app.fret_manager.collect_channels(app.cells_manager)
+
+
+def check_results(app, field, tolerance):
+    """Returns a dict with the computed value, the expected value and
+    whether the relative error is within tolerance for each checked output"""
+
+    fret_manager = app.fret_manager
+    checks = OrderedDict()
+
+    def check(name, value, expected, tol=tolerance):
+        value = float(value)
+        checks[name] = OrderedDict([("value", value),
+                                    ("expected", float(expected)),
+                                    ("passed", relative_error(value, expected) <= tol)])
+
+    for channel in ["Donor", "Acceptor", "FRET"]:
+        dx, dy = app.image_manager.align_values[channel]
+        checks["Align " + channel] = OrderedDict([("value", [dx, dy]),
+                                                  ("expected", [field.shift_x, field.shift_y]),
+                                                  ("passed", (dx, dy) == (field.shift_x, field.shift_y))])
+
+    check("Cells", len(app.cells_manager.cells), field.n_cells)
+    check("Autofluorescence Donor", fret_manager.autofluorescence_donor,
+          field.autofluorescence["Donor"])
+    check("Autofluorescence Acceptor", fret_manager.autofluorescence_acceptor,
+          field.autofluorescence["Acceptor"])
+    check("Autofluorescence FRET", fret_manager.autofluorescence_fret,
+          field.autofluorescence["FRET"])
+    check("a", fret_manager.fret_a, field.fret_a)
+    check("b", fret_manager.fret_b, field.fret_b)
+    check("c", fret_manager.fret_c, field.fret_c)
+    check("d", fret_manager.fret_d, field.fret_d)
+    check("G", fret_manager.fret_G, field.fret_G)
+    check("Cell E", fret_manager.cell_E, field.both_E)
+    check("Membrane E", fret_manager.membrane_E, field.both_E)
+    check("Cytoplasm E", fret_manager.cyto_E, field.both_E)
+    check("Septum E", fret_manager.septum_E, field.both_E)
+
+    return checks
+
+
+def precision_checks(result, float32_result, tolerance):
+    """Returns the checks of the E values of a float32 run against the
+    values of the float64 run of the same field"""
+
+    checks = OrderedDict()
+
+    for name in ["Cell E", "Membrane E", "Cytoplasm E", "Septum E"]:
+        value = float32_result["checks"][name]["value"]
+        expected = result["checks"][name]["value"]
+        checks["float32 " + name] = OrderedDict([("value", value),
+                                                 ("expected", expected),
+                                                 ("passed", relative_error(value, expected) <= tolerance)])
+
+    return checks
+
+
+def precision_timings(result, float32_result):
+    """Returns the wall time of each stage in the float64 and float32 runs
+    of the same field and the ratio between them"""
+
+    timings = OrderedDict()
+
+    for name, stage in result["stages"].items():
+        if name not in float32_result["stages"]:
+            continue
+
+        wall = float32_result["stages"][name]["wall"]
+        ratio = wall / stage["wall"] if stage["wall"] > 0 else float("nan")
+        timings[name] = OrderedDict([("float64", stage["wall"]),
+                                     ("float32", wall), ("ratio", ratio)])
+
+    return timings
+
+
+def run_benchmark(n_cells, workdir, seed=0, noise=5.0, tolerance=0.05,
+                  precision="float64"):
+    """Generates a field with n_cells, runs the whole pipeline on it and
+    returns the stage timings and the checks against the ground truth"""
+
+    field = SyntheticField(n_cells=n_cells, seed=seed)
+    field.fluor_noise = noise
+    field.generate()
+    filenames = field.save(workdir + os.sep + str(n_cells))
+
+    app = SetManager()
+    app.parameters.imageloaderparams.compute_precision = precision
+    app.enable_instrumentation()
+
+    app.load_phase_image(filenames["Phase"])
+    app.compute_mask()
+    app.load_fluor_image("Donor", filenames["Donor"])
+    app.load_fluor_image("FRET", filenames["FRET"])
+    app.load_fluor_image("Acceptor", filenames["Acceptor"])
+    app.compute_segments()
+    app.compute_cells()
+    app.process_cells()
+
+    assign_truth_channels(app, field)
+    app.fret_manager.fret_E = field.control_E
+
+    app.compute_autofluorescence()
+    app.compute_correction_factors()
+    app.compute_g()
+    app.compute_fret_efficiency()
+
+    result = OrderedDict()
+    result["cells"] = field.n_cells
+    result["precision"] = precision
+    result["shape"] = list(field.shape)
+    result["stages"] = app.instrumentation.summary()
+    result["checks"] = check_results(app, field, tolerance)
+
+    return result
+
+
+def print_result(result):
+    print "\n" + str(result["cells"]) + " cells, field " + \
+        "x".join([str(s) for s in result["shape"]]) + ", " + result["precision"]
+
+    for name, stage in result["stages"].items():
+        print "  {0:45s} {1:5d} calls {2:10.3f} s {3:10d} kB".format(
+            name, stage["calls"], stage["wall"], stage["rss_delta"])
+
+    for name, check in result["checks"].items():
+        print "  {0:30s} {1:6s} {2} (expected {3})".format(
+            name, "ok" if check["passed"] else "FAILED", check["value"],
+            check["expected"])
+
+
+def print_timings(timings):
+    print "\n  {0:45s} {1:>10s} {2:>10s} {3:>6s}".format(
+        "stage", "float64", "float32", "ratio")
+
+    for name, timing in timings.items():
+        print "  {0:45s} {1:10.3f} {2:10.3f} {3:6.2f}".format(
+            name, timing["float64"], timing["float32"], timing["ratio"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyFRET stage benchmark")
+    parser.add_argument("--scales", type=int, nargs="+",
+                        default=[100, 1000, 10000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noise", type=float, default=5.0)
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--compare-precision", action="store_true")
+    parser.add_argument("--precision-tolerance", type=float, default=0.001)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="pyfret_benchmark")
+
+    results = []
+    try:
+        for n_cells in args.scales:
+            result = run_benchmark(n_cells, workdir, args.seed, args.noise,
+                                   args.tolerance)
+            if args.compare_precision:
+                float32_result = run_benchmark(n_cells, workdir, args.seed,
+                                               args.noise, args.tolerance,
+                                               "float32")
+                float32_result["checks"].update(
+                    precision_checks(result, float32_result,
+                                     args.precision_tolerance))
+                float32_result["timings"] = precision_timings(result,
+                                                              float32_result)
+                print_result(result)
+                print_result(float32_result)
+                print_timings(float32_result["timings"])
+                results.extend([result, float32_result])
+            else:
+                print_result(result)
+                results.append(result)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = [name for r in results for name, c in r["checks"].items()
+              if not c["passed"]]
+
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    exit(main())
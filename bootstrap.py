@@ -0,0 +1,47 @@
+"""Module used to compute bootstrap confidence intervals of the medians of
+per cell values. All the resamples are drawn as a single matrix of indices
+and their medians computed along one axis, instead of looping over the
+resamples"""
+
+import numpy as np
+
+# largest number of elements of the resample matrix held in memory at once
+MAX_ELEMENTS = 2 ** 24
+
+
+def bootstrap_medians(values, n_resamples=2000, seed=None):
+    """Returns the medians of n_resamples resamples with replacement of the
+    values, NaN values excluded"""
+
+    values = np.asarray(values, dtype=float).ravel()
+    values = values[np.isfinite(values)]
+
+    if len(values) == 0:
+        return np.zeros(0)
+
+    rng = np.random.RandomState(seed)
+    rows = max(1, MAX_ELEMENTS // len(values))
+    medians = []
+
+    for start in range(0, n_resamples, rows):
+        count = min(rows, n_resamples - start)
+        ix = rng.randint(0, len(values), size=(count, len(values)))
+        medians.append(np.median(values[ix], axis=1))
+
+    return np.concatenate(medians)
+
+
+def median_confidence_interval(values, n_resamples=2000, alpha=0.05,
+                               seed=None):
+    """Returns the (low, high) percentile bootstrap confidence interval of
+    the median at level 1 - alpha, or (NaN, NaN) if there are no values"""
+
+    medians = bootstrap_medians(values, n_resamples, seed)
+
+    if len(medians) == 0:
+        return np.nan, np.nan
+
+    low, high = np.percentile(medians, [100 * alpha / 2.0,
+                                        100 * (1 - alpha / 2.0)])
+
+    return low, high
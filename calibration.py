@@ -0,0 +1,118 @@
+"""Module used to save the calibration of the microscope (autofluorescence,
+correction factors and G) to a file and to load it in later runs, so that
+the FRET efficiency of a field can be computed without the wt, donor,
+acceptor and control populations"""
+
+import json
+import time
+import numpy as np
+from collections import OrderedDict
+
+# name of each calibration value and the FRETManager attribute holding it
+CALIBRATION_VALUES = [("Autofluorescence Donor", "autofluorescence_donor"),
+                      ("Autofluorescence Acceptor", "autofluorescence_acceptor"),
+                      ("Autofluorescence FRET", "autofluorescence_fret"),
+                      ("a", "fret_a"),
+                      ("b", "fret_b"),
+                      ("c", "fret_c"),
+                      ("d", "fret_d"),
+                      ("G", "fret_G")]
+
+CALIBRATION_VERSION = 1
+
+
+def json_value(value):
+    """Converts numpy scalars to python values, NaN to None"""
+
+    if value is None:
+        return None
+
+    value = float(value)
+    if np.isnan(value):
+        return None
+
+    return value
+
+
+def calibration_record(fret_manager, provenance=None):
+    """Returns a dict with the calibration values of a FRETManager, the per
+    cell averages used to compute them, the bootstrap confidence interval of
+    each value and the provenance of the run. The intervals are the ones of
+    the FRETManager, shown in the report, computed first if missing"""
+
+    if any([name not in fret_manager.confidence_intervals
+            for name, attribute in CALIBRATION_VALUES]):
+        alpha = 0.05
+        if fret_manager.confidence_level is not None:
+            alpha = 1 - fret_manager.confidence_level
+        fret_manager.compute_confidence_intervals(alpha=alpha)
+
+    record = OrderedDict()
+    record["version"] = CALIBRATION_VERSION
+    record["values"] = OrderedDict()
+    record["cell_averages"] = OrderedDict()
+    record["confidence_level"] = fret_manager.confidence_level
+    record["confidence_intervals"] = OrderedDict()
+
+    for name, attribute in CALIBRATION_VALUES:
+        cell_averages = fret_manager.cell_averages.get(name, [])
+        record["values"][name] = json_value(getattr(fret_manager, attribute))
+        record["cell_averages"][name] = [json_value(v) for v in cell_averages]
+        record["confidence_intervals"][name] = [
+            json_value(v) for v in fret_manager.confidence_intervals[name]]
+
+    record["fret_E"] = json_value(fret_manager.fret_E)
+
+    record["provenance"] = OrderedDict()
+    record["provenance"]["date"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    record["provenance"]["cells"] = OrderedDict(
+        [("wt", len(fret_manager.wt_cells)),
+         ("donor", len(fret_manager.donor_cells)),
+         ("acceptor", len(fret_manager.acceptor_cells)),
+         ("control", len(fret_manager.control_cells))])
+    if provenance is not None:
+        record["provenance"].update(provenance)
+
+    return record
+
+
+def save_calibration(filename, fret_manager, provenance=None):
+    """Saves the calibration of a FRETManager as json. provenance is a dict
+    with any other information to keep, e.g. the image files"""
+
+    with open(filename, "w") as f:
+        json.dump(calibration_record(fret_manager, provenance), f, indent=2)
+
+
+def read_calibration(filename):
+    """Returns the record saved in a calibration file"""
+
+    with open(filename, "r") as f:
+        record = json.load(f, object_pairs_hook=OrderedDict)
+
+    if record.get("version") != CALIBRATION_VERSION:
+        raise ValueError("Unknown calibration file version: " +
+                         str(record.get("version")))
+
+    return record
+
+
+def load_calibration(filename, fret_manager):
+    """Sets the calibration values and per cell averages of a FRETManager
+    from a file saved with save_calibration. Returns the loaded record"""
+
+    record = read_calibration(filename)
+
+    for name, attribute in CALIBRATION_VALUES:
+        value = record["values"].get(name)
+        if value is None:
+            raise ValueError("Calibration file without " + name + " value")
+        setattr(fret_manager, attribute, value)
+        fret_manager.cell_averages[name] = [np.nan if v is None else v for v in
+                                            record["cell_averages"].get(name, [])]
+        fret_manager.confidence_intervals.pop(name, None)
+
+    if record.get("fret_E") is not None:
+        fret_manager.fret_E = record["fret_E"]
+
+    return record
@@ -0,0 +1,156 @@
+"""Module used to assign the channel and septum of each cell automatically,
+from the background corrected intensities of the cells, as an alternative
+to picking every cell by hand in the CellPicker"""
+
+import numpy as np
+from scipy import ndimage
+from skimage.filters import threshold_isodata
+
+
+class CellClassifier(object):
+    """Classifies the cells as wt, donor, acceptor or both (or control) from
+    the average Donor and Acceptor intensities of each cell, and detects
+    the septum from the ratio between the septum and cytoplasm intensities.
+    Each cell gets a confidence between 0 and 1; cells below min_confidence
+    are returned as ambiguous so that they can be picked by hand. Without
+    calibrated thresholds, a channel whose intensities do not split into two
+    groups at least min_separation apart is taken as a single population
+    that cannot be classified, and all its cells are ambiguous"""
+
+    def __init__(self):
+        # if None, the thresholds are computed from the intensities of all
+        # the cells, assuming expressing and non expressing cells
+        self.donor_threshold = None
+        self.acceptor_threshold = None
+        # minimum distance between the means of the two groups, in log scale
+        self.min_separation = 1.0
+
+        # septum to cytoplasm intensity ratio above which the cell has septum
+        self.septum_threshold = 1.2
+
+        self.min_confidence = 0.5
+
+        # channel of the cells with both donor and acceptor, use "control"
+        # when classifying the control population
+        self.both_channel = "both"
+
+    def cell_intensities(self, image_manager, cells_manager):
+        """Returns the keys of the cells and a dict with the background
+        corrected average Donor and Acceptor intensity of each cell"""
+
+        cells = cells_manager.cells
+        keys = sorted(cells.keys(), key=int)
+        labels = np.array([int(cells[k].label) for k in keys])
+        label_image = cells_manager.merged_labels.astype(int)
+
+        intensities = {}
+        for channel, img in (("Donor", image_manager.donor_image),
+                             ("Acceptor", image_manager.acceptor_image)):
+            averages = np.asarray(ndimage.mean(img, label_image, labels))
+            baselines = np.array([cells[k].stats["Baseline " + channel]
+                                  for k in keys])
+            intensities[channel] = averages - baselines
+
+        return keys, intensities
+
+    def channel_confidence(self, signal, threshold=None):
+        """Returns which cells are above the threshold and the confidence of
+        that decision, based on the distance to the threshold in log scale
+        relative to the distance between the two groups of cells. Without a
+        threshold, the confidence is 0 if the cells do not form two groups"""
+
+        floor = 1e-3 * np.max(np.abs(signal))
+        log_signal = np.log(np.clip(signal, floor, None))
+
+        if threshold is None:
+            log_threshold = threshold_isodata(log_signal)
+        else:
+            log_threshold = np.log(threshold)
+
+        above = log_signal > log_threshold
+        if np.all(above) or not np.any(above):
+            margin = np.std(log_signal)
+        else:
+            margin = (np.mean(log_signal[above]) -
+                      np.mean(log_signal[~above])) / 2.0
+
+        if threshold is None and (np.all(above) or not np.any(above) or
+                                  2 * margin < self.min_separation):
+            return above, np.zeros(len(signal))
+
+        if margin <= 0:
+            confidence = np.ones(len(signal))
+        else:
+            confidence = np.clip(np.abs(log_signal - log_threshold) / margin,
+                                 0, 1)
+
+        return above, confidence
+
+    def septum_ratio(self, cell, image_manager):
+        """Returns the ratio between the background corrected average
+        intensities of the septum and the cytoplasm, in the channel where the
+        septum was found"""
+
+        if cell.sept_mask is None or cell.cyto_mask is None or \
+                np.sum(cell.cyto_mask) == 0 or np.sum(cell.sept_mask) == 0:
+            return None
+
+        if cell.septum_from == "Acceptor":
+            img, baseline = image_manager.acceptor_image, cell.stats["Baseline Acceptor"]
+        else:
+            img, baseline = image_manager.donor_image, cell.stats["Baseline Donor"]
+
+        x0, y0, x1, y1 = cell.box
+        fluor = img[x0:x1 + 1, y0:y1 + 1] - baseline
+        septum = np.average(fluor[cell.sept_mask > 0])
+        cyto = np.average(fluor[cell.cyto_mask > 0])
+
+        if cyto <= 0:
+            return None
+
+        return septum / cyto
+
+    def classify(self, image_manager, cells_manager):
+        """Assigns channel, has_septum and channel_confidence to every cell.
+        Returns the keys of the cells with a confidence below min_confidence"""
+
+        keys, intensities = self.cell_intensities(image_manager, cells_manager)
+
+        if len(keys) == 0:
+            return []
+
+        has_donor, donor_conf = self.channel_confidence(intensities["Donor"],
+                                                        self.donor_threshold)
+        has_acceptor, acceptor_conf = self.channel_confidence(intensities["Acceptor"],
+                                                              self.acceptor_threshold)
+        confidence = np.minimum(donor_conf, acceptor_conf)
+
+        channels = np.array(["wt"] * len(keys), dtype=object)
+        channels[has_donor & ~has_acceptor] = "donor"
+        channels[~has_donor & has_acceptor] = "acceptor"
+        channels[has_donor & has_acceptor] = self.both_channel
+
+        log_septum = np.log(self.septum_threshold)
+        ambiguous = []
+
+        for ix, k in enumerate(keys):
+            cell = cells_manager.cells[k]
+            cell.channel = channels[ix]
+            cell.has_septum = False
+
+            if cell.channel in ("donor", "acceptor", self.both_channel):
+                ratio = self.septum_ratio(cell, image_manager)
+                if ratio is not None and ratio > 0:
+                    cell.has_septum = bool(ratio >= self.septum_threshold)
+                    if log_septum > 0:
+                        septum_conf = min(abs(np.log(ratio) - log_septum) /
+                                          log_septum, 1.0)
+                        confidence[ix] = min(confidence[ix], septum_conf)
+
+            cell.stats["Has Septum"] = int(cell.has_septum)
+            cell.channel_confidence = float(confidence[ix])
+
+            if confidence[ix] < self.min_confidence:
+                ambiguous.append(k)
+
+        return ambiguous
@@ -1,5 +1,7 @@
+import Queue
+import threading
 import Tkinter as tk
-import matplotlib.cm as cm
+import numpy as np
 import tkMessageBox
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2TkAgg
 from matplotlib import pyplot as plt
@@ -101,10 +103,23 @@ class CellPicker(object):
 
         self.main_window.bind("<Key>", self.key)
 
-    def start_picker(self, image_manager, cells_manager):
-        
+        # the cell image is drawn with blitting over a saved background
+        self.axes_image = None
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+        # number of cell images prepared ahead by the prefetch thread
+        self.prefetch_count = 5
+
+    def start_picker(self, image_manager, cells_manager, cells_id=None,
+                     journal=None):
+        """Shows each cell to be classified by hand. If cells_id is given,
+        only those cells are shown. Each decision is saved to the journal,
+        if one is given, as soon as it is made"""
+
         self.image_manager = image_manager
         self.cells_manager = cells_manager
+        self.journal = journal
 
         self.wt_cells = []
         self.donor_cells = []
@@ -113,13 +128,25 @@ class CellPicker(object):
         self.septum_cells = []
 
         self.current_index = 0
-        self.cells_id = sorted(self.cells_manager.cells.keys())
+        if cells_id is None:
+            cells_id = self.cells_manager.cells.keys()
+        self.cells_id = sorted(cells_id)
         self.total = len(self.cells_id)
 
+        self.frame_shape = self.compute_frame_shape()
+        self.frames = {}
+        self.frames_lock = threading.Lock()
+        self.prefetch_queue = Queue.Queue()
+        prefetch_thread = threading.Thread(target=self.prefetch_worker)
+        prefetch_thread.daemon = True
+        prefetch_thread.start()
+
         self.show_image()
 
         self.main_window.mainloop()
 
+        self.prefetch_queue.put(None)
+
         label_text.set(str(self.current_index+1) + " of " + str(self.total) + " total")
 
     def key(self, event):
@@ -165,6 +192,10 @@ class CellPicker(object):
         else:
             self.cells_manager.cells[self.cells_id[self.current_index]].stats["Has Septum"] = 0
 
+        if self.journal is not None:
+            self.journal.record(self.cells_id[self.current_index], channel,
+                                has_septum)
+
         if self.current_index < len(self.cells_id)-1:
             self.current_index += 1
             self.show_image()
@@ -175,13 +206,99 @@ class CellPicker(object):
             else:
                 self.show_image()
 
+    def compute_frame_shape(self):
+        """Returns the shape of the largest cell image. Every cell image is
+        padded to this shape so that the axes never need to be rescaled"""
+        height = 1
+        width = 1
+        for key in self.cells_id:
+            img = self.cells_manager.cells[key].donacc_image
+            height = max(height, img.shape[0])
+            width = max(width, img.shape[1])
+
+        return height, width, 3
+
+    def prepare_frame(self, index):
+        """Converts the image of a cell to 8 bit rgb, centered on a frame
+        with the size of the largest cell image"""
+        img = self.cells_manager.cells[self.cells_id[index]].donacc_image
+        if img.ndim == 2:
+            img = np.dstack((img, img, img))
+
+        frame = np.zeros(self.frame_shape, dtype=np.uint8)
+        h, w = img.shape[:2]
+        x0 = (self.frame_shape[0] - h) / 2
+        y0 = (self.frame_shape[1] - w) / 2
+        frame[x0:x0 + h, y0:y0 + w] = np.clip(img[:, :, :3] * 255, 0, 255)
+
+        return frame
+
+    def prefetch_worker(self):
+        """Runs on a background thread, preparing the frames of the cells
+        requested through the prefetch queue"""
+        while True:
+            index = self.prefetch_queue.get()
+            if index is None:
+                break
+
+            with self.frames_lock:
+                if index in self.frames:
+                    continue
+
+            frame = self.prepare_frame(index)
+
+            with self.frames_lock:
+                self.frames[index] = frame
+
+    def get_frame(self, index):
+        with self.frames_lock:
+            frame = self.frames.get(index)
+
+        if frame is None:
+            frame = self.prepare_frame(index)
+            with self.frames_lock:
+                self.frames[index] = frame
+
+        return frame
+
+    def prefetch(self):
+        """Requests the next cells and forgets the frames that are far from
+        the current cell"""
+        first = self.current_index - self.prefetch_count
+        last = self.current_index + self.prefetch_count
+
+        with self.frames_lock:
+            for index in self.frames.keys():
+                if index < first or index > last:
+                    del self.frames[index]
+
+        for index in range(self.current_index + 1, min(last + 1, self.total)):
+            self.prefetch_queue.put(index)
+
+    def on_draw(self, event):
+        """Saves the background after a full redraw (first draw, resize,
+        zoom) and draws the cell image over it"""
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        if self.axes_image is not None:
+            self.ax.draw_artist(self.axes_image)
+            self.canvas.blit(self.ax.bbox)
+
     def show_image(self):
 
-        self.ax.cla()
+        frame = self.get_frame(self.current_index)
+
+        if self.axes_image is None:
+            self.axes_image = self.ax.imshow(frame, interpolation="nearest",
+                                             animated=True)
+            self.canvas.draw()
 
-        current_image = self.cells_manager.cells[self.cells_id[self.current_index]].donacc_image
+        else:
+            self.axes_image.set_data(frame)
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.axes_image)
+            self.canvas.blit(self.ax.bbox)
 
-        self.ax.imshow(current_image, cmap=cm.gray)
         label_text.set(str(self.current_index+1) + " of " + str(self.total) + " total")
         self.main_window.update_idletasks()
-        self.canvas.show()
+
+        self.prefetch()
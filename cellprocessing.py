@@ -1,6 +1,7 @@
 "Module used to encapsulate some functions used in the cells module"
 
 
+import heapq
 import numpy as np
 from skimage import color
 from skimage.util import img_as_int
@@ -111,27 +112,117 @@ def overlay_cells(cells, image, colors):
     return tmp
 
 
-def assign_cell_color(cell, cells, cell_colors):
-    """ assigns an index to cell.color that is different from the neighbours """
-
-    neighcols = []
-
-    for neigh in cell.neighbours.iterkeys():
-        try:
-            col = cells[str(int(neigh))].color_i
-            if col not in neighcols:
-                neighcols.append(col)
-        except KeyError:
-            pass
-
-    cell.color_i = cell.stats["Area"] % len(
-        cell_colors)  # each cell has a preferred color
-
-    while len(neighcols) < len(cell_colors) and (cell.color_i in neighcols):
-        cell.color_i += 1
-
-        if cell.color_i >= len(cell_colors):
-            cell.color_i = 0
+def merged_aliases(cells):
+    """Returns a dict of the label of each merged cell to the key of the cell
+    it was merged into"""
+
+    aliases = {}
+    for k, c in cells.items():
+        for merged in c.merged_list:
+            aliases[str(int(merged))] = k
+
+    return aliases
+
+
+def neighbour_graph(cells, keys, original_cells=None, aliases=None):
+    """Returns the CSR adjacency (indptr, indices) of the cells of keys: row
+    i has the labels of the neighbours of keys[i], including the neighbours
+    of the cells merged into it if original_cells is given. Edges between
+    two cells of keys are made symmetric. aliases is the dict of
+    merged_aliases, built from all the cells if None and needed; a label
+    whose alias was merged again is followed to the cell it is part of"""
+
+    position = dict([(k, i) for i, k in enumerate(keys)])
+    src = []
+    dst = []
+
+    for i, k in enumerate(keys):
+        cell = cells[k]
+        neighbours = list(cell.neighbours.keys())
+        if original_cells is not None:
+            for merged in cell.merged_list:
+                if str(int(merged)) in original_cells:
+                    neighbours.extend(original_cells[str(int(merged))].neighbours.keys())
+
+        for label in neighbours:
+            neighbour = str(int(label))
+            if neighbour not in cells:
+                if aliases is None:
+                    aliases = merged_aliases(cells)
+                while neighbour is not None and neighbour not in cells:
+                    neighbour = aliases.get(neighbour)
+
+            if neighbour is not None and neighbour != k:
+                src.append(i)
+                dst.append(int(neighbour))
+                if neighbour in position:
+                    src.append(position[neighbour])
+                    dst.append(int(k))
+
+    src = np.array(src, dtype=np.int64)
+    dst = np.array(dst, dtype=np.int64)
+    n_labels = np.max(dst) + 1 if len(dst) > 0 else 1
+
+    # sorted unique edges, by cell and then by neighbour
+    pairs = np.unique(src * n_labels + dst)
+    indices = pairs % n_labels
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(pairs // n_labels,
+                                                        minlength=len(keys)))))
+
+    return indptr, indices
+
+
+def color_cells(cells, n_colors, keys=None, original_cells=None, aliases=None):
+    """Assigns to the cells of keys (all the cells if None) a color_i
+    different from the colours of their neighbours, when there are enough
+    colours. Cells are coloured in DSATUR order: the cell with most distinct
+    colours around it first, then the one with most neighbours, then the
+    lowest label, so the result is deterministic. Each cell takes its
+    preferred colour, the area modulo n_colors, or the next free one. The
+    other cells keep their colours, so after a merge or a split only the
+    changed cells need to be recoloured, given the aliases of the merged
+    cells kept up to date by the caller"""
+
+    if keys is None:
+        keys = cells.keys()
+    keys = sorted(keys, key=int)
+    position = dict([(k, i) for i, k in enumerate(keys)])
+
+    for k in keys:
+        cells[k].color_i = -1
+
+    indptr, indices = neighbour_graph(cells, keys, original_cells, aliases)
+    degree = np.diff(indptr)
+
+    # colours around each cell, starting with the cells not recoloured
+    around = [set() for k in keys]
+    for i in range(len(keys)):
+        for label in indices[indptr[i]:indptr[i + 1]]:
+            if str(label) not in position and cells[str(label)].color_i >= 0:
+                around[i].add(cells[str(label)].color_i)
+
+    heap = [(-len(around[i]), -degree[i], int(k), i) for i, k in enumerate(keys)]
+    heapq.heapify(heap)
+    colored = np.zeros(len(keys), dtype=bool)
+
+    while len(heap) > 0:
+        saturation, dum, dum, i = heapq.heappop(heap)
+        # skips the entries replaced after a neighbour was coloured
+        if colored[i] or -saturation != len(around[i]):
+            continue
+
+        cell = cells[keys[i]]
+        cell.color_i = cell.stats["Area"] % n_colors
+        if len(around[i]) < n_colors:
+            while cell.color_i in around[i]:
+                cell.color_i = (cell.color_i + 1) % n_colors
+        colored[i] = True
+
+        for label in indices[indptr[i]:indptr[i + 1]]:
+            j = position.get(str(label))
+            if j is not None and not colored[j] and cell.color_i not in around[j]:
+                around[j].add(cell.color_i)
+                heapq.heappush(heap, (-len(around[j]), -degree[j], int(keys[j]), j))
 
 
 def update_neighbours(cells, oldlabel, newlabel):
@@ -3,6 +3,7 @@ import numpy as np
 import matplotlib as plt
 from collections import OrderedDict
 from copy import deepcopy
+from scipy.spatial import cKDTree
 from skimage.color import gray2rgb, rgb2gray
 from skimage.draw import line
 from skimage.exposure import rescale_intensity
@@ -11,6 +12,7 @@ from skimage.morphology import binary_dilation, binary_erosion
 from skimage.filters import threshold_isodata
 from skimage.util import img_as_float, img_as_int, img_as_uint
 from skimage.segmentation import mark_boundaries
+from instrumentation import recorder, timed
 
 
 class Cell(object):
@@ -38,6 +40,7 @@ class Cell(object):
 
         self.septum_from = None
         self.channel = None
+        self.channel_confidence = None
         self.has_septum = None
 
         self.fluor = None
@@ -88,6 +91,7 @@ class Cell(object):
 
         self.septum_from = None
         self.channel = None
+        self.channel_confidence = None
         self.has_septum = None
 
         self.fluor = None
@@ -247,10 +251,10 @@ class Cell(object):
 
     def compute_cell_mask(self):
         x0, y0, x1, y1 = self.box
-        mask = np.zeros((x1 - x0 + 1, y1 - y0 + 1))
+        mask = np.zeros((x1 - x0 + 1, y1 - y0 + 1), dtype=bool)
         for lin in self.lines:
             y, st, en = lin
-            mask[st - x0:en - x0 + 1, y - y0] = 1.0
+            mask[st - x0:en - x0 + 1, y - y0] = True
         return mask
 
     def compute_perim_mask(self, mask, thick):
@@ -259,9 +263,8 @@ class Cell(object):
         """
         # create mask
 
-        eroded = binary_erosion(mask, np.ones(
-            (thick * 2 - 1, thick - 1))).astype(float)
-        perim = mask - eroded
+        eroded = binary_erosion(mask, np.ones((thick * 2 - 1, thick - 1)))
+        perim = mask & ~eroded
 
         return perim
 
@@ -289,11 +292,11 @@ class Cell(object):
         for img in self.fluor:
             fluor_box = img
             perim_mask = self.compute_perim_mask(cell_mask, thick)
-            inner_mask = cell_mask - perim_mask
-            inner_fluor = (inner_mask > 0) * fluor_box
+            inner_mask = cell_mask & ~perim_mask
+            inner_fluor = inner_mask * fluor_box
 
             threshold = threshold_isodata(inner_fluor[inner_fluor > 0])
-            interest_matrix = inner_mask * (inner_fluor > threshold)
+            interest_matrix = inner_mask & (inner_fluor > threshold)
 
             label_matrix = label(interest_matrix, connectivity=2)
             interest_label = 0
@@ -305,7 +308,7 @@ class Cell(object):
                     interest_label_sum = np.sum(
                         img_as_float(label_matrix == l + 1))
 
-            septum_masks.append(img_as_float(label_matrix == interest_label))
+            septum_masks.append(label_matrix == interest_label)
 
         donor_values = septum_masks[0] * self.fluor[0]
         donor_values = np.sort(donor_values, axis=None)[::-1]
@@ -337,16 +340,17 @@ class Cell(object):
 
         linmask = np.zeros((x1 - x0 + 1, y1 - y0 + 1))
         linmask[x, y] = 1
-        linmask = binary_dilation(
-            linmask, np.ones((thick, thick))).astype(float)
+        linmask = binary_dilation(linmask, np.ones((thick, thick)))
 
         if mask is not None:
-            linmask = mask * linmask
+            linmask = mask & linmask
 
         return linmask
 
     def get_outline_points(self, data):
         """Method used to obtain the outline pixels of the septum"""
+        # integer view of the boolean mask, so that the neighbours add up
+        data = np.asarray(data, dtype=np.uint8)
         outline = []
         for x in range(0, len(data)):
             for y in range(0, len(data[x])):
@@ -557,6 +561,7 @@ class Cell(object):
             except RuntimeError:
                 self.recursive_compute_sept(cell_mask, inner_mask_thickness - 1, "Box")
 
+    @timed("Cell.compute_regions")
     def compute_regions(self, params, image_manager):
         """Computes each different region of the cell (whole cell, membrane,
         septum, cytoplasm) and creates their respectives masks."""
@@ -578,7 +583,7 @@ class Cell(object):
                 linmask = self.remove_sept_from_membrane(
                     image_manager.mask.shape)
 
-                self.cyto_mask = (self.cell_mask - self.perim_mask - self.sept_mask) > 0
+                self.cyto_mask = self.cell_mask & ~self.perim_mask & ~self.sept_mask
                 
                 # different from ehooke, these values are not added to the cytoplasm
                 if linmask is not None:
@@ -587,20 +592,18 @@ class Cell(object):
                     
 
                 else:
-                    self.cyto_mask = (
-                        self.cell_mask - self.perim_mask - self.sept_mask) > 0
+                    self.cyto_mask = \
+                        self.cell_mask & ~self.perim_mask & ~self.sept_mask
             else:
-                self.perim_mask = (self.compute_perim_mask(self.cell_mask,
-                                                           params.inner_mask_thickness) -
-                                   self.sept_mask) > 0
-                self.membsept_mask = (self.perim_mask + self.sept_mask) > 0
-                self.cyto_mask = (self.cell_mask - self.perim_mask -
-                                  self.sept_mask) > 0
+                self.perim_mask = self.compute_perim_mask(
+                    self.cell_mask, params.inner_mask_thickness) & ~self.sept_mask
+                self.membsept_mask = self.perim_mask | self.sept_mask
+                self.cyto_mask = self.cell_mask & ~self.perim_mask & ~self.sept_mask
         else:
             self.sept_mask = None
             self.perim_mask = self.compute_perim_mask(self.cell_mask,
                                                       params.inner_mask_thickness)
-            self.cyto_mask = (self.cell_mask - self.perim_mask) > 0
+            self.cyto_mask = self.cell_mask & ~self.perim_mask
 
     def set_image(self, params, images):
         """ creates a strip with the cell in different images
@@ -702,6 +705,18 @@ class CellsManager(object):
         self.original_cells = {}
         self.merged_cells = []
         self.merged_labels = None
+        # label of each merged cell to the key of the cell it was merged
+        # into, kept up to date by merge_cells and split_cells
+        self.aliases = None
+
+        # spatial index of the cells: merged_labels gives the cell at a
+        # pixel, the centroids and bounding boxes of index_keys are used by
+        # nearest_cells and cells_in_box, rebuilt when index_dirty
+        self.index_keys = []
+        self.index_centroids = np.zeros((0, 2))
+        self.index_boxes = np.zeros((0, 4), dtype=int)
+        self.index_tree = None
+        self.index_dirty = True
 
         spmap = plt.cm.get_cmap("hsv", params.cellprocessingparams.cell_colors)
         self.cell_colors = spmap(np.arange(
@@ -712,6 +727,19 @@ class CellsManager(object):
         self.acceptor_w_cells = None
         self.fret_w_cells = None
 
+    def cell_aliases(self):
+        """Returns the aliases of the merged cells, built from the cells if
+        they were set from outside, e.g. loaded from the stage cache"""
+        if self.aliases is None:
+            self.aliases = cp.merged_aliases(self.cells)
+
+        return self.aliases
+
+    def merged_cells_labels(self):
+        """Returns the labels of the cells resulting from a merge"""
+        return [k for k in self.cells.keys()
+                if self.cells[k].merged_with == "Yes"]
+
     def clean_empty_cells(self):
         """Removes empty cell objects from the cells dict"""
         newcells = {}
@@ -721,6 +749,7 @@ class CellsManager(object):
 
         self.cells = newcells
 
+    @timed("CellsManager.cell_regions_from_labels")
     def cell_regions_from_labels(self, labels):
         """creates a list of N cells assuming self.labels has consecutive
         values from 1 to N create cell regions, frontiers and neighbours from
@@ -767,6 +796,8 @@ class CellsManager(object):
 
         self.cells = cells
 
+        recorder.count(cells=len(cells), pixels=labels.size)
+
     def overlay_cells_w_image(self, image):
         """Creates an overlay of the cells over the base image.
         Besides the base image this method also requires the clipping
@@ -787,11 +818,79 @@ class CellsManager(object):
             labels = cp.paint_cell(c, labels, c.label)
 
         self.merged_labels = labels
+        self.index_dirty = True
         self.phase_w_cells = self.overlay_cells_w_image(image_manager.phase_image)
         self.donor_w_cells = self.overlay_cells_w_image(image_manager.donor_image)
         self.acceptor_w_cells = self.overlay_cells_w_image(image_manager.acceptor_image)
         self.fret_w_cells = self.overlay_cells_w_image(image_manager.fret_image)
 
+    def update_index(self):
+        """Rebuilds the centroids, the bounding boxes and the KD-tree of the
+        centroids of the cells from their lines. Cells without lines are
+        left out of the index"""
+
+        keys = [k for k in sorted(self.cells.keys(), key=int)
+                if len(self.cells[k].lines) > 0]
+        centroids = np.zeros((len(keys), 2))
+        boxes = np.zeros((len(keys), 4), dtype=int)
+
+        for ix, k in enumerate(keys):
+            lines = np.asarray(self.cells[k].lines)
+            y, x0, x1 = lines[:, 0], lines[:, 1], lines[:, 2]
+            count = x1 - x0 + 1
+            centroids[ix] = (np.sum(count * (x0 + x1) / 2.0) / np.sum(count),
+                             np.sum(count * y) / float(np.sum(count)))
+            boxes[ix] = (np.min(x0), np.min(y), np.max(x1), np.max(y))
+
+        self.index_keys = keys
+        self.index_centroids = centroids
+        self.index_boxes = boxes
+        self.index_tree = cKDTree(centroids) if len(keys) > 0 else None
+        self.index_dirty = False
+
+    def cell_at(self, x, y):
+        """Returns the key of the cell at pixel (x, y) of the clipped images,
+        or None if there is no cell there"""
+
+        if self.merged_labels is None:
+            return None
+
+        label = int(self.merged_labels[x, y])
+        if label == 0 or str(label) not in self.cells:
+            return None
+
+        return str(label)
+
+    def nearest_cells(self, x, y, k=1):
+        """Returns the keys and the centroid distances of the k cells whose
+        centroids are nearest to (x, y), nearest first"""
+
+        if self.index_dirty:
+            self.update_index()
+
+        k = min(k, len(self.index_keys))
+        if k == 0:
+            return [], []
+
+        distances, ixs = self.index_tree.query((x, y), k=k)
+        distances = np.atleast_1d(distances)
+        ixs = np.atleast_1d(ixs)
+
+        return [self.index_keys[ix] for ix in ixs], list(distances)
+
+    def cells_in_box(self, x0, y0, x1, y1):
+        """Returns the keys of the cells whose bounding box intersects the
+        box from (x0, y0) to (x1, y1), limits included"""
+
+        if self.index_dirty:
+            self.update_index()
+
+        boxes = self.index_boxes
+        inside = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x0) & \
+                 (boxes[:, 1] <= y1) & (boxes[:, 3] >= y0)
+
+        return [self.index_keys[ix] for ix in np.nonzero(inside)[0]]
+
     def compute_box_axes(self, rotations, maskshape):
         for k in self.cells.keys():
             if self.cells[k].stats["Area"] > 0:
@@ -811,6 +910,7 @@ class CellsManager(object):
         self.compute_box_axes(rotations, image_manager.mask.shape)
 
         self.original_cells = deepcopy(self.cells)
+        self.aliases = {}
 
         for k in self.cells.keys():
             try:
@@ -828,9 +928,9 @@ class CellsManager(object):
             except KeyError:
                 pass
 
-        for k in self.cells.keys():
-            cp.assign_cell_color(self.cells[k], self.cells,
-                                 self.cell_colors)
+        cp.color_cells(self.cells, len(self.cell_colors),
+                       original_cells=self.original_cells,
+                       aliases=self.aliases)
 
         self.overlay_cells(image_manager)
 
@@ -847,6 +947,8 @@ class CellsManager(object):
 
         self.cells[str(label_c2)].outline.extend(self.cells[str(label_c1)].outline)
 
+        self.cell_aliases()[str(label_c1)] = str(label_c2)
+
         self.cells[str(label_c2)].stats["Neighbours"] = self.cells[str(label_c2)].stats["Neighbours"] + self.cells[str(label_c1)].stats["Neighbours"] - 2
 
         del self.cells[str(label_c1)]
@@ -859,12 +961,23 @@ class CellsManager(object):
         if len(self.cells[str(label_c2)].merged_list) > 0:
             self.cells[str(label_c2)].merged_with = "Yes"
 
+        # merges made after compute_cells only recolour the merged cell
+        if self.merged_labels is not None:
+            cp.paint_cell(self.cells[str(label_c2)], self.merged_labels, label_c2)
+            cp.color_cells(self.cells, len(self.cell_colors), [str(label_c2)],
+                           self.original_cells, self.aliases)
+        self.index_dirty = True
+
     def split_cells(self, label_c1, params, segments_manager, image_manager):
         """Splits a previously merged cell."""
         merged_cells = self.cells[str(label_c1)].merged_list
         merged_cells.append(label_c1)
         del self.cells[str(label_c1)]
 
+        aliases = self.cell_aliases()
+        for id in merged_cells:
+            aliases.pop(str(int(id)), None)
+
         rotations = cp.rotation_matrices(params.axial_step)
         for id in merged_cells:
             id = int(id)
@@ -873,10 +986,13 @@ class CellsManager(object):
             self.cells[str(id)].recompute_outline(segments_manager.labels)
             if len(self.cells[str(id)].merged_list) == 0:
                 self.cells[str(id)].merged_with = "No"
+            if self.merged_labels is not None:
+                cp.paint_cell(self.cells[str(id)], self.merged_labels, id)
+        self.index_dirty = True
 
-        for k in self.cells.keys():
-            cp.assign_cell_color(self.cells[k], self.cells,
-                                 self.cell_colors)
+        cp.color_cells(self.cells, len(self.cell_colors),
+                       [str(int(id)) for id in merged_cells], self.original_cells,
+                       aliases)
 
     def mark_cell_as_noise(self, label_c1, image_manager, is_noise):
         """Used to change the selection_state of a cell to 0 (noise)
@@ -902,7 +1018,6 @@ class CellsManager(object):
 
         if params.remove_background:
             for k in self.cells.keys():
-                self.cells[k].set_image(params, [self.donor_w_cells, self.acceptor_w_cells, self.fret_w_cells])
                 self.cells[k].compute_fluor_baseline(image_manager.mask,
                                                      image_manager.donor_image,
                                                      params.baseline_margin,
@@ -915,22 +1030,78 @@ class CellsManager(object):
                                                      image_manager.fret_image,
                                                      params.baseline_margin,
                                                      "FRET")
-                self.cells[k].create_image(image_manager)
-        else:
-            for k in self.cells.keys():
-                self.cells[k].set_image(params, [self.donor_w_cells, self.acceptor_w_cells, self.fret_w_cells])
-                self.cells[k].create_image(image_manager)
+
+        self.create_cells_images(params, image_manager)
+
+    def create_cells_images(self, params, image_manager):
+        """Creates the image strip and the composite image of each cell.
+        Requires the regions of the cells to be computed"""
+        for k in self.cells.keys():
+            self.cells[k].set_image(params, [self.donor_w_cells, self.acceptor_w_cells, self.fret_w_cells])
+            self.cells[k].create_image(image_manager)
 
         self.overlay_cells(image_manager)
 
+    def stats_columns(self, names, keys):
+        """Returns a dict of stat name to an array with the value of the stat
+        of each cell of keys"""
+
+        return dict([(name, np.array([self.cells[k].stats[name] for k in keys],
+                                     dtype=float)) for name in names])
+
+    def query_cells(self, filters=(), sort_by=None, descending=False,
+                    top=None, keys=None):
+        """Returns an array with the labels of the cells of keys (all the
+        cells if None) whose stats are within every [("Stat", min, max)]
+        filter, evaluated on the stats of all the cells at once. If sort_by
+        is given the labels are sorted by that stat, ties by label, and
+        only the first top are kept"""
+
+        if keys is None:
+            keys = self.cells.keys()
+        keys = sorted(keys, key=int)
+        labels = np.array([int(k) for k in keys], dtype=int)
+
+        names = set([f[0] for f in filters])
+        if sort_by is not None:
+            names.add(sort_by)
+        columns = self.stats_columns(names, keys)
+
+        passed = np.ones(len(keys), dtype=bool)
+        for name, minimum, maximum in filters:
+            values = columns[name]
+            # NaN stats pass the filters, as in cp.blocked_by_filter
+            with np.errstate(invalid="ignore"):
+                passed &= ~((values < minimum) | (values > maximum))
+
+        labels = labels[passed]
+
+        if sort_by is not None:
+            values = columns[sort_by][passed]
+            if descending:
+                values = -values
+            labels = labels[np.lexsort((labels, values))]
+
+        if top is not None:
+            labels = labels[:top]
+
+        return labels
+
+    def set_selection_state(self, labels, state):
+        """Sets the selection_state of the cells of labels, without
+        refreshing the overlays"""
+
+        for label in labels:
+            self.cells[str(int(label))].selection_state = state
+
     def filter_cells(self, params, image_manager):
         """Gets the list of filters on the parameters [("Stat", min, max)].
         Compares each cell to the filter and only select the ones that pass the filter"""
-        for k in self.cells.keys():
-            if self.cells[k].selection_state != 0:
-                if cp.blocked_by_filter(self.cells[k], params.cell_filters):
-                    self.cells[k].selection_state = -1
-                else:
-                    self.cells[k].selection_state = 1
+        keys = [k for k in self.cells.keys() if self.cells[k].selection_state != 0]
+        passed = self.query_cells(params.cell_filters, keys=keys)
+        blocked = np.setdiff1d([int(k) for k in keys], passed)
+
+        self.set_selection_state(passed, 1)
+        self.set_selection_state(blocked, -1)
 
         self.overlay_cells(image_manager)
@@ -1,9 +1,39 @@
+import os
 import numpy as np
 import Tkinter as tk
+from collections import OrderedDict
 from matplotlib import cm
 from skimage.util import img_as_float
 from skimage.color import gray2rgb
+from numpy.lib.format import open_memmap
 from cellpicker import CellPicker
+from cellclassifier import CellClassifier
+from pickerjournal import apply_assignments
+from instrumentation import recorder, timed
+from bootstrap import median_confidence_interval
+from accumulators import SortedAggregate
+from calibration import CALIBRATION_VALUES
+from precision import float_dtype
+
+# layers of the E stack computed by compute_fret_efficiency
+E_LAYERS = ["Cell E", "Membrane E", "Cytoplasm E", "Septum E", "Idd", "Iaa",
+            "Fc"]
+
+# per cell values computed for each population
+POPULATION_VALUES = {"wt": ["Autofluorescence Donor", "Autofluorescence Acceptor",
+                            "Autofluorescence FRET"],
+                     "acceptor": ["a", "b"],
+                     "donor": ["c", "d"],
+                     "control": ["G"],
+                     "both": ["Cell E", "Membrane E", "Cytoplasm E", "Septum E",
+                              "MembSept E"]}
+
+# attribute with the median of each per cell value
+SUMMARY_ATTRIBUTES = dict(CALIBRATION_VALUES + [("Cell E", "cell_E"),
+                                                ("Membrane E", "membrane_E"),
+                                                ("Cytoplasm E", "cyto_E"),
+                                                ("Septum E", "septum_E"),
+                                                ("MembSept E", "membsept_E")])
 
 
 # READ: correction factors are calculated from membrane and septum (if it exists)
@@ -40,193 +70,297 @@ class FRETManager(object):
 
         self.fret_heatmap = None
 
-    def start_channel_picker(self, image_manager, cells_manager):
-        picker = CellPicker()
-        picker.start_picker(image_manager, cells_manager)
+        # float32 stack with a layer for each of E_LAYERS, NaN outside the
+        # computed pixels. If e_stack_filename is set, the stack is created
+        # as a memory mapped npy file instead of in memory
+        self.e_stack = None
+        self.e_stack_filename = None
 
-        for key in cells_manager.cells.keys():
-            if cells_manager.cells[key].channel == "donor":
-                self.donor_cells.append(key)
-            elif cells_manager.cells[key].channel == "wt":
-                self.wt_cells.append(key)
-            elif cells_manager.cells[key].channel == "acceptor":
-                self.acceptor_cells.append(key)
-            elif cells_manager.cells[key].channel == "both":
-                self.both_cells.append(key)
-            elif cells_manager.cells[key].channel == "control":
-                self.control_cells.append(key)
+        # per cell averages used to compute each calibration value, kept so
+        # that the calibration can be saved and pooled with other fields
+        self.cell_averages = OrderedDict()
 
-    def compute_autofluorescence(self, image_manager, cells_manager):
+        # bootstrap confidence interval of the median of each of those
+        self.confidence_intervals = OrderedDict()
+        self.confidence_level = None
 
-        print "Computing Autofluorescense"
+        # pixel values of each region of the cells, see region_pixels
+        self.pixel_cache = {}
 
-        cell_average_donor = []
-        cell_average_acceptor = []
-        cell_average_fret = []
+        # value of each cell of the populations already computed, with the
+        # key of the cell, kept sorted to update the medians cell by cell
+        self.aggregates = {}
+        self.heatmap_pixels = 0
 
-        for key in self.wt_cells:
-            x0, y0, x1, y1 = cells_manager.cells[key].box
-            cell_mask = cells_manager.cells[key].cyto_mask
+    def start_channel_picker(self, image_manager, cells_manager, journal=None,
+                             resume=False):
+        """Opens the CellPicker to classify the cells by hand. If resume is
+        True, the decisions saved in the journal are applied first and only
+        the cells without a channel are shown"""
+        cells_id = cells_manager.cells.keys()
 
-            donor_values = (image_manager.donor_image[x0:x1+1, y0:y1+1] - cells_manager.cells[key].stats["Baseline Donor"]) * cell_mask
-            donor_values = donor_values[np.nonzero(donor_values)]
-            cell_average_donor.append(np.average(donor_values))
+        if resume and journal is not None:
+            apply_assignments(journal.assignments(), cells_manager)
+            cells_id = [k for k in cells_id
+                        if cells_manager.cells[k].channel is None]
 
-            acceptor_values = (image_manager.acceptor_image[x0:x1+1, y0:y1+1] - cells_manager.cells[key].stats["Baseline Acceptor"]) * cell_mask
-            acceptor_values = acceptor_values[np.nonzero(acceptor_values)]
-            cell_average_acceptor.append(np.average(acceptor_values))
+        if len(cells_id) > 0:
+            picker = CellPicker()
+            picker.start_picker(image_manager, cells_manager, cells_id, journal)
 
-            fret_values = (image_manager.fret_image[x0:x1+1, y0:y1+1] - cells_manager.cells[key].stats["Baseline FRET"]) * cell_mask
-            fret_values = fret_values[np.nonzero(fret_values)]
-            cell_average_fret.append(np.average(fret_values))
+        if journal is not None:
+            journal.close()
 
-        self.autofluorescence_donor = np.median(cell_average_donor)
-        self.autofluorescence_acceptor = np.median(cell_average_acceptor)
-        self.autofluorescence_fret = np.median(cell_average_fret)
+        self.collect_channels(cells_manager)
 
-    def compute_ab(self, image_manager, cells_manager):
-        cell_average_a = []
-        cell_average_b = []
+    def load_assignments(self, cells_manager, assignments):
+        """Applies saved picker decisions to the cells, without opening the
+        CellPicker"""
+        apply_assignments(assignments, cells_manager)
 
-        for key in self.acceptor_cells:
-            x0, y0, x1, y1 = cells_manager.cells[key].box
-            cell_mask = cells_manager.cells[key].perim_mask
+        self.collect_channels(cells_manager)
 
-            donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * cell_mask
-            donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-            donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-            nonzero_donor = np.nonzero(donor_cell_image)
+    def classify_channels(self, image_manager, cells_manager, classifier=None,
+                          pick_ambiguous=True):
+        """Assigns the channel and septum of every cell automatically. The
+        cells classified with low confidence are shown in the CellPicker or,
+        if pick_ambiguous is False, left without a channel"""
+        if classifier is None:
+            classifier = CellClassifier()
 
-            acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * cell_mask
-            acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-            acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-            nonzero_acceptor = np.nonzero(acceptor_cell_image)
+        ambiguous = classifier.classify(image_manager, cells_manager)
 
-            fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * cell_mask
-            fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-            fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-            nonzero_fret = np.nonzero(fret_cell_image)
+        if pick_ambiguous and len(ambiguous) > 0:
+            picker = CellPicker()
+            picker.start_picker(image_manager, cells_manager, ambiguous)
+        else:
+            for key in ambiguous:
+                cells_manager.cells[key].channel = None
 
-            a_ix = list(set(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))).intersection(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))))
+        self.collect_channels(cells_manager)
 
-            a_values = []
-            for ix in a_ix:
-                a_values.append(fret_cell_image[ix]/acceptor_cell_image[ix])
+        return ambiguous
 
-            b_ix = list(set(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))).intersection(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))))
+    def collect_channels(self, cells_manager):
+        """Builds the lists of cells of each population from the channel
+        assigned to each cell"""
+        self.control_cells = []
+        self.wt_cells = []
+        self.donor_cells = []
+        self.acceptor_cells = []
+        self.both_cells = []
 
-            b_values = []
-            for ix in b_ix:
-                b_values.append(donor_cell_image[ix]/acceptor_cell_image[ix])
+        for key in cells_manager.cells.keys():
+            if cells_manager.cells[key].channel == "donor":
+                self.donor_cells.append(key)
+            elif cells_manager.cells[key].channel == "wt":
+                self.wt_cells.append(key)
+            elif cells_manager.cells[key].channel == "acceptor":
+                self.acceptor_cells.append(key)
+            elif cells_manager.cells[key].channel == "both":
+                self.both_cells.append(key)
+            elif cells_manager.cells[key].channel == "control":
+                self.control_cells.append(key)
+
+    def population_cells(self, channel):
+        """Returns the list of cells of a population, None for discard or an
+        unknown channel"""
+        return {"wt": self.wt_cells, "donor": self.donor_cells,
+                "acceptor": self.acceptor_cells, "control": self.control_cells,
+                "both": self.both_cells}.get(channel)
+
+    def clear_pixel_cache(self):
+        """Removes the cached pixel values of the cells, needed when the
+        fluorescence images change"""
+        self.pixel_cache = {}
+
+    def region_pixels(self, image_manager, cells_manager, key, region):
+        """Returns the coordinates and the Donor, Acceptor and FRET values of
+        the pixels of a region (cell, perim, cyto or sept) of a cell. The
+        vectors are cached until the mask of the region changes, so that
+        recomputing with other correction factors does not read the images"""
+        mask = getattr(cells_manager.cells[key], region + "_mask")
+        pixels = self.pixel_cache.get((key, region))
+
+        if pixels is not None and pixels["mask"] is mask:
+            return pixels
+
+        x0, y0, x1, y1 = cells_manager.cells[key].box
+        x, y = np.nonzero(mask)
+        x = x + x0
+        y = y + y0
+
+        pixels = {"mask": mask, "x": x, "y": y,
+                  "Donor": image_manager.donor_image[x, y].astype(float_dtype()),
+                  "Acceptor": image_manager.acceptor_image[x, y].astype(float_dtype()),
+                  "FRET": image_manager.fret_image[x, y].astype(float_dtype())}
+        self.pixel_cache[(key, region)] = pixels
+
+        return pixels
+
+    def corrected_signals(self, image_manager, cells_manager, key, region):
+        """Returns the coordinates and the Donor, Acceptor and FRET values of
+        the pixels of a region of a cell, minus the autofluorescence and the
+        baselines of the cell"""
+        stats = cells_manager.cells[key].stats
+        pixels = self.region_pixels(image_manager, cells_manager, key, region)
+
+        donor = pixels["Donor"] - self.autofluorescence_donor - stats["Baseline Donor"]
+        acceptor = pixels["Acceptor"] - self.autofluorescence_acceptor - stats["Baseline Acceptor"]
+        fret = pixels["FRET"] - self.autofluorescence_fret - stats["Baseline FRET"]
+
+        return pixels["x"], pixels["y"], donor, acceptor, fret
+
+    def pixel_signals(self, donor, acceptor, fret):
+        """Returns Iaa, Idd and Fc of pixels from their corrected Donor,
+        Acceptor and FRET values"""
+        Iaa = (self.fret_d * acceptor - self.fret_c * fret) / (self.fret_d - self.fret_c * self.fret_a)
+        Idd = (self.fret_a * donor - self.fret_b * fret) / (self.fret_a - self.fret_b * self.fret_d)
+        Fc = fret - self.fret_a * Iaa - self.fret_d * Idd
+
+        return Iaa, Idd, Fc
+
+    def reset_values(self, names):
+        """Starts new aggregates for the per cell values of a population"""
+        for name in names:
+            self.aggregates[name] = SortedAggregate()
+
+    def set_cell_values(self, key, names, values):
+        """Sets the values of a cell in the aggregates, removing the cell from
+        the aggregates of the values it does not have"""
+        for name in names:
+            if name in values:
+                self.aggregates[name].set(key, values[name])
+            else:
+                self.aggregates[name].remove(key)
+
+    def update_summary(self, names):
+        """Sets the median of each value from its aggregate, and the list of
+        per cell averages used by the calibration and bootstrap. Their
+        confidence intervals are out of date until computed again"""
+        for name in names:
+            setattr(self, SUMMARY_ATTRIBUTES[name], self.aggregates[name].median())
+            self.cell_averages[name] = self.aggregates[name].values()
+            self.confidence_intervals.pop(name, None)
+
+    def cell_autofluorescence(self, image_manager, cells_manager, key):
+        """Returns the average Donor, Acceptor and FRET values of the
+        cytoplasm of a wt cell"""
+        stats = cells_manager.cells[key].stats
+        pixels = self.region_pixels(image_manager, cells_manager, key, "cyto")
+        values = OrderedDict()
+
+        for channel in ["Donor", "Acceptor", "FRET"]:
+            channel_values = pixels[channel] - stats["Baseline " + channel]
+            values["Autofluorescence " + channel] = np.average(
+                channel_values[channel_values != 0])
+
+        return values
+
+    @timed("FRETManager.compute_autofluorescence")
+    def compute_autofluorescence(self, image_manager, cells_manager):
 
-            if cells_manager.cells[key].has_septum:
-                x0, y0, x1, y1 = cells_manager.cells[key].box
-                cell_mask = cells_manager.cells[key].sept_mask
+        print "Computing Autofluorescense"
 
-                donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * cell_mask
-                donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-                donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-                nonzero_donor = np.nonzero(donor_cell_image)
+        names = POPULATION_VALUES["wt"]
+        self.reset_values(names)
 
-                acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * cell_mask
-                acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-                acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-                nonzero_acceptor = np.nonzero(acceptor_cell_image)
+        for key in self.wt_cells:
+            values = self.cell_autofluorescence(image_manager, cells_manager,
+                                                key)
+            self.set_cell_values(key, names, values)
 
-                fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * cell_mask
-                fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-                fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-                nonzero_fret = np.nonzero(fret_cell_image)
+        recorder.count(cells=len(self.wt_cells))
 
-                a_ix = list(set(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))).intersection(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))))
+        self.update_summary(names)
 
-                for ix in a_ix:
-                    a_values.append(fret_cell_image[ix]/acceptor_cell_image[ix])
+    def correction_regions(self, cells_manager, key):
+        """Regions used for the correction factors, the membrane and the
+        septum if it exists"""
+        if cells_manager.cells[key].has_septum:
+            return ["perim", "sept"]
 
-                b_ix = list(set(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))).intersection(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))))
+        return ["perim"]
 
-                for ix in b_ix:
-                    b_values.append(donor_cell_image[ix]/acceptor_cell_image[ix])
+    def cell_ab(self, image_manager, cells_manager, key):
+        """Returns the average a and b of an acceptor cell, if it has pixels
+        with signal"""
+        a_values = []
+        b_values = []
 
-            if len(a_values) > 0:
-                cell_average_a.append(np.average(a_values))
-            if len(b_values) > 0:
-                cell_average_b.append(np.average(b_values))
+        for region in self.correction_regions(cells_manager, key):
+            x, y, donor, acceptor, fret = self.corrected_signals(
+                image_manager, cells_manager, key, region)
 
-        self.fret_a = np.median(cell_average_a)
-        self.fret_b = np.median(cell_average_b)
+            a_ix = (fret > 0) & (acceptor > 0)
+            a_values.append(fret[a_ix] / acceptor[a_ix])
 
-    def compute_cd(self, image_manager, cells_manager):
-        cell_average_c = []
-        cell_average_d = []
+            b_ix = (donor > 0) & (acceptor > 0)
+            b_values.append(donor[b_ix] / acceptor[b_ix])
 
-        for key in self.donor_cells:
-            x0, y0, x1, y1 = cells_manager.cells[key].box
-            cell_mask = cells_manager.cells[key].perim_mask
+        a_values = np.concatenate(a_values)
+        b_values = np.concatenate(b_values)
+        values = OrderedDict()
 
-            donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * cell_mask
-            donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-            donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-            nonzero_donor = np.nonzero(donor_cell_image)
+        if len(a_values) > 0:
+            values["a"] = np.average(a_values)
+        if len(b_values) > 0:
+            values["b"] = np.average(b_values)
 
-            acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * cell_mask
-            acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-            acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-            nonzero_acceptor = np.nonzero(acceptor_cell_image)
+        return values
 
-            fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * cell_mask
-            fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-            fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-            nonzero_fret = np.nonzero(fret_cell_image)
+    @timed("FRETManager.compute_ab")
+    def compute_ab(self, image_manager, cells_manager):
+        names = POPULATION_VALUES["acceptor"]
+        self.reset_values(names)
 
-            c_ix = list(set(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))).intersection(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))))
+        for key in self.acceptor_cells:
+            values = self.cell_ab(image_manager, cells_manager, key)
+            self.set_cell_values(key, names, values)
 
-            c_values = []
-            for ix in c_ix:
-                c_values.append(acceptor_cell_image[ix]/donor_cell_image[ix])
+        recorder.count(cells=len(self.acceptor_cells))
 
-            d_ix = list(set(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))).intersection(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))))
+        self.update_summary(names)
 
-            d_values = []
-            for ix in d_ix:
-                d_values.append(fret_cell_image[ix]/donor_cell_image[ix])
+    def cell_cd(self, image_manager, cells_manager, key):
+        """Returns the average c and d of a donor cell, if it has pixels with
+        signal"""
+        c_values = []
+        d_values = []
 
-            if cells_manager.cells[key].has_septum:
-                x0, y0, x1, y1 = cells_manager.cells[key].box
-                cell_mask = cells_manager.cells[key].sept_mask
+        for region in self.correction_regions(cells_manager, key):
+            x, y, donor, acceptor, fret = self.corrected_signals(
+                image_manager, cells_manager, key, region)
 
-                donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * cell_mask
-                donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-                donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-                nonzero_donor = np.nonzero(donor_cell_image)
+            c_ix = (acceptor > 0) & (donor > 0)
+            c_values.append(acceptor[c_ix] / donor[c_ix])
 
-                acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * cell_mask
-                acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-                acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-                nonzero_acceptor = np.nonzero(acceptor_cell_image)
+            d_ix = (fret > 0) & (donor > 0)
+            d_values.append(fret[d_ix] / donor[d_ix])
 
-                fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * cell_mask
-                fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-                fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-                nonzero_fret = np.nonzero(fret_cell_image)
+        c_values = np.concatenate(c_values)
+        d_values = np.concatenate(d_values)
+        values = OrderedDict()
 
-                c_ix = list(set(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))).intersection(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))))
+        if len(c_values) > 0:
+            values["c"] = np.average(c_values)
+        if len(d_values) > 0:
+            values["d"] = np.average(d_values)
 
-                for ix in c_ix:
-                    c_values.append(acceptor_cell_image[ix]/donor_cell_image[ix])
+        return values
 
-                d_ix = list(set(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))).intersection(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))))
+    @timed("FRETManager.compute_cd")
+    def compute_cd(self, image_manager, cells_manager):
+        names = POPULATION_VALUES["donor"]
+        self.reset_values(names)
 
-                for ix in d_ix:
-                    d_values.append(fret_cell_image[ix]/donor_cell_image[ix])
+        for key in self.donor_cells:
+            values = self.cell_cd(image_manager, cells_manager, key)
+            self.set_cell_values(key, names, values)
 
-            if len(c_values) > 0:
-                cell_average_c.append(np.average(c_values))
-            if len(d_values) > 0:
-                cell_average_d.append(np.average(d_values))
+        recorder.count(cells=len(self.donor_cells))
 
-        self.fret_c = np.median(cell_average_c)
-        self.fret_d = np.median(cell_average_d)
+        self.update_summary(names)
 
     def compute_correction_factors(self, image_manager, cells_manager):
         """autofluorescence is removed px by px using the previous computed average.
@@ -256,258 +390,297 @@ class FRETManager(object):
 
         window.mainloop()
 
+    def cell_g(self, image_manager, cells_manager, key):
+        """Computes the average G of a control cell and sets it in the stats
+        of the cell"""
+        x, y, donor, acceptor, fret = self.corrected_signals(
+            image_manager, cells_manager, key, "cyto")
+
+        # TODO discuss if we shoudld use these pixels anyway
+        nonzero_ix = (donor > 0) & (acceptor > 0) & (fret > 0)
+
+        Iaa, Idd, Fc = self.pixel_signals(donor[nonzero_ix],
+                                          acceptor[nonzero_ix],
+                                          fret[nonzero_ix])
+        g_values = ((1-self.fret_E)*Fc)/(self.fret_E*Idd)
+        values = OrderedDict()
+
+        if len(g_values) > 0:
+            average = np.average(g_values)
+            values["G"] = average
+            cells_manager.cells[key].stats["G"] = average
+        else:
+            cells_manager.cells[key].stats["G"] = 0
+
+        return values
+
+    @timed("FRETManager.compute_g")
     def compute_g(self, image_manager, cells_manager):
         if self.fret_E is None:
             self.get_E_value()
 
-        cell_average_g = []
-
         print "Computing G"
 
+        names = POPULATION_VALUES["control"]
+        self.reset_values(names)
+
         for key in self.control_cells:
-            x0, y0, x1, y1 = cells_manager.cells[key].box
-            cell_mask = cells_manager.cells[key].cyto_mask
-
-            donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * cell_mask
-            donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-            donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-            nonzero_donor = np.nonzero(donor_cell_image)
-
-            acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * cell_mask
-            acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-            acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-            nonzero_acceptor = np.nonzero(acceptor_cell_image)
-
-            fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * cell_mask
-            fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-            fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-            nonzero_fret = np.nonzero(fret_cell_image)
-
-            # TODO discuss if we shoudld use these pixels anyway
-            nonzero_ix = list(set(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))).intersection(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))).intersection(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))))
-
-            g_values = []
-            for ix in nonzero_ix:
-                Iaa = (self.fret_d * acceptor_cell_image[ix] - self.fret_c * fret_cell_image[ix]) / (self.fret_d - self.fret_c * self.fret_a)
-                Idd = (self.fret_a * donor_cell_image[ix] - self.fret_b * fret_cell_image[ix]) / (self.fret_a - self.fret_b * self.fret_d)
-                Fc = fret_cell_image[ix] - self.fret_a * Iaa - self.fret_d * Idd
-                g_value = ((1-self.fret_E)*Fc)/(self.fret_E*Idd)
-                g_values.append(g_value)
-
-            if len(g_values) > 0:
-                average = np.average(g_values)
-                cell_average_g.append(average)
-                cells_manager.cells[key].stats["G"] = average
+            values = self.cell_g(image_manager, cells_manager, key)
+            self.set_cell_values(key, names, values)
+
+        recorder.count(cells=len(self.control_cells))
+
+        self.update_summary(names)
+
+    def create_e_stack(self, shape):
+        """Creates the E stack filled with NaN, in memory or as a memory
+        mapped npy file"""
+        shape = (len(E_LAYERS),) + tuple(shape)
+
+        if self.e_stack_filename is None:
+            self.e_stack = np.empty(shape, dtype=np.float32)
+        else:
+            self.e_stack = open_memmap(self.e_stack_filename, mode="w+",
+                                       dtype=np.float32, shape=shape)
+
+        self.e_stack[:] = np.nan
+
+    def save_e_stack(self, filename):
+        """Saves the E stack as an npy file, that can be opened lazily with
+        np.load(filename, mmap_mode="r"). The layer names are saved in a
+        text file next to it"""
+        if self.e_stack_filename is not None and \
+                os.path.abspath(filename) == os.path.abspath(self.e_stack_filename):
+            self.e_stack.flush()
+        else:
+            stack = open_memmap(filename, mode="w+", dtype=np.float32,
+                                shape=self.e_stack.shape)
+            for layer in range(self.e_stack.shape[0]):
+                stack[layer] = self.e_stack[layer]
+            stack.flush()
+            del stack
+
+        open(os.path.splitext(filename)[0] + "_layers.txt", "w").writelines(
+            [name + "\n" for name in E_LAYERS])
+
+    def region_efficiency(self, image_manager, cells_manager, key, region):
+        """Returns the coordinates, Iaa, Idd, Fc and E of the pixels of a
+        region of a cell with signal in the three channels"""
+        x, y, donor, acceptor, fret = self.corrected_signals(
+            image_manager, cells_manager, key, region)
+
+        # TODO discuss if we shoudld use this pixels anyway
+        nonzero_ix = (donor > 0) & (acceptor > 0) & (fret > 0)
+
+        Iaa, Idd, Fc = self.pixel_signals(donor[nonzero_ix],
+                                          acceptor[nonzero_ix],
+                                          fret[nonzero_ix])
+        e_values = (Fc/self.fret_G) / (Idd+(Fc/self.fret_G))
+
+        return x[nonzero_ix], y[nonzero_ix], Iaa, Idd, Fc, e_values
+
+    def color_heatmap(self, x, y, e_values):
+        """Paints the pixels with E above zero in the heatmap"""
+        ht_ix = e_values > 0
+        min_val = 0
+        max_val = 100
+
+        cm_ix = (((e_values[ht_ix] + np.sqrt(min_val*min_val))*256) / (max_val + np.sqrt(min_val*min_val))).astype(int)
+        self.fret_heatmap[x[ht_ix], y[ht_ix]] = cm.bwr(cm_ix)[:, :3]
+
+        return np.count_nonzero(ht_ix)
+
+    def cell_efficiency(self, image_manager, cells_manager, key):
+        """Computes the E of each region of a both cell, sets it in the stats
+        of the cell, the E stack and the heatmap, and returns the averages"""
+        stats = cells_manager.cells[key].stats
+        layers = dict((name, ix) for ix, name in enumerate(E_LAYERS))
+        values = OrderedDict()
+
+        ###################################################################
+        # Whole Cell Calculations
+        x, y, Iaa, Idd, Fc, e_values = self.region_efficiency(
+            image_manager, cells_manager, key, "cell")
+        self.e_stack[layers["Cell E"], x, y] = e_values
+        self.e_stack[layers["Idd"], x, y] = Idd
+        self.e_stack[layers["Iaa"], x, y] = Iaa
+        self.e_stack[layers["Fc"], x, y] = Fc
+        self.heatmap_pixels += self.color_heatmap(x, y, e_values)
+
+        if len(e_values) > 0:
+            average = np.average(e_values)
+            values["Cell E"] = average
+            stats["Cell E"] = average
+        else:
+            stats["Cell E"] = 0
+
+        ###################################################################
+        # Membrane Calculations
+        x, y, Iaa, Idd, Fc, membrane_e_values = self.region_efficiency(
+            image_manager, cells_manager, key, "perim")
+        self.e_stack[layers["Membrane E"], x, y] = membrane_e_values
+
+        if len(membrane_e_values) > 0:
+            average = np.average(membrane_e_values)
+            values["Membrane E"] = average
+            stats["Membrane E"] = average
+        else:
+            stats["Membrane E"] = 0
+
+        ###################################################################
+        # Cytoplasm Calculations
+        x, y, Iaa, Idd, Fc, cyto_e_values = self.region_efficiency(
+            image_manager, cells_manager, key, "cyto")
+        self.e_stack[layers["Cytoplasm E"], x, y] = cyto_e_values
+
+        if len(cyto_e_values) > 0:
+            average = np.average(cyto_e_values)
+            values["Cytoplasm E"] = average
+            stats["Cytoplasm E"] = average
+        else:
+            stats["Cytoplasm E"] = 0
+
+        ###################################################################
+        # Septum Calculations
+        if cells_manager.cells[key].has_septum:
+            x, y, Iaa, Idd, Fc, septum_e_values = self.region_efficiency(
+                image_manager, cells_manager, key, "sept")
+            self.e_stack[layers["Septum E"], x, y] = septum_e_values
+
+            if len(septum_e_values) > 0:
+                average = np.average(septum_e_values)
+                values["Septum E"] = average
+                stats["Septum E"] = average
             else:
-                cells_manager.cells[key].stats["G"] = 0
+                stats["Septum E"] = 0
 
-        self.fret_G = np.median(cell_average_g)
+            ###################################################################
+            # MembSept Calculations
+            membsept_e_values = np.concatenate((membrane_e_values,
+                                                septum_e_values))
+
+            if len(membsept_e_values) > 0:
+                average = np.average(membsept_e_values)
+                values["MembSept E"] = average
+                stats["MembSept E"] = average
+            else:
+                stats["MembSept E"] = 0
 
+        else:
+            stats["MembSept E"] = 0
+
+        return values
+
+    def clear_cell_efficiency(self, image_manager, cells_manager, key):
+        """Removes the E of a cell from its stats, the E stack and the
+        heatmap"""
+        pixels = self.region_pixels(image_manager, cells_manager, key, "cell")
+        x, y = pixels["x"], pixels["y"]
+
+        self.e_stack[:, x, y] = np.nan
+        phase_values = img_as_float(image_manager.phase_image[x, y])
+        self.fret_heatmap[x, y] = np.repeat(phase_values[:, np.newaxis], 3, axis=1)
+
+        for name in POPULATION_VALUES["both"]:
+            cells_manager.cells[key].stats[name] = 0
+
+    @timed("FRETManager.compute_fret_efficiency")
     def compute_fret_efficiency(self, image_manager, cells_manager):
 
-        heatmap = np.zeros(image_manager.phase_image.shape)
+        self.create_e_stack(image_manager.phase_image.shape)
+        self.fret_heatmap = img_as_float(gray2rgb(image_manager.phase_image))
+        self.heatmap_pixels = 0
 
         print "computing FRET Efficiency"
 
-        cell_average_E = []
-        cyto_average_E = []
-        membrane_average_E = []
-        septum_average_E = []
-        membsept_average_E = []
+        names = POPULATION_VALUES["both"]
+        self.reset_values(names)
 
         for key in self.both_cells:
-            ###################################################################
-            # Whole Cell Calculations
-            x0, y0, x1, y1 = cells_manager.cells[key].box
-            cell_mask = cells_manager.cells[key].cell_mask
-
-            donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * cell_mask
-            donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-            donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-            nonzero_donor = np.nonzero(donor_cell_image)
-
-            acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * cell_mask
-            acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-            acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-            nonzero_acceptor = np.nonzero(acceptor_cell_image)
-
-            fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * cell_mask
-            fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-            fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-            nonzero_fret = np.nonzero(fret_cell_image)
-
-            # TODO discuss if we shoudld use this pixels anyway
-            cell_nonzero_ix = list(set(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))).intersection(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))).intersection(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))))
-
-            e_values = []
-            for ix in cell_nonzero_ix:
-                Iaa = (self.fret_d * acceptor_cell_image[ix] - self.fret_c * fret_cell_image[ix]) / (self.fret_d - self.fret_c * self.fret_a)
-                Idd = (self.fret_a * donor_cell_image[ix] - self.fret_b * fret_cell_image[ix]) / (self.fret_a - self.fret_b * self.fret_d)
-                Fc = fret_cell_image[ix] - self.fret_a * Iaa - self.fret_d * Idd
-
-                e = (Fc/self.fret_G) / (Idd+(Fc/self.fret_G))
-                e_values.append(e)
-                x, y = ix
-                heatmap[x0+x, y0+y] = e
-
-            if len(e_values) > 0:
-                average = np.average(e_values)
-                cell_average_E.append(average)
-                cells_manager.cells[key].stats["Cell E"] = average
-            else:
-                cells_manager.cells[key].stats["Cell E"] = 0
+            values = self.cell_efficiency(image_manager, cells_manager, key)
+            self.set_cell_values(key, names, values)
 
-            ###################################################################
-            # Membrane Calculations
-            cell_mask = cells_manager.cells[key].perim_mask
-
-            donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * cell_mask
-            donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-            donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-            nonzero_donor = np.nonzero(donor_cell_image)
-
-            acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * cell_mask
-            acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-            acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-            nonzero_acceptor = np.nonzero(acceptor_cell_image)
-
-            fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * cell_mask
-            fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-            fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-            nonzero_fret = np.nonzero(fret_cell_image)
-
-            # TODO discuss if we shoudld use this pixels anyway
-            membrane_nonzero_ix = list(set(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))).intersection(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))).intersection(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))))
-
-            membrane_e_values = []
-            for ix in membrane_nonzero_ix:
-                Iaa = (self.fret_d * acceptor_cell_image[ix] - self.fret_c * fret_cell_image[ix]) / (self.fret_d - self.fret_c * self.fret_a)
-                Idd = (self.fret_a * donor_cell_image[ix] - self.fret_b * fret_cell_image[ix]) / (self.fret_a - self.fret_b * self.fret_d)
-                Fc = fret_cell_image[ix] - self.fret_a * Iaa - self.fret_d * Idd
-
-                e = (Fc/self.fret_G) / (Idd+(Fc/self.fret_G))
-                membrane_e_values.append(e)
-                x, y = ix
-
-            if len(membrane_e_values) > 0:
-                average = np.average(membrane_e_values)
-                membrane_average_E.append(average)
-                cells_manager.cells[key].stats["Membrane E"] = average
-            else:
-                cells_manager.cells[key].stats["Membrane E"] = 0
+        recorder.count(cells=len(self.both_cells),
+                       pixels=self.heatmap_pixels)
 
-            ###################################################################
-            # Cytoplasm Calculations
-            cell_mask = cells_manager.cells[key].cyto_mask
-
-            donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * cell_mask
-            donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-            donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-            nonzero_donor = np.nonzero(donor_cell_image)
-
-            acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * cell_mask
-            acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-            acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-            nonzero_acceptor = np.nonzero(acceptor_cell_image)
-
-            fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * cell_mask
-            fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-            fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-            nonzero_fret = np.nonzero(fret_cell_image)
-
-            # TODO discuss if we shoudld use this pixels anyway
-            cyto_nonzero_ix = list(set(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))).intersection(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))).intersection(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))))
-
-            cyto_e_values = []
-            for ix in cyto_nonzero_ix:
-                Iaa = (self.fret_d * acceptor_cell_image[ix] - self.fret_c * fret_cell_image[ix]) / (self.fret_d - self.fret_c * self.fret_a)
-                Idd = (self.fret_a * donor_cell_image[ix] - self.fret_b * fret_cell_image[ix]) / (self.fret_a - self.fret_b * self.fret_d)
-                Fc = fret_cell_image[ix] - self.fret_a * Iaa - self.fret_d * Idd
-
-                e = (Fc/self.fret_G) / (Idd+(Fc/self.fret_G))
-                cyto_e_values.append(e)
-                x, y = ix
-
-            if len(cyto_e_values) > 0:
-                average = np.average(cyto_e_values)
-                cyto_average_E.append(average)
-                cells_manager.cells[key].stats["Cytoplasm E"] = average
-            else:
-                cells_manager.cells[key].stats["Cytoplasm E"] = 0
+        self.update_summary(names)
+        if self.e_stack_filename is not None:
+            self.e_stack.flush()
 
-            ###################################################################
-            # Septum Calculations
-            if cells_manager.cells[key].has_septum:
-                x0, y0, x1, y1 = cells_manager.cells[key].box
-                sept_mask = cells_manager.cells[key].sept_mask
-
-                donor_cell_image = image_manager.donor_image[x0:x1+1, y0:y1+1] * sept_mask
-                donor_cell_image = donor_cell_image - self.autofluorescence_donor - cells_manager.cells[key].stats["Baseline Donor"]
-                donor_cell_image = donor_cell_image * (donor_cell_image > 0)
-                nonzero_donor = np.nonzero(donor_cell_image)
-
-                acceptor_cell_image = image_manager.acceptor_image[x0:x1+1, y0:y1+1] * sept_mask
-                acceptor_cell_image = acceptor_cell_image - self.autofluorescence_acceptor - cells_manager.cells[key].stats["Baseline Acceptor"]
-                acceptor_cell_image = acceptor_cell_image * (acceptor_cell_image > 0)
-                nonzero_acceptor = np.nonzero(acceptor_cell_image)
-
-                fret_cell_image = image_manager.fret_image[x0:x1+1, y0:y1+1] * sept_mask
-                fret_cell_image = fret_cell_image - self.autofluorescence_fret - cells_manager.cells[key].stats["Baseline FRET"]
-                fret_cell_image = fret_cell_image * (fret_cell_image > 0)
-                nonzero_fret = np.nonzero(fret_cell_image)
-
-                # TODO discuss if we shoudld use this pixels anyway
-                septum_nonzero_ix = list(set(zip(list(nonzero_acceptor[0]), list(nonzero_acceptor[1]))).intersection(zip(list(nonzero_donor[0]), list(nonzero_donor[1]))).intersection(zip(list(nonzero_fret[0]), list(nonzero_fret[1]))))
-
-                septum_e_values = []
-                for ix in septum_nonzero_ix:
-                    Iaa = (self.fret_d * acceptor_cell_image[ix] - self.fret_c * fret_cell_image[ix]) / (self.fret_d - self.fret_c * self.fret_a)
-                    Idd = (self.fret_a * donor_cell_image[ix] - self.fret_b * fret_cell_image[ix]) / (self.fret_a - self.fret_b * self.fret_d)
-                    Fc = fret_cell_image[ix] - self.fret_a * Iaa - self.fret_d * Idd
-
-                    e = (Fc/self.fret_G) / (Idd+(Fc/self.fret_G))
-                    septum_e_values.append(e)
-
-                if len(septum_e_values) > 0:
-                    average = np.average(septum_e_values)
-                    septum_average_E.append(average)
-                    cells_manager.cells[key].stats["Septum E"] = average
-                else:
-                    cells_manager.cells[key].stats["Septum E"] = 0
-
-                ###################################################################
-                # MembSept Calculations
-
-                membsept_e_values = []
-                membsept_e_values.extend(membrane_e_values)
-                membsept_e_values.extend(septum_e_values)
-
-                if len(membsept_e_values) > 0:
-                    average = np.average(membsept_e_values)
-                    membsept_average_E.append(average)
-                    cells_manager.cells[key].stats["MembSept E"] = average
-                else:
-                    cells_manager.cells[key].stats["MembSept E"] = 0
+    def population_computed(self, channel):
+        """True if the values of a population were already computed"""
+        return channel in POPULATION_VALUES and \
+            POPULATION_VALUES[channel][0] in self.aggregates
+
+    def remove_cell(self, image_manager, cells_manager, key, channel):
+        """Removes a cell from a population, updating the summary of the
+        population if it was already computed"""
+        population = self.population_cells(channel)
+        if population is None or key not in population:
+            return
+
+        population.remove(key)
+
+        if self.population_computed(channel):
+            for name in POPULATION_VALUES[channel]:
+                self.aggregates[name].remove(key)
+
+            if channel == "both":
+                self.clear_cell_efficiency(image_manager, cells_manager, key)
+            elif channel == "control":
+                cells_manager.cells[key].stats["G"] = 0
 
+            self.update_summary(POPULATION_VALUES[channel])
+
+    def add_cell(self, image_manager, cells_manager, key, channel):
+        """Adds a cell to a population, computing its values and updating the
+        summary of the population if it was already computed"""
+        population = self.population_cells(channel)
+        if population is None or key in population:
+            return
+
+        population.append(key)
+
+        if self.population_computed(channel):
+            if channel == "wt":
+                values = self.cell_autofluorescence(image_manager, cells_manager, key)
+            elif channel == "acceptor":
+                values = self.cell_ab(image_manager, cells_manager, key)
+            elif channel == "donor":
+                values = self.cell_cd(image_manager, cells_manager, key)
+            elif channel == "control":
+                values = self.cell_g(image_manager, cells_manager, key)
             else:
-                cells_manager.cells[key].stats["MembSept E"] = 0
-
-            phase_img = image_manager.phase_image
-            phase_img = img_as_float(gray2rgb(phase_img))
-
-            ht_ix = np.nonzero(heatmap > 0)
-            ht_ix = zip(list(ht_ix[0]), list(ht_ix[1]))
-            min_val = 0
-            max_val = 100
-
-            for ix in ht_ix:
-                cm_ix = int(((heatmap[ix] + np.sqrt(min_val*min_val))*256) / (max_val + np.sqrt(min_val*min_val)))
-                color = np.array(cm.bwr(cm_ix)[:3])
-                phase_img[ix] = color
-
-        self.cell_E = np.median(cell_average_E)
-        self.cyto_E = np.median(cyto_average_E)
-        self.membrane_E = np.median(membrane_average_E)
-        self.membsept_E = np.median(membsept_average_E)
-        self.septum_E = np.median(septum_average_E)
-        self.fret_heatmap = phase_img
+                values = self.cell_efficiency(image_manager, cells_manager, key)
+
+            self.set_cell_values(key, POPULATION_VALUES[channel], values)
+            self.update_summary(POPULATION_VALUES[channel])
+
+    def reclassify_cell(self, image_manager, cells_manager, key, channel,
+                        has_septum=None):
+        """Changes the channel, and optionally the septum, of a cell. Only the
+        values of that cell and the summaries of its old and new populations
+        are updated. Values computed from a changed summary (e.g. the E of
+        the both cells after G changes) are only updated by running the
+        compute methods again"""
+        cell = cells_manager.cells[key]
+        self.remove_cell(image_manager, cells_manager, key, cell.channel)
+
+        cell.channel = channel
+        if has_septum is not None:
+            cell.has_septum = has_septum
+            cell.stats["Has Septum"] = int(has_septum)
+
+        self.add_cell(image_manager, cells_manager, key, channel)
+
+    def compute_confidence_intervals(self, n_resamples=2000, alpha=0.05,
+                                     seed=0):
+        """Computes the bootstrap confidence interval of the median of the
+        per cell averages of each calibration value and E"""
+
+        self.confidence_intervals = OrderedDict()
+        self.confidence_level = 1 - alpha
+
+        for name, values in self.cell_averages.items():
+            self.confidence_intervals[name] = median_confidence_interval(
+                values, n_resamples, alpha, seed)
@@ -1,3 +1,5 @@
+import multiprocessing
+import os
 import numpy as np
 import tkFileDialog
 from scipy import ndimage
@@ -6,7 +8,165 @@ from skimage.exposure import rescale_intensity
 from skimage.filters import threshold_adaptive, threshold_isodata
 from skimage.morphology import closing, erosion
 from skimage.io import imread
+from skimage.external.tifffile import TiffFile, imread as tiff_imread
 from skimage.util import img_as_float
+from instrumentation import timed
+from precision import as_float, float_dtype
+
+
+def open_image(path):
+    """Opens an image without reading its pixels when possible: npy files
+    and uncompressed tiffs are returned as read only memory maps in their
+    own dtype, so that only the regions used are read from disk. Other
+    files are read with imread"""
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".npy":
+        return np.load(path, mmap_mode="r")
+
+    elif extension in (".tif", ".tiff"):
+        try:
+            with TiffFile(path) as tiff:
+                return tiff.asarray(memmap=True)
+        except (ValueError, IOError):
+            return tiff_imread(path)
+
+    return imread(path)
+
+
+def read_image(path, lazy=False):
+    if lazy:
+        return open_image(path)
+
+    return imread(path)
+
+
+def odd_block_size(block_size):
+    if block_size % 2 == 0:
+        block_size += 1
+
+    return block_size
+
+
+def local_mean(img, block_size):
+    """Mean of the block_size x block_size neighbourhood of each pixel,
+    with the image reflected at the borders. Computed from a summed area
+    table, so the cost per pixel does not depend on block_size"""
+
+    radius = block_size // 2
+    rows, cols = img.shape
+
+    padded = np.pad(img.astype(float), radius, mode="symmetric")
+    table = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1))
+    table[1:, 1:] = padded.cumsum(axis=0).cumsum(axis=1)
+
+    sums = table[block_size:block_size + rows, block_size:block_size + cols] - \
+        table[:rows, block_size:block_size + cols] - \
+        table[block_size:block_size + rows, :cols] + \
+        table[:rows, :cols]
+
+    return sums / float(block_size * block_size)
+
+
+def threshold_mask(img, params, threshold=None):
+    """Returns the mask of an image before the closing, erosion and filling
+    steps, 0 at the cells. threshold is the Isodata threshold to use instead
+    of computing it from img"""
+
+    base_mask = np.copy(img)
+
+    if params.mask_algorithm == "Isodata":
+        if threshold is None:
+            threshold = threshold_isodata(base_mask)
+        base_mask = img_as_float(base_mask <= threshold)
+
+    elif params.mask_algorithm == "Local Average":
+        # need to invert because threshold_adaptive sets dark parts to 0
+        block_size = odd_block_size(params.mask_blocksize)
+
+        base_mask = 1.0 - threshold_adaptive(base_mask,
+                                             block_size,
+                                             offset=params.mask_offset)
+
+    elif params.mask_algorithm == "Local Mean":
+        # same as Local Average with the mean of a square block instead of
+        # a gaussian, dark parts are cells
+        block_size = odd_block_size(params.mask_blocksize)
+        threshold = local_mean(base_mask, block_size) - params.mask_offset
+
+        base_mask = 1.0 - img_as_float(base_mask > threshold)
+
+    else:
+        print "Not a valid mask algorithm"
+
+    return 1 - base_mask
+
+
+def clean_mask(mask, params):
+    """Removes small spots from the mask and erodes it"""
+
+    closing_matrix = np.ones((int(params.mask_closing),
+                              int(params.mask_closing)))
+
+    if params.mask_closing > 0:
+        # removes small dark spots and then small white spots
+        mask = img_as_float(closing(mask, closing_matrix))
+        mask = 1 - \
+            img_as_float(closing(1 - mask, closing_matrix))
+
+    for f in range(params.mask_dilation):
+        mask = erosion(mask, np.ones((3, 3)))
+
+    return mask
+
+
+def mask_halo(params):
+    """Width of the border each tile needs around it for its mask to be the
+    same as the mask of the whole image: the radius of the Local Average
+    or Local Mean filter plus the reach of the closings and erosions"""
+
+    halo = 4 * int(params.mask_closing) + int(params.mask_dilation) + 1
+
+    if params.mask_algorithm == "Local Average":
+        # threshold_adaptive uses a gaussian truncated at 4 sigma
+        sigma = (odd_block_size(params.mask_blocksize) - 1) / 6.0
+        halo += int(4 * sigma + 0.5)
+    elif params.mask_algorithm == "Local Mean":
+        halo += odd_block_size(params.mask_blocksize) // 2
+
+    return halo
+
+
+def mask_tile(args):
+    """Computes the mask of a tile with its halo. Module level function so
+    that it can be sent to worker processes"""
+
+    img, params, threshold = args
+
+    return clean_mask(threshold_mask(img, params, threshold), params)
+
+
+def stack_pages(stack, channels, position=0):
+    """Returns a dict with a view of the page of each channel of a stack.
+    The channels can be in the first or the last axis of a 3D stack; a 4D
+    stack has the positions in the first axis"""
+
+    if stack.ndim == 4:
+        stack = stack[position]
+
+    if stack.ndim != 3:
+        raise ValueError("Not a multi-channel stack, shape " + str(stack.shape))
+
+    if stack.shape[0] == len(channels):
+        pages = [stack[ix] for ix in range(len(channels))]
+    elif stack.shape[-1] == len(channels):
+        pages = [stack[..., ix] for ix in range(len(channels))]
+    else:
+        raise ValueError("Stack of shape " + str(stack.shape) + " does not have " +
+                         str(len(channels)) + " channels")
+
+    return dict(zip(channels, pages))
 
 
 class ImageManager(object):
@@ -16,110 +176,223 @@ class ImageManager(object):
         self.phase_image = None
         self.clip = None
         self.mask = None
-        self.align_values = None
+        self.align_values = {}
         self.donor_image = None
         self.acceptor_image = None
         self.fret_image = None
 
-    def load_phase_image(self, path=None, border=10):
+        # views of the pages of a stack file, by channel
+        self.stack_pages = {}
+
+        # AlignmentCache shared by the fields of a batch, the setup the
+        # offsets are kept for and the time of the field for the drift
+        # model, the next field of the setup if None
+        self.alignment_cache = None
+        self.alignment_setup = "default"
+        self.acquisition_time = None
+
+    def load_phase_image(self, path=None, border=10, lazy=False):
 
         if path is None:
             image_path = tkFileDialog.askopenfilename(title="Load Phase Image")
         else:
             image_path = path
 
-        img = imread(image_path)
-        img = rgb2gray(img)
-        img = img_as_float(img)
-        img = rescale_intensity(img)
+        self.set_phase_image(read_image(image_path, lazy), border)
+
+    def set_phase_image(self, img, border=10):
+        """Sets the phase image from an array, in memory or memory mapped,
+        and computes the clipping coordinates"""
 
         self.clip = (border, border, img.shape[0]-border, img.shape[1]-border)
 
         x0, y0, x1, y1 = self.clip
 
-        self.phase_image = img[x0:x1, y0:y1]
+        if img.ndim == 2:
+            # only the clipped region is converted to float, rescaled with
+            # the range of the whole image as before
+            in_range = tuple(img_as_float(np.array([np.min(img), np.max(img)],
+                                                   dtype=img.dtype)))
+            img = as_float(img[x0:x1, y0:y1])
+            self.phase_image = rescale_intensity(img, in_range=in_range)
+
+        else:
+            img = rgb2gray(img)
+            img = as_float(img)
+            img = rescale_intensity(img)
+
+            self.phase_image = img[x0:x1, y0:y1]
 
     def compute_mask(self, params):
 
-        base_mask = np.copy(self.phase_image)
+        if 0 < params.mask_tile_size < max(self.phase_image.shape):
+            mask = self.compute_mask_tiled(params)
+        else:
+            mask = clean_mask(threshold_mask(self.phase_image, params), params)
 
-        if params.mask_algorithm == "Isodata":
-            isodata_threshold = threshold_isodata(base_mask)
-            base_mask = img_as_float(base_mask <= isodata_threshold)
+        if params.mask_fill_holes:
+            # mask is inverted
+            mask = 1 - img_as_float(ndimage.binary_fill_holes(1.0 - mask))
 
-        elif params.mask_algorithm == "Local Average":
-            # need to invert because threshold_adaptive sets dark parts to 0
-            block_size = params.mask_blocksize
+        # kept as float, the stages use it arithmetically (1 - mask)
+        self.mask = as_float(mask)
 
-            if block_size % 2 == 0:
-                block_size += 1
+    def mask_tiles(self, size):
+        """Returns the (x0, y0, x1, y1) limits of the tiles of the phase
+        image"""
+        rows, cols = self.phase_image.shape
 
-            base_mask = 1.0 - threshold_adaptive(base_mask,
-                                                 block_size,
-                                                 offset=params.mask_offset)
+        return [(x, y, min(x + size, rows), min(y + size, cols))
+                for x in range(0, rows, size) for y in range(0, cols, size)]
 
-        else:
-            print "Not a valid mask algorithm"
+    def compute_mask_tiled(self, params):
+        """Computes the mask in tiles of mask_tile_size pixels, each with a
+        halo wide enough for the result to be identical to the mask of the
+        whole image. The tiles run in parallel in mask_workers processes,
+        limited so that the tiles in memory fit in mask_memory_budget MB.
+        Filling the holes is not local and is done on the whole mask"""
 
-        base_mask = 1 - base_mask
+        img = self.phase_image
+        rows, cols = img.shape
+        halo = mask_halo(params)
+        tiles = self.mask_tiles(params.mask_tile_size)
 
-        mask = np.copy(base_mask)
-        closing_matrix = np.ones((int(params.mask_closing),
-                                  int(params.mask_closing)))
+        # the Isodata threshold is computed from the whole image
+        threshold = None
+        if params.mask_algorithm == "Isodata":
+            threshold = threshold_isodata(img)
+
+        # each tile uses about 8 float arrays of the size of tile and halo
+        tile_bytes = 8 * 8 * (params.mask_tile_size + 2 * halo) ** 2
+        workers = params.mask_workers
+        if workers <= 0:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(tiles),
+                             int(params.mask_memory_budget * 1024 ** 2 / tile_bytes)))
+
+        mask = np.empty(img.shape, dtype=float_dtype())
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+
+        try:
+            for start in range(0, len(tiles), workers):
+                batch = []
+                for x0, y0, x1, y1 in tiles[start:start + workers]:
+                    hx0, hy0 = max(x0 - halo, 0), max(y0 - halo, 0)
+                    hx1, hy1 = min(x1 + halo, rows), min(y1 + halo, cols)
+                    batch.append((img[hx0:hx1, hy0:hy1], params, threshold))
+
+                if pool is None:
+                    results = map(mask_tile, batch)
+                else:
+                    results = pool.map(mask_tile, batch)
+
+                for (x0, y0, x1, y1), result in zip(tiles[start:start + workers],
+                                                    results):
+                    hx0, hy0 = max(x0 - halo, 0), max(y0 - halo, 0)
+                    mask[x0:x1, y0:y1] = result[x0 - hx0:x1 - hx0,
+                                                y0 - hy0:y1 - hy0]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        return mask
+
+    @timed("ImageManager.align_image")
+    def align_image(self, img, params, channel=None):
+        """Returns the (dx, dy) offset of a fluorescence image that best
+        overlaps the cells of the mask. With an alignment cache, the offset
+        predicted for the channel is used if it scores better than its
+        neighbours, and the full search is only run when it does not"""
+
+        if not params.auto_align:
+            return (params.x_align, params.y_align)
 
-        if params.mask_closing > 0:
-            # removes small dark spots and then small white spots
-            mask = img_as_float(closing(mask, closing_matrix))
-            mask = 1 - \
-                img_as_float(closing(1 - mask, closing_matrix))
+        inverted_mask = 1 - self.mask
+        width = params.border
+        cache = self.alignment_cache
 
-        for f in range(params.mask_dilation):
-            mask = erosion(mask, np.ones((3, 3)))
+        if cache is None or channel is None:
+            return self.search_alignment(inverted_mask, img, width)
 
-        if params.mask_fill_holes:
-            # mask is inverted
-            mask = 1 - img_as_float(ndimage.binary_fill_holes(1.0 - mask))
+        setup = self.alignment_setup
+        time = self.acquisition_time
+        if time is None:
+            time = cache.next_time(setup, channel)
 
-        self.mask = mask
+        predicted = cache.predict(setup, channel, time)
+        if predicted is not None and not cache.refresh_due(setup, channel) and \
+           self.check_alignment(inverted_mask, img, width, predicted):
+            cache.add(setup, channel, time, predicted, False)
+            return predicted
 
-    def align_image(self, img, params):
+        best = self.search_alignment(inverted_mask, img, width)
+        cache.add(setup, channel, time, best, True)
 
-        inverted_mask = 1 - self.mask
+        return best
 
-        best = (0, 0)
+    def alignment_score(self, inverted_mask, img, dx, dy):
         x0, y0, x1, y1 = self.clip
 
-        if params.auto_align:
-            minscore = 0
-            width = params.border
-            for dx in range(-width, width):
-                for dy in range(-width, width):
-                    tot = -np.sum(np.multiply(inverted_mask,
-                                              img[x0 + dx:x1 + dx,
-                                                  y0 + dy:y1 + dy]))
+        return -np.sum(np.multiply(inverted_mask,
+                                   img[x0 + dx:x1 + dx, y0 + dy:y1 + dy]))
 
-                    if tot < minscore:
-                        minscore = tot
-                        best = (dx, dy)
+    def search_alignment(self, inverted_mask, img, width):
+        """Scores every offset up to width pixels and returns the best"""
 
-        else:
-            best = (params.x_align, params.y_align)
+        best = (0, 0)
+        minscore = 0
+        for dx in range(-width, width):
+            for dy in range(-width, width):
+                tot = self.alignment_score(inverted_mask, img, dx, dy)
+
+                if tot < minscore:
+                    minscore = tot
+                    best = (dx, dy)
 
         return best
 
-    def load_fluor_image(self, channel, params, path=None):
+    def check_alignment(self, inverted_mask, img, width, offset):
+        """Cheap check of a predicted offset: True if it is inside the search
+        range and no neighbour offset scores better"""
 
-        x0, y0, x1, y1 = self.clip
+        dx, dy = offset
+        if not (-width <= dx < width and -width <= dy < width):
+            return False
+
+        score = self.alignment_score(inverted_mask, img, dx, dy)
+        for nx in range(max(dx - 1, -width), min(dx + 2, width)):
+            for ny in range(max(dy - 1, -width), min(dy + 2, width)):
+                if (nx, ny) != (dx, dy) and \
+                   self.alignment_score(inverted_mask, img, nx, ny) < score:
+                    return False
+
+        return True
+
+    def load_fluor_image(self, channel, params, path=None):
 
         if path is None:
             image_path = tkFileDialog.askopenfilename(title="Load " + channel + " Image")
         else:
             image_path = path
 
-        img = imread(image_path)
-        img = rgb2gray(img)
+        self.set_fluor_image(channel, read_image(image_path, params.lazy_images),
+                             params)
+
+    def set_fluor_image(self, channel, img, params):
+        """Sets a fluorescence channel from an array, in memory or memory
+        mapped, aligned with the phase image. Single channel images are kept
+        in their own dtype and only the clipped view is stored"""
+
+        x0, y0, x1, y1 = self.clip
+
+        if img.ndim > 2:
+            img = rgb2gray(img)
 
-        dx, dy = self.align_image(img, params)
+        dx, dy = self.align_image(img, params, channel)
+        self.align_values[channel] = (dx, dy)
 
         if channel == "Donor":
             self.donor_image = img[x0 + dx:x1 + dx, y0 + dy:y1 + dy]
@@ -132,3 +405,32 @@ class ImageManager(object):
 
         else:
             print "Not a valid channel name"
+
+    def load_stack(self, params, path=None, position=0):
+        """Reads a multi-page or multi-channel tiff once, keeps a view of the
+        page of each channel, ordered as in params.stack_channels, and sets
+        the phase image. Files with several positions have them in the first
+        axis, position selects one. The fluorescence channels are set with
+        set_stack_fluor_images after the mask is computed"""
+
+        if path is None:
+            image_path = tkFileDialog.askopenfilename(title="Load Image Stack")
+        else:
+            image_path = path
+
+        if params.lazy_images:
+            stack = open_image(image_path)
+        else:
+            stack = tiff_imread(image_path)
+
+        self.stack_pages = stack_pages(stack,
+                                       params.stack_channels, position)
+
+        self.set_phase_image(self.stack_pages["Phase"], params.border)
+
+    def set_stack_fluor_images(self, params):
+        """Sets the Donor, Acceptor and FRET images from the pages of the
+        stack, aligned with the phase image"""
+
+        for channel in ["Donor", "Acceptor", "FRET"]:
+            self.set_fluor_image(channel, self.stack_pages[channel], params)
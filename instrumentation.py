@@ -0,0 +1,159 @@
+"""Module used to record the wall time, cpu time, memory and number of items
+processed by each stage of the pipeline and by the most expensive functions.
+Recording is disabled by default and the decorated functions only pay for
+a flag check until it is enabled"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, memory is not recorded
+    resource = None
+
+
+def peak_rss():
+    """Returns the peak resident set size of the process in kilobytes"""
+
+    if resource is None:
+        return 0
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Instrumentation(object):
+    """Keeps the records of the current run. Each record is a dict with the
+    name of the stage, its start time, wall and cpu time in seconds, the
+    increase of the peak rss in kilobytes and the item counts"""
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.stack = []
+        self.run_start = None
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.records = []
+        self.stack = []
+        self.run_start = time.time()
+
+    def start(self, name):
+        record = OrderedDict([("name", name),
+                              ("depth", len(self.stack)),
+                              ("start", time.time() - self.run_start),
+                              ("wall", 0.0),
+                              ("cpu", 0.0),
+                              ("rss_delta", 0),
+                              ("counts", OrderedDict())])
+        self.records.append(record)
+        self.stack.append((record, time.time(), cpu_time(), peak_rss()))
+
+    def stop(self):
+        record, wall, cpu, rss = self.stack.pop()
+        record["wall"] = time.time() - wall
+        record["cpu"] = cpu_time() - cpu
+        record["rss_delta"] = peak_rss() - rss
+
+    def count(self, **counts):
+        """Adds item counts (cells, pixels, merges, septa...) to the record of
+        the stage currently running"""
+
+        if not self.enabled or len(self.stack) == 0:
+            return
+
+        record_counts = self.stack[-1][0]["counts"]
+        for name, value in counts.iteritems():
+            record_counts[name] = record_counts.get(name, 0) + int(value)
+
+    def summary(self):
+        """Returns the records aggregated by name, with the number of calls
+        and the total times and counts"""
+
+        summary = OrderedDict()
+
+        for record in self.records:
+            if record["name"] not in summary:
+                summary[record["name"]] = OrderedDict([("calls", 0),
+                                                       ("wall", 0.0),
+                                                       ("cpu", 0.0),
+                                                       ("rss_delta", 0),
+                                                       ("counts", OrderedDict())])
+            total = summary[record["name"]]
+            total["calls"] += 1
+            total["wall"] += record["wall"]
+            total["cpu"] += record["cpu"]
+            total["rss_delta"] += record["rss_delta"]
+            for name, value in record["counts"].iteritems():
+                total["counts"][name] = total["counts"].get(name, 0) + value
+
+        return summary
+
+    def run_record(self):
+        return OrderedDict([("summary", self.summary()),
+                            ("records", self.records)])
+
+    def save_json(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.run_record(), f, indent=2)
+
+    def save_chrome_trace(self, filename):
+        """Saves the records in the trace event format, which can be opened
+        in chrome://tracing or perfetto"""
+
+        events = []
+        pid = os.getpid()
+
+        for record in self.records:
+            args = OrderedDict(record["counts"])
+            args["cpu"] = record["cpu"]
+            args["rss_delta"] = record["rss_delta"]
+            events.append(OrderedDict([("name", record["name"]),
+                                       ("ph", "X"),
+                                       ("ts", record["start"] * 1e6),
+                                       ("dur", record["wall"] * 1e6),
+                                       ("pid", pid),
+                                       ("tid", 0),
+                                       ("args", args)]))
+
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events}, f)
+
+
+recorder = Instrumentation()
+
+
+def timed(name):
+    """Decorator that records each call of the function as a stage"""
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return func(*args, **kwargs)
+
+            recorder.start(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.stop()
+
+        return wrapper
+
+    return decorator
@@ -67,10 +67,10 @@ class MaskParameters(object):
         # if true, phase will be inverted.
         # Useful when using fluorescence or light on dark background
 
-        self.mask_algorithms = ['Local Average', 'Isodata']
+        self.mask_algorithms = ['Local Average', 'Isodata', 'Local Mean']
         self.mask_algorithm = 'Isodata'
 
-        # used for local average algorithm
+        # used for local average and local mean algorithms
         self.mask_blocksize = 151  # block size for moving average
         self.mask_offset = 0.02    # offset for moving average
 
@@ -87,6 +87,22 @@ class MaskParameters(object):
         self.x_align = 0
         self.y_align = 0
 
+        # tiled mask computation, for large images. 0 computes the mask of
+        # the whole image at once
+        self.mask_tile_size = 0
+        self.mask_workers = 0  # 0 uses every cpu
+        self.mask_memory_budget = 1024  # MB used by the tiles in memory
+
+        # order of the channels in the pages of a multi-channel stack file
+        self.stack_channels = ["Phase", "Donor", "Acceptor", "FRET"]
+
+        # memory maps npy and uncompressed tiff inputs instead of reading them
+        self.lazy_images = False
+
+        # float type of the images, masks and FRET computations,
+        # "float32" or "float64"
+        self.compute_precision = "float64"
+
     def load_from_parser(self, parser, section):
         """Loads frame parameters from a ConfigParser object of the
         configuration file. The section parameters specifies the configuration
@@ -104,6 +120,21 @@ class MaskParameters(object):
         self.x_align = int(parser.get(section, "x align"))
         self.y_align = int(parser.get(section, "y align"))
 
+        # options added after the first version of the configuration file
+        if parser.has_option(section, "mask tile size"):
+            self.mask_tile_size = int(parser.get(section, "mask tile size"))
+        if parser.has_option(section, "mask workers"):
+            self.mask_workers = int(parser.get(section, "mask workers"))
+        if parser.has_option(section, "mask memory budget"):
+            self.mask_memory_budget = int(parser.get(section, "mask memory budget"))
+        if parser.has_option(section, "stack channels"):
+            self.stack_channels = [c.strip() for c in
+                                   parser.get(section, "stack channels").split(",")]
+        if parser.has_option(section, "lazy images"):
+            self.lazy_images = check_bool(parser.get(section, "lazy images"))
+        if parser.has_option(section, "compute precision"):
+            self.compute_precision = parser.get(section, "compute precision")
+
     def save_to_parser(self, parser, section):
         """Saves mask parameters to a ConfigParser object of the
         configuration file. It creates the section if it does not
@@ -124,6 +155,12 @@ class MaskParameters(object):
         parser.set(section, "auto align", self.auto_align)
         parser.set(section, "x align", self.x_align)
         parser.set(section, "y align", self.y_align)
+        parser.set(section, "mask tile size", self.mask_tile_size)
+        parser.set(section, "mask workers", self.mask_workers)
+        parser.set(section, "mask memory budget", self.mask_memory_budget)
+        parser.set(section, "stack channels", ", ".join(self.stack_channels))
+        parser.set(section, "lazy images", self.lazy_images)
+        parser.set(section, "compute precision", self.compute_precision)
 
 
 class RegionParameters(object):
@@ -141,6 +178,11 @@ class RegionParameters(object):
         self.outline_use_base_mask = False
         # assign fixed height to all in base mask
 
+        # time-lapse frames seeded from the labels of the previous frame
+        self.warm_start = False
+        self.warm_start_overlap = 0.8
+        self.warm_start_erosion = 2
+
     def load_from_parser(self, parser, section):
         """Loads frame parameters from a ConfigParser object of the
         configuration file. The section parameters specifies the
@@ -154,6 +196,12 @@ class RegionParameters(object):
         self.max_peaks = int(parser.get(section, "max peaks"))
         self.outline_use_base_mask = check_bool(parser.get(section,
                                                 "outline use base mask"))
+        if parser.has_option(section, "warm start"):
+            self.warm_start = check_bool(parser.get(section, "warm start"))
+        if parser.has_option(section, "warm start overlap"):
+            self.warm_start_overlap = float(parser.get(section, "warm start overlap"))
+        if parser.has_option(section, "warm start erosion"):
+            self.warm_start_erosion = int(parser.get(section, "warm start erosion"))
 
     def save_to_parser(self, parser, section):
         """Saves mask parameters to a ConfigParser object of the configuration
@@ -169,6 +217,9 @@ class RegionParameters(object):
         parser.set(section, "max peaks", self.max_peaks)
         parser.set(section, "outline use base mask",
                    self.outline_use_base_mask)
+        parser.set(section, "warm start", self.warm_start)
+        parser.set(section, "warm start overlap", self.warm_start_overlap)
+        parser.set(section, "warm start erosion", self.warm_start_erosion)
 
 
 class CellParameters(object):
@@ -201,6 +252,12 @@ class CellParameters(object):
         # display
         self.cell_colors = 10
 
+        # time-lapse tracking: fraction of a cell that must overlap its
+        # cell in the previous frame, and the largest distance of the
+        # centroids of a cell and its match when they do not overlap
+        self.track_min_overlap = 0.3
+        self.track_max_distance = 20
+
     def process_filters(self, text):
         filters = []
         if len(text.split(")")) > 1:
@@ -238,6 +295,10 @@ class CellParameters(object):
         self.remove_background = check_bool(parser.get(section, "remove background"))
         self.baseline_margin = int(parser.get(section, "baseline margin"))
         self.cell_colors = int(parser.get(section, "cell colors"))
+        if parser.has_option(section, "track min overlap"):
+            self.track_min_overlap = float(parser.get(section, "track min overlap"))
+        if parser.has_option(section, "track max distance"):
+            self.track_max_distance = float(parser.get(section, "track max distance"))
 
     def save_to_parser(self, parser, section):
         """Saves mask parameters to a ConfigParser object of the configuration
@@ -261,3 +322,5 @@ class CellParameters(object):
         parser.set(section, "remove background", self.remove_background)
         parser.set(section, "baseline margin", self.baseline_margin)
         parser.set(section, "cell colors", self.cell_colors)
+        parser.set(section, "track min overlap", self.track_min_overlap)
+        parser.set(section, "track max distance", self.track_max_distance)
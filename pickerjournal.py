@@ -0,0 +1,87 @@
+"""Module used to save the channel assignments made in the CellPicker as they
+are made, so that picking can be resumed after the window is closed or the
+process crashes, and to replay saved assignments without any GUI"""
+
+import os
+from collections import OrderedDict
+
+
+class PickerJournal(object):
+    """Append-only journal of picker decisions. Each line has the field, the
+    cell label, the channel and whether the cell has septum, separated by
+    tabs. When a cell is picked more than once the last line wins"""
+
+    def __init__(self, path, field):
+        self.path = path
+        self.field = str(field)
+        self.journal_file = None
+
+    def record(self, label, channel, has_septum):
+        """Appends a decision and forces it to disk"""
+
+        if self.journal_file is None:
+            self.journal_file = open(self.path, "a+")
+            # a line cut by a crash must not be joined with the next one
+            self.journal_file.seek(0, os.SEEK_END)
+            if self.journal_file.tell() > 0:
+                self.journal_file.seek(-1, os.SEEK_END)
+                last = self.journal_file.read(1)
+                self.journal_file.seek(0, os.SEEK_END)
+                if last != "\n":
+                    self.journal_file.write("\n")
+
+        self.journal_file.write("\t".join([self.field, str(int(label)),
+                                           channel, str(bool(has_septum))]) + "\n")
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+    def close(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+
+    def assignments(self):
+        """Returns the decisions saved for the field of this journal"""
+
+        return load_assignments(self.path, self.field)
+
+
+def load_assignments(path, field=None):
+    """Reads a journal and returns an OrderedDict of cell label (as a string)
+    to (channel, has_septum). If field is None, the lines of every field are
+    used"""
+
+    assignments = OrderedDict()
+
+    if not os.path.exists(path):
+        return assignments
+
+    for line in open(path, "r"):
+        values = line.rstrip("\n").split("\t")
+
+        # skips comments and lines cut by a crash while being written
+        if line.startswith("#") or len(values) != 4:
+            continue
+
+        line_field, label, channel, has_septum = values
+        if field is None or line_field == str(field):
+            assignments[label] = (channel, has_septum == "True")
+
+    return assignments
+
+
+def apply_assignments(assignments, cells_manager):
+    """Sets the channel and septum of the cells from saved assignments.
+    Returns the number of cells that were assigned"""
+
+    count = 0
+
+    for label, (channel, has_septum) in assignments.items():
+        if label in cells_manager.cells:
+            cell = cells_manager.cells[label]
+            cell.channel = channel
+            cell.has_septum = has_septum
+            cell.stats["Has Septum"] = int(has_septum)
+            count += 1
+
+    return count
@@ -0,0 +1,38 @@
+"""Module holding the float precision of the pipeline. float64 gives the
+same results as always; float32 halves the memory used by the phase image,
+the masks and the pixel vectors of the FRET computations, with E values
+within a small tolerance of the float64 ones"""
+
+import numpy as np
+from skimage.util import img_as_float
+
+PRECISIONS = {"float32": np.float32, "float64": np.float64}
+
+FLOAT_DTYPE = np.float64
+
+
+def set_precision(name):
+    """Sets the float type used from now on, "float32" or "float64" """
+
+    global FLOAT_DTYPE
+
+    if name not in PRECISIONS:
+        raise ValueError("Not a valid precision: " + str(name))
+
+    FLOAT_DTYPE = PRECISIONS[name]
+
+
+def float_dtype():
+    return FLOAT_DTYPE
+
+
+def as_float(img):
+    """Returns the image as a float array of the current precision, scaled
+    as img_as_float does, without a copy if it already is one"""
+
+    img = np.asarray(img)
+
+    if img.dtype == bool:
+        return img.astype(FLOAT_DTYPE)
+
+    return img_as_float(img).astype(FLOAT_DTYPE, copy=False)
@@ -10,6 +10,18 @@ class ReportsManager(object):
     def __init__(self, parameters):
         self.keys = cp.stats_format(parameters.cellprocessingparams)
 
+    def value_text(self, fret_manager, value, name):
+        """Returns the value followed by its bootstrap confidence interval,
+        if it was computed"""
+        text = str(value)
+
+        if name in fret_manager.confidence_intervals:
+            low, high = fret_manager.confidence_intervals[name]
+            text += " (" + str(int(round(100 * fret_manager.confidence_level))) + \
+                "% CI: " + str(low) + " - " + str(high) + ")"
+
+        return text
+
     def generate_report_experiment(self, image_manager, cells_manager, fret_manager, path):
         cells = cells_manager.cells
 
@@ -42,33 +54,33 @@ class ReportsManager(object):
 
         report = [HTML_HEADER]
 
-        g_report = "<h2>Average G value: " + str(g_value) + "</h2>"
+        g_report = "<h2>Average G value: " + self.value_text(fret_manager, g_value, "G") + "</h2>"
         report.extend(g_report)
-        cell_e_report = "<h2>Average Cell E value: " + str(cell_e) + "</h2>"
+        cell_e_report = "<h2>Average Cell E value: " + self.value_text(fret_manager, cell_e, "Cell E") + "</h2>"
         report.extend(cell_e_report)
-        membrane_e_report = "<h2>Average Membrane E value: " + str(membrane_e) + "</h2>"
+        membrane_e_report = "<h2>Average Membrane E value: " + self.value_text(fret_manager, membrane_e, "Membrane E") + "</h2>"
         report.extend(membrane_e_report)
-        cyto_e_report = "<h2>Average Cytoplasm E value: " + str(cyto_e) + "</h2>"
+        cyto_e_report = "<h2>Average Cytoplasm E value: " + self.value_text(fret_manager, cyto_e, "Cytoplasm E") + "</h2>"
         report.extend(cyto_e_report)
-        septum_e_report = "<h2>Average Septum E value: " + str(septum_e) + "</h2>"
+        septum_e_report = "<h2>Average Septum E value: " + self.value_text(fret_manager, septum_e, "Septum E") + "</h2>"
         report.extend(septum_e_report)
-        membsept_e_report = "<h2>Average MembSept E value: " + str(membsept_e) + "</h2>"
+        membsept_e_report = "<h2>Average MembSept E value: " + self.value_text(fret_manager, membsept_e, "MembSept E") + "</h2>"
         report.extend(membsept_e_report)
 
-        auto_d_report = "<h2>Average Donor Autofluorescence value: " + str(auto_d) + "</h2>"
+        auto_d_report = "<h2>Average Donor Autofluorescence value: " + self.value_text(fret_manager, auto_d, "Autofluorescence Donor") + "</h2>"
         report.extend(auto_d_report)
-        auto_a_report = "<h2>Average Acceptor Autofluorescence value: " + str(auto_a) + "</h2>"
+        auto_a_report = "<h2>Average Acceptor Autofluorescence value: " + self.value_text(fret_manager, auto_a, "Autofluorescence Acceptor") + "</h2>"
         report.extend(auto_a_report)
-        auto_f_report = "<h2>Average FRET Autofluorescence value: " + str(auto_f) + "</h2>"
+        auto_f_report = "<h2>Average FRET Autofluorescence value: " + self.value_text(fret_manager, auto_f, "Autofluorescence FRET") + "</h2>"
         report.extend(auto_f_report)
 
-        cf_a_report = "<h2>Average a value: " + str(cf_a) + "</h2>"
+        cf_a_report = "<h2>Average a value: " + self.value_text(fret_manager, cf_a, "a") + "</h2>"
         report.extend(cf_a_report)
-        cf_b_report = "<h2>Average b value: " + str(cf_b) + "</h2>"
+        cf_b_report = "<h2>Average b value: " + self.value_text(fret_manager, cf_b, "b") + "</h2>"
         report.extend(cf_b_report)
-        cf_c_report = "<h2>Average c value: " + str(cf_c) + "</h2>"
+        cf_c_report = "<h2>Average c value: " + self.value_text(fret_manager, cf_c, "c") + "</h2>"
         report.extend(cf_c_report)
-        cf_d_report = "<h2>Average d value: " + str(cf_d) + "</h2>"
+        cf_d_report = "<h2>Average d value: " + self.value_text(fret_manager, cf_d, "d") + "</h2>"
         report.extend(cf_d_report)
 
         if len(cells) > 0:
@@ -238,3 +250,5 @@ class ReportsManager(object):
             os.makedirs(path + os.sep + "_discarded_images")
         self.generate_report_experiment(image_manager, cells_manager, fret_manager, path)
         imsave(path + os.sep + "heatmap.png", img_as_int(fret_manager.fret_heatmap))
+        if fret_manager.e_stack is not None:
+            fret_manager.save_e_stack(path + os.sep + "e_stack.npy")
@@ -9,6 +9,7 @@ class SegmentsManager(object):
     def __init__(self):
         self.features = None
         self.labels = None
+        self.distance = None
         self.phase_w_features = None
 
     @staticmethod
@@ -75,6 +76,93 @@ class SegmentsManager(object):
 
         self.features = features
 
+    @staticmethod
+    def warm_start_markers(previous_labels, foreground, params):
+        """Returns the markers kept from the labels of the previous frame:
+        each label eroded by warm_start_erosion pixels and cut to the
+        current foreground, with its previous label. Labels with less than
+        warm_start_overlap of their pixels in the foreground, or whose
+        marker is split in several parts, e.g. by a division, are dropped"""
+
+        size = 2 * params.warm_start_erosion + 1
+        eroded = (ndimage.minimum_filter(previous_labels, size) ==
+                  ndimage.maximum_filter(previous_labels, size))
+        markers = np.where(eroded & foreground, previous_labels, 0)
+
+        n_labels = np.max(previous_labels) + 1
+        area = np.bincount(previous_labels.ravel(), minlength=n_labels)
+        kept = np.bincount(previous_labels[foreground], minlength=n_labels)
+        overlap = kept / np.maximum(area, 1).astype(float)
+
+        parts, n_parts = ndimage.label(markers > 0)
+        part_labels = np.asarray(ndimage.maximum(markers, parts,
+                                                 range(1, n_parts + 1)), dtype=int)
+        n_marker_parts = np.bincount(part_labels, minlength=n_labels)
+
+        reused = (overlap >= params.warm_start_overlap) & (n_marker_parts == 1)
+        reused[0] = False
+
+        return np.where(reused[markers], markers, 0), reused
+
+    def compute_features_warm(self, params, image_manager, previous_labels):
+        """Computes the features seeded from the labels of the previous
+        frame of a time-lapse. The distance peaks are only searched in the
+        bounding box of the foreground not covered by a reused label. The
+        cells that did not change keep their label and the new features get
+        the lowest labels not reused, so that the labels do not grow from
+        frame to frame"""
+
+        mask = image_manager.mask
+        foreground = mask < 0.5
+
+        self.distance = ndimage.morphology.distance_transform_edt(1 - mask)
+        features, reused = self.warm_start_markers(previous_labels,
+                                                   foreground, params)
+
+        changed = foreground & ~reused[previous_labels]
+        if np.any(changed):
+            # window around the changed pixels, with a margin so that the
+            # peaks of the window are the same as in the whole image
+            margin = params.peak_min_distance
+            rows = np.nonzero(np.any(changed, axis=1))[0]
+            cols = np.nonzero(np.any(changed, axis=0))[0]
+            x0, x1 = max(rows[0] - margin, 0), min(rows[-1] + margin + 1, mask.shape[0])
+            y0, y1 = max(cols[0] - margin, 0), min(cols[-1] + margin + 1, mask.shape[1])
+
+            window = np.where(changed[x0:x1, y0:y1], self.distance[x0:x1, y0:y1], 0)
+            centers = peak_local_max(window, min_distance=params.peak_min_distance,
+                                     threshold_abs=params.peak_min_height,
+                                     exclude_border=True,
+                                     num_peaks=params.max_peaks,
+                                     indices=True)
+
+            minmargin = max(params.peak_min_distance_from_edge, 1)
+            mindist = params.peak_min_distance
+            lx, ly = mask.shape
+            placedmask = np.ones(mask.shape)
+            heights = []
+            circles = []
+
+            for c in centers:
+                x, y = c[0] + x0, c[1] + y0
+
+                if x >= minmargin and y >= minmargin and x <= lx - minmargin \
+                   and y <= ly - minmargin and placedmask[x, y]:
+                    placedmask[x - mindist:x + mindist +
+                               1, y - mindist:y + mindist + 1] = 0
+                    circles.append((x, y))
+                    heights.append(self.distance[x, y])
+
+            n_labels = np.sum(reused) + len(circles)
+            free = np.setdiff1d(np.arange(1, n_labels + 1), np.nonzero(reused)[0])
+            for ix, c in enumerate([circles[i] for i in np.argsort(heights)]):
+                x, y = c
+                for f in range(3):
+                    features[x - 1 + f, y] = free[ix]
+                    features[x, y - 1 + f] = free[ix]
+
+        self.features = features
+
     def overlay_phase_w_features(self, image_manager):
         """Method used to produce an image with an overlay of the features on
         the phase image requires a phase image, the features and the clip
@@ -96,7 +184,9 @@ class SegmentsManager(object):
 
         markers = self.features
         inverted_mask = 1 - image_manager.mask
-        distance = -ndimage.morphology.distance_transform_edt(inverted_mask)
+        if self.distance is None:
+            self.distance = ndimage.morphology.distance_transform_edt(inverted_mask)
+        distance = -self.distance
 
         mindist = np.min(distance)
         markpoints = markers > 0
@@ -105,10 +195,15 @@ class SegmentsManager(object):
 
         self.labels = labels
 
-    def compute_segments(self, params, image_manager):
+    def compute_segments(self, params, image_manager, previous_labels=None):
         """Calls the different methods of the module in the right order.
         Can be used as the interface of this module in the main module of the
-        software"""
-        self.compute_features(params, image_manager)
+        software. If previous_labels, the labels of the previous frame of a
+        time-lapse, are given, the features are seeded from them"""
+        self.distance = None
+        if previous_labels is None:
+            self.compute_features(params, image_manager)
+        else:
+            self.compute_features_warm(params, image_manager, previous_labels)
         self.overlay_phase_w_features(image_manager)
         self.compute_labels(params, image_manager)
@@ -5,6 +5,15 @@ from cellsmanager import CellsManager
 from fretmanager import FRETManager
 from parameters import ParametersManager
 from reportsmanager import ReportsManager
+from instrumentation import recorder, timed
+from pickerjournal import PickerJournal, load_assignments
+from calibration import save_calibration, load_calibration
+from accumulators import CalibrationAccumulator
+from precision import set_precision
+from alignment import AlignmentCache
+from timelapse import TimeLapse, TimeLapseWriter, stack_frames
+from stagecache import StageCache, STAGES, cells_from_arrays, cells_to_arrays, \
+    file_digest, parameters_digest, stage_key
 
 
 class SetManager(object):
@@ -18,25 +27,178 @@ class SetManager(object):
         self.reports_manager = ReportsManager(self.parameters)
         self.control_params = None
         self.working_dir = None
+        self.phase_filename = None
+        self.fluor_filenames = {}
 
+        self.stage_cache = None
+        # (filename, stack position) each channel was loaded from
+        self.input_sources = {}
+        self.input_digests = {}
+        self.cell_edits = []
+
+        self.instrumentation = recorder
+
+    def enable_instrumentation(self):
+        """Starts recording the time and memory of each stage. The records of
+        the run are kept in self.instrumentation"""
+        self.instrumentation.enable()
+
+    def save_instrumentation(self, filename, chrome_trace=False):
+        """Saves the records of the run as json or, if chrome_trace is True,
+        in the trace event format used by chrome://tracing"""
+        if chrome_trace:
+            self.instrumentation.save_chrome_trace(filename)
+        else:
+            self.instrumentation.save_json(filename)
+
+    def enable_alignment_cache(self, filename=None, setup="default",
+                               refresh_interval=20):
+        """Reuses the offsets of the fluorescence channels found in the
+        previous fields of the same acquisition setup. If filename is given,
+        the offsets of earlier runs are loaded from it, and they are saved
+        to it with save_alignment_cache"""
+        self.image_manager.alignment_cache = AlignmentCache(filename, refresh_interval)
+        self.image_manager.alignment_setup = setup
+
+    def save_alignment_cache(self, filename=None):
+        self.image_manager.alignment_cache.save(filename)
+
+    def enable_stage_cache(self, path, max_size=2 * 1024 ** 3):
+        """Stores the output of each stage on disk, so that reprocessing a
+        field resumes from the deepest stage whose inputs and parameters did
+        not change. max_size is the size of the cache in bytes"""
+        self.stage_cache = StageCache(path, max_size)
+
+    def stage_key(self, stage):
+        """Returns the cache key of a stage, computed from the digests of the
+        input images and the parameters of the stage and the previous ones"""
+        if stage == "mask":
+            return stage_key(self.input_digest("Phase"),
+                             parameters_digest(self.parameters.imageloaderparams))
+        elif stage == "segments":
+            return stage_key(self.stage_key("mask"),
+                             parameters_digest(self.parameters.imageprocessingparams))
+        elif stage == "cells":
+            return stage_key(self.stage_key("segments"),
+                             parameters_digest(self.parameters.cellprocessingparams))
+        elif stage == "regions":
+            return stage_key(self.stage_key("cells"),
+                             self.input_digest("Donor"),
+                             self.input_digest("Acceptor"),
+                             self.input_digest("FRET"),
+                             *self.cell_edits)
+
+    def cached_stage(self):
+        """Returns the deepest stage available in the cache for the current
+        images and parameters, or None if nothing can be reused"""
+        if self.stage_cache is None:
+            return None
+
+        keys = dict((stage, self.stage_key(stage)) for stage in STAGES)
+
+        return self.stage_cache.deepest_stage(keys)
+
+    def load_stage(self, stage):
+        if self.stage_cache is None:
+            return None
+
+        return self.stage_cache.load(stage, self.stage_key(stage))
+
+    def save_stage(self, stage, arrays):
+        if self.stage_cache is not None:
+            self.stage_cache.save(stage, self.stage_key(stage), arrays)
+
+    def set_input(self, channel, filename, position=None):
+        """Records the file a channel was loaded from, with its position if
+        it is a stack. The digest is computed when a key first needs it"""
+        self.input_sources[channel] = (filename, position)
+        self.input_digests.pop(channel, None)
+
+    def input_digest(self, channel):
+        """Returns the digest of the image of a channel, or None if it was
+        not loaded"""
+        if channel not in self.input_digests:
+            if channel not in self.input_sources:
+                return None
+
+            filename, position = self.input_sources[channel]
+            if position is None:
+                self.input_digests[channel] = file_digest(filename)
+            else:
+                self.input_digests[channel] = stage_key(
+                    stage_key(file_digest(filename), position), channel)
+
+        return self.input_digests[channel]
+
+    @timed("Load Phase Image")
     def load_phase_image(self, filename=None):
         if filename is None:
             filename = tkFileDialog.askopenfilename(initialdir=self.working_dir)
 
         self.working_dir = "/".join(filename.split("/")[:len(filename.split("/"))-1])
+        self.phase_filename = filename
 
+        set_precision(self.parameters.imageloaderparams.compute_precision)
         self.image_manager.load_phase_image(filename,
-                                            self.parameters.imageloaderparams.border)
+                                            self.parameters.imageloaderparams.border,
+                                            self.parameters.imageloaderparams.lazy_images)
+        self.set_input("Phase", filename)
+
+        recorder.count(pixels=self.image_manager.phase_image.size)
 
         print "Phase Image Loaded"
 
+    @timed("Load Image Stack")
+    def load_stack(self, filename=None, position=0):
+        """Loads the phase image from a multi-channel stack file, read only
+        once. After compute_mask, load_stack_fluor_images sets the
+        fluorescence channels from the same file"""
+        if filename is None:
+            filename = tkFileDialog.askopenfilename(initialdir=self.working_dir)
+
+        self.working_dir = "/".join(filename.split("/")[:len(filename.split("/"))-1])
+        self.phase_filename = filename
+
+        set_precision(self.parameters.imageloaderparams.compute_precision)
+        self.image_manager.load_stack(self.parameters.imageloaderparams,
+                                      filename, position)
+
+        for channel in ["Phase", "Donor", "Acceptor", "FRET"]:
+            self.set_input(channel, filename, position)
+
+        recorder.count(pixels=self.image_manager.phase_image.size)
+
+        print "Image Stack Loaded"
+
+    @timed("Load Stack Fluor Images")
+    def load_stack_fluor_images(self):
+        """Sets the Donor, Acceptor and FRET images from the stack loaded
+        with load_stack"""
+        self.image_manager.set_stack_fluor_images(self.parameters.imageloaderparams)
+        for channel in ["Donor", "Acceptor", "FRET"]:
+            self.fluor_filenames[channel] = self.phase_filename
+        self.fret_manager.clear_pixel_cache()
+
+        print "Fluor Images Loaded"
+
+    @timed("Compute Mask")
     def compute_mask(self):
         """Calls the compute_mask method from image_manager."""
 
-        self.image_manager.compute_mask(self.parameters.imageloaderparams)
+        arrays = self.load_stage("mask")
+
+        if arrays is not None:
+            self.image_manager.mask = arrays["mask"]
+            print "Mask Loaded From Cache"
 
-        print "Mask Computation Finished"
+        else:
+            self.image_manager.compute_mask(self.parameters.imageloaderparams)
+            self.save_stage("mask", {"mask": self.image_manager.mask})
+            recorder.count(pixels=self.image_manager.mask.size)
 
+            print "Mask Computation Finished"
+
+    @timed("Load Fluor Image")
     def load_fluor_image(self, channel, filename=None):
         """Calls the load_fluor_image method from the ImageManager
         Can be called without a filename or by passing one as an arg
@@ -47,32 +209,71 @@ class SetManager(object):
         self.image_manager.load_fluor_image(channel,
                                             self.parameters.imageloaderparams,
                                             filename)
+        self.fluor_filenames[channel] = filename
+        self.fret_manager.clear_pixel_cache()
+        self.set_input(channel, filename)
 
         print "Fluor Image Loaded"
 
+    @timed("Compute Segments")
     def compute_segments(self):
         """Calls the compute_segments method from Segments.
         Requires the prior loading of both the phase and fluor images and
         the computation of the mask"""
 
         self.segments_manager = SegmentsManager()
-        self.segments_manager.compute_segments(self.parameters.
-                                               imageprocessingparams,
-                                               self.image_manager)
+        arrays = self.load_stage("segments")
+        recorder.count(pixels=self.image_manager.mask.size)
+
+        if arrays is not None:
+            self.segments_manager.features = arrays["features"]
+            self.segments_manager.labels = arrays["labels"]
+            self.segments_manager.distance = arrays["distance"]
+            self.segments_manager.overlay_phase_w_features(self.image_manager)
+            print "Segments Loaded From Cache"
 
-        print "Segments Computation Finished"
+        else:
+            self.segments_manager.compute_segments(self.parameters.
+                                                   imageprocessingparams,
+                                                   self.image_manager)
+            self.save_stage("segments",
+                            {"features": self.segments_manager.features,
+                             "labels": self.segments_manager.labels,
+                             "distance": self.segments_manager.distance})
 
+            print "Segments Computation Finished"
+
+    @timed("Compute Cells")
     def compute_cells(self):
         """Creates an instance of the CellManager class and uses the
         compute_cells_method to create a list of cells based on the labels
         computed by the SegmentsManager instance."""
         self.cells_manager = CellsManager(self.parameters)
-        self.cells_manager.compute_cells(self.parameters.cellprocessingparams,
-                                         self.image_manager,
-                                         self.segments_manager)
+        self.cell_edits = []
+        arrays = self.load_stage("cells")
+
+        if arrays is not None:
+            self.cells_manager.cells = cells_from_arrays(arrays, "cells__")
+            self.cells_manager.original_cells = cells_from_arrays(arrays,
+                                                                  "original__")
+            self.cells_manager.overlay_cells(self.image_manager)
+            print "Cells Loaded From Cache"
+
+        else:
+            self.cells_manager.compute_cells(self.parameters.cellprocessingparams,
+                                             self.image_manager,
+                                             self.segments_manager)
+            arrays = cells_to_arrays(self.cells_manager.cells, "cells__")
+            arrays.update(cells_to_arrays(self.cells_manager.original_cells,
+                                          "original__"))
+            self.save_stage("cells", arrays)
 
-        print "Cells Computation Finished"
+            print "Cells Computation Finished"
 
+        recorder.count(cells=len(self.cells_manager.cells),
+                       merges=len(self.cells_manager.merged_cells_labels()))
+
+    @timed("Merge Cells")
     def merge_cells(self, label_c1, label_c2):
         """Merges two cells using the merge_cells method from the cell_manager
         instance and the compute_merged_cells to create a new list of cells,
@@ -82,9 +283,11 @@ class SetManager(object):
                                        self.segments_manager,
                                        self.image_manager)
         self.cells_manager.overlay_cells(self.image_manager)
+        self.cell_edits.extend(["merge", int(label_c1), int(label_c2)])
 
         print "Merge Finished"
 
+    @timed("Split Cells")
     def split_cells(self, label_c1):
         """Splits a previously merged cell, requires the label of cell to be
         splitted.
@@ -94,6 +297,7 @@ class SetManager(object):
                                        self.segments_manager,
                                        self.image_manager)
         self.cells_manager.overlay_cells(self.image_manager)
+        self.cell_edits.extend(["split", int(label_c1)])
 
         print "Split Finished"
 
@@ -101,26 +305,157 @@ class SetManager(object):
         """Method used to change the state of a cell to noise or to undo it"""
         self.cells_manager.mark_cell_as_noise(label_c1, self.image_manager,
                                               noise)
+        self.cell_edits.extend(["noise", int(label_c1), bool(noise)])
 
+    @timed("Process Cells")
     def process_cells(self):
-        self.cells_manager.process_cells(self.parameters.cellprocessingparams, self.image_manager)
+        arrays = self.load_stage("regions")
+
+        if arrays is not None:
+            self.cells_manager.cells = cells_from_arrays(arrays, "cells__")
+            self.cells_manager.create_cells_images(self.parameters.cellprocessingparams,
+                                                   self.image_manager)
+            print "Cells Regions Loaded From Cache"
+
+        else:
+            self.cells_manager.process_cells(self.parameters.cellprocessingparams, self.image_manager)
+            self.save_stage("regions", cells_to_arrays(self.cells_manager.cells,
+                                                       "cells__"))
+
+            print "Cells Processing Finished"
+
+        recorder.count(cells=len(self.cells_manager.cells),
+                       septa=len([k for k in self.cells_manager.cells.keys()
+                                  if self.cells_manager.cells[k].sept_mask is not None]))
+
+    def field_name(self):
+        """Name of the field used to key the picker journal, the name of the
+        phase image file"""
+        return self.phase_filename.split("/")[-1]
 
-        print "Cells Processing Finished"
+    def pick_channel(self, journal_filename=None, resume=False):
+        """Opens the CellPicker. If journal_filename is given, each decision
+        is appended to that file as it is made and, with resume=True, the
+        cells already classified in the journal are skipped"""
+        journal = None
+        if journal_filename is not None:
+            journal = PickerJournal(journal_filename, self.field_name())
 
-    def pick_channel(self):
-        self.fret_manager.start_channel_picker(self.image_manager, self.cells_manager)
+        self.fret_manager.start_channel_picker(self.image_manager, self.cells_manager,
+                                               journal, resume)
 
+    def load_assignments(self, filename, field=None):
+        """Replays a picker journal into the cells without opening any
+        window. By default only the decisions of the current field are used"""
+        if field is None:
+            field = self.field_name()
+
+        assignments = load_assignments(filename, field)
+        self.fret_manager.load_assignments(self.cells_manager, assignments)
+
+        print str(len(assignments)) + " Assignments Loaded"
+
+    def reclassify_cell(self, label, channel, has_septum=None):
+        """Changes the channel of a single cell after the FRET computations,
+        updating only that cell and the medians of its populations"""
+        self.fret_manager.reclassify_cell(self.image_manager, self.cells_manager,
+                                          str(int(label)), channel, has_septum)
+
+    @timed("Classify Channels")
+    def classify_channels(self, classifier=None, pick_ambiguous=True):
+        """Classifies the cells automatically, only showing the ambiguous
+        ones in the CellPicker"""
+        ambiguous = self.fret_manager.classify_channels(self.image_manager,
+                                                        self.cells_manager,
+                                                        classifier,
+                                                        pick_ambiguous)
+        recorder.count(cells=len(self.cells_manager.cells))
+
+        print str(len(ambiguous)) + " Ambiguous Cells"
+
+    @timed("Compute Autofluorescence")
     def compute_autofluorescence(self):
         self.fret_manager.compute_autofluorescence(self.image_manager, self.cells_manager)
 
+    @timed("Compute Correction Factors")
     def compute_correction_factors(self):
         self.fret_manager.compute_correction_factors(self.image_manager, self.cells_manager)
 
+    @timed("Compute G")
     def compute_g(self):
         self.fret_manager.compute_g(self.image_manager, self.cells_manager)
 
-    def compute_fret_efficiency(self):
+    def save_calibration(self, filename=None):
+        """Saves the autofluorescence, correction factors and G, with the per
+        cell averages and the images they were computed from"""
+        if filename is None:
+            filename = tkFileDialog.asksaveasfilename(initialdir=self.working_dir)
+
+        images = {"Phase": self.phase_filename}
+        images.update(self.fluor_filenames)
+        provenance = {"images": images}
+        if self.stage_cache is not None:
+            provenance["digests"] = dict([(channel, self.input_digest(channel))
+                                          for channel in self.input_sources])
+
+        save_calibration(filename, self.fret_manager, provenance)
+
+        print "Calibration Saved"
+
+    def load_calibration(self, filename=None):
+        """Loads a saved calibration, replacing compute_autofluorescence,
+        compute_correction_factors and compute_g. Only the cells picked as
+        both are needed afterwards to compute the FRET efficiency"""
+        if filename is None:
+            filename = tkFileDialog.askopenfilename(initialdir=self.working_dir)
+
+        record = load_calibration(filename, self.fret_manager)
+
+        print "Calibration Loaded (" + record["provenance"]["date"] + ")"
+
+    def pool_calibrations(self, filenames, sketch=False, output=None):
+        """Loads the median of the per cell averages of several calibration
+        files, as if all their cells were in a single field. If output is
+        given, the pooled calibration is saved to that file"""
+        accumulator = CalibrationAccumulator(sketch)
+        for filename in filenames:
+            accumulator.add_calibration(filename)
+
+        accumulator.apply(self.fret_manager)
+
+        if output is not None:
+            save_calibration(output, self.fret_manager, accumulator.provenance())
+
+        print str(len(filenames)) + " Calibrations Pooled"
+
+        return accumulator
+
+    @timed("Compute FRET Efficiency")
+    def compute_fret_efficiency(self, stack_filename=None):
+        """Computes E for the cells picked as both. If stack_filename is
+        given, the E stack is written to that npy file as it is computed
+        instead of being kept in memory"""
+        self.fret_manager.e_stack_filename = stack_filename
         self.fret_manager.compute_fret_efficiency(self.image_manager, self.cells_manager)
+        self.fret_manager.compute_confidence_intervals()
+
+    @timed("Process Time-Lapse")
+    def process_time_lapse(self, filename, output):
+        """Processes every frame of a time-lapse stack file with the current
+        parameters and the calibration of the FRETManager, loaded before
+        with load_calibration. The frames are read and processed one at a
+        time and their results written to the output_frames.txt and
+        output_cells.txt files"""
+        time_lapse = TimeLapse(self.parameters, self.fret_manager,
+                               self.image_manager.alignment_cache,
+                               self.image_manager.alignment_setup)
+        frames = stack_frames(filename,
+                              self.parameters.imageloaderparams.stack_channels)
+
+        TimeLapseWriter(output).write_all(time_lapse.run(frames))
+
+        print "Time-Lapse Processing Finished"
 
+    @timed("Generate Report")
     def generate_report(self):
         self.reports_manager.generate_report(self.image_manager, self.cells_manager, self.fret_manager)
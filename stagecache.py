@@ -0,0 +1,250 @@
+"""Module containing an on-disk cache for the outputs of the pipeline stages.
+Each stage output is stored as a compressed numpy archive named after a key
+computed from the input images and the parameters used by that stage"""
+
+import hashlib
+import json
+import os
+import zipfile
+import numpy as np
+from collections import OrderedDict
+from cellsmanager import Cell
+
+# ordered from the first to the last stage of the pipeline
+STAGES = ["mask", "segments", "cells", "regions"]
+
+CELL_FIELDS = ["label", "merged_with", "merged_list", "marked_as_noise",
+               "box", "box_margin", "color_i", "septum_from", "channel",
+               "has_septum", "selection_state"]
+
+CELL_ARRAYS = ["lines", "outline", "long_axis", "short_axis", "cell_mask",
+               "perim_mask", "sept_mask", "cyto_mask", "membsept_mask"]
+
+# parameters that change how a stage runs or are not used by the cached
+# stages, but not their output, left out of the keys
+EXECUTION_PARAMETERS = ["mask_workers", "mask_memory_budget", "lazy_images",
+                        "track_min_overlap", "track_max_distance"]
+
+
+def file_digest(path, chunk_size=1048576):
+    """Returns the sha1 digest of the bytes of a file"""
+
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(chunk_size)
+
+    return sha.hexdigest()
+
+
+def parameters_digest(params):
+    """Returns the sha1 digest of the attributes of a parameters section
+    (MaskParameters, RegionParameters or CellParameters), except the
+    EXECUTION_PARAMETERS"""
+
+    values = [(name, value) for name, value in sorted(vars(params).items())
+              if name not in EXECUTION_PARAMETERS]
+
+    return hashlib.sha1(repr(values)).hexdigest()
+
+
+def stage_key(*parts):
+    """Combines digests and values into a single key"""
+
+    return hashlib.sha1("|".join([str(p) for p in parts])).hexdigest()
+
+
+def plain_value(value):
+    """Converts numpy scalars and containers to values that can be
+    serialized to json"""
+
+    if isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, (list, tuple, np.ndarray)):
+        return [plain_value(v) for v in value]
+    else:
+        return value
+
+
+def cells_to_arrays(cells, prefix):
+    """Packs a dict of cells into a dict of arrays. The array attributes of
+    all cells are concatenated, one array per attribute, and the remaining
+    attributes are stored as a json string"""
+
+    keys = sorted(cells.keys(), key=int)
+    meta = OrderedDict()
+    arrays = {}
+
+    for name in CELL_ARRAYS:
+        data = []
+        shapes = np.zeros((len(keys), 2), dtype=np.int64)
+
+        for ix, k in enumerate(keys):
+            value = getattr(cells[k], name)
+            if value is None:
+                shapes[ix] = (-1, -1)
+            else:
+                value = np.asarray(value)
+                if value.size == 0:
+                    value = np.zeros((0, 0))
+                shapes[ix] = value.shape
+                data.append(value.ravel())
+
+        if len(data) > 0:
+            arrays[prefix + name + "__data"] = np.concatenate(data)
+        else:
+            arrays[prefix + name + "__data"] = np.zeros(0)
+        arrays[prefix + name + "__shapes"] = shapes
+
+    for k in keys:
+        cell = cells[k]
+        fields = OrderedDict()
+        for name in CELL_FIELDS:
+            fields[name] = plain_value(getattr(cell, name))
+        fields["neighbours"] = [[plain_value(n), plain_value(v)]
+                                for n, v in cell.neighbours.iteritems()]
+        fields["stats"] = [[s, plain_value(v)]
+                           for s, v in cell.stats.iteritems()]
+        fields["dtypes"] = dict((name, str(np.asarray(getattr(cell, name)).dtype))
+                                for name in CELL_ARRAYS
+                                if getattr(cell, name) is not None)
+        meta[k] = fields
+
+    arrays[prefix + "meta"] = np.array(json.dumps(meta))
+
+    return arrays
+
+
+def cells_from_arrays(arrays, prefix):
+    """Rebuilds the dict of cells packed by cells_to_arrays"""
+
+    meta = json.loads(arrays[prefix + "meta"].item(),
+                      object_pairs_hook=OrderedDict)
+    keys = meta.keys()
+    cells = {}
+
+    for k in keys:
+        fields = meta[k]
+        cell = Cell(fields["label"])
+        for name in CELL_FIELDS:
+            setattr(cell, name, fields[name])
+        if cell.box is not None:
+            cell.box = tuple(cell.box)
+        cell.neighbours = dict((n, v) for n, v in fields["neighbours"])
+        cell.stats = OrderedDict(fields["stats"])
+        cells[str(k)] = cell
+
+    for name in CELL_ARRAYS:
+        data = arrays[prefix + name + "__data"]
+        shapes = arrays[prefix + name + "__shapes"]
+        offset = 0
+
+        for ix, k in enumerate(keys):
+            cell = cells[str(k)]
+            shape = tuple(shapes[ix])
+
+            if shape[0] < 0:
+                setattr(cell, name, None)
+                continue
+
+            size = int(np.prod(shape))
+            value = data[offset:offset + size].reshape(shape)
+            value = value.astype(meta[k]["dtypes"][name])
+            offset += size
+
+            if name in ("lines", "outline"):
+                value = [tuple(p) for p in value.tolist()]
+            elif name in ("long_axis", "short_axis") and size == 0:
+                value = []
+
+            setattr(cell, name, value)
+
+    return cells
+
+
+class StageCache(object):
+    """Stores the outputs of the pipeline stages in a directory, evicting the
+    least recently used entries when the total size goes over max_size"""
+
+    def __init__(self, path, max_size=2 * 1024 ** 3):
+        self.path = path
+        self.max_size = max_size
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def filename(self, stage, key):
+        return os.path.join(self.path, stage + "_" + key + ".npz")
+
+    def has(self, stage, key):
+        return os.path.exists(self.filename(stage, key))
+
+    def load(self, stage, key):
+        """Returns a dict with the arrays stored for the stage or None if the
+        stage is not in the cache"""
+
+        filename = self.filename(stage, key)
+
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with np.load(filename) as data:
+                arrays = dict((k, data[k]) for k in data.files)
+        except (IOError, ValueError, zipfile.BadZipfile):
+            os.remove(filename)
+            return None
+
+        # entries are evicted by modification time
+        os.utime(filename, None)
+
+        return arrays
+
+    def save(self, stage, key, arrays):
+        """Writes the arrays of a stage and evicts old entries if needed"""
+
+        filename = self.filename(stage, key)
+        tmp_filename = filename + ".tmp"
+
+        with open(tmp_filename, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.rename(tmp_filename, filename)
+
+        self.evict(keep=filename)
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the cache size is
+        below max_size"""
+
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith(".npz"):
+                filename = os.path.join(self.path, name)
+                stat = os.stat(filename)
+                entries.append((stat.st_mtime, stat.st_size, filename))
+
+        entries.sort()
+        total = sum([e[1] for e in entries])
+
+        for mtime, size, filename in entries:
+            if total <= self.max_size:
+                break
+            if filename != keep:
+                os.remove(filename)
+                total -= size
+
+    def deepest_stage(self, keys):
+        """Returns the last stage of the pipeline that is stored in the cache,
+        given a dict with the key of each stage, or None if even the first
+        stage has to be computed"""
+
+        deepest = None
+        for stage in STAGES:
+            if stage in keys and self.has(stage, keys[stage]):
+                deepest = stage
+            else:
+                break
+
+        return deepest
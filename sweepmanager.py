@@ -0,0 +1,225 @@
+"""Module used to run the pipeline over a grid of parameter values.
+Combinations are organized as a tree following the stages of the pipeline,
+so that combinations sharing the mask parameters reuse the same mask and
+combinations sharing the region parameters reuse the same labels. The
+masks and labels are handed to the worker processes once, when they start,
+and each task only carries the parameters of its leaf"""
+
+import itertools
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+from copy import deepcopy
+from skimage.io import imread
+from imagemanager import ImageManager
+from segmentsmanager import SegmentsManager
+from cellsmanager import CellsManager
+from cellclassifier import CellClassifier
+from precision import set_precision
+
+SECTIONS = ["imageloaderparams", "imageprocessingparams", "cellprocessingparams"]
+
+# inputs shared by the leaves: the (image manager, segments manager) of each
+# region node, the fret manager and the classifier
+SHARED_INPUTS = {}
+
+
+def set_shared_inputs(inputs):
+    """Sets the inputs used by run_leaf. Called in each worker process when
+    it starts, so that they are not sent again with every task"""
+
+    SHARED_INPUTS.clear()
+    SHARED_INPUTS.update(inputs)
+
+
+def run_leaf(args):
+    """Computes and processes the cells of a single combination of parameters,
+    given the parameters and the index of its region node in the shared
+    inputs. Module level function so that it can be sent to worker
+    processes"""
+
+    parameters, node = args
+    image_manager, segments_manager = SHARED_INPUTS["nodes"][node]
+    fret_manager = SHARED_INPUTS["fret_manager"]
+
+    set_precision(parameters.imageloaderparams.compute_precision)
+
+    cells_manager = CellsManager(parameters)
+    cells_manager.compute_cells(parameters.cellprocessingparams,
+                                image_manager, segments_manager)
+    cells_manager.process_cells(parameters.cellprocessingparams,
+                                image_manager)
+
+    result = OrderedDict()
+    result["Cells"] = len(cells_manager.cells)
+    result["Merged"] = len(cells_manager.merged_cells_labels())
+    result["Average Area"] = np.average([c.stats["Area"] for c in
+                                         cells_manager.cells.values()])
+
+    if fret_manager is not None:
+        fret_manager = deepcopy(fret_manager)
+        fret_manager.classify_channels(image_manager, cells_manager,
+                                       SHARED_INPUTS["classifier"],
+                                       pick_ambiguous=False)
+        fret_manager.both_cells = [k for k in fret_manager.both_cells
+                                   if cells_manager.cells[k].selection_state == 1]
+        result["Both Cells"] = len(fret_manager.both_cells)
+        result["Septa"] = len([k for k in fret_manager.both_cells
+                               if cells_manager.cells[k].has_septum])
+
+        if len(fret_manager.both_cells) > 0:
+            fret_manager.compute_fret_efficiency(image_manager, cells_manager)
+
+        result["Cell E"] = fret_manager.cell_E
+        result["Membrane E"] = fret_manager.membrane_E
+        result["Cytoplasm E"] = fret_manager.cyto_E
+        result["Septum E"] = fret_manager.septum_E
+        result["MembSept E"] = fret_manager.membsept_E
+
+    return result
+
+
+class ParameterSweep(object):
+    """Runs the pipeline for every combination of a grid of parameter values.
+    The grid is a dict of parameter names, as attributes of the
+    MaskParameters, RegionParameters or CellParameters classes, and lists of
+    values, e.g. {"peak_min_distance": [5, 7], "mask_closing": [1, 3]}"""
+
+    def __init__(self, parameters, grid):
+        self.parameters = parameters
+        self.grid = OrderedDict(grid)
+        self.sections = OrderedDict()
+        self.table = []
+
+        for name in self.grid.keys():
+            for section in SECTIONS:
+                if hasattr(getattr(parameters, section), name):
+                    self.sections[name] = section
+                    break
+            else:
+                raise ValueError("Not a valid parameter name: " + name)
+
+    def combinations(self):
+        """Returns a list of dicts, one for each combination of the grid"""
+
+        names = self.grid.keys()
+
+        return [OrderedDict(zip(names, values)) for values in
+                itertools.product(*[self.grid[n] for n in names])]
+
+    def section_values(self, combination, section):
+        return tuple([(n, v) for n, v in combination.items()
+                      if self.sections[n] == section])
+
+    def build_tree(self):
+        """Groups the combinations by the values of the mask parameters and,
+        inside each group, by the values of the region parameters. The
+        combinations in the leaves only differ in the cell parameters"""
+
+        tree = OrderedDict()
+
+        for combination in self.combinations():
+            mask_values = self.section_values(combination, "imageloaderparams")
+            region_values = self.section_values(combination,
+                                                "imageprocessingparams")
+            tree.setdefault(mask_values, OrderedDict())
+            tree[mask_values].setdefault(region_values, [])
+            tree[mask_values][region_values].append(combination)
+
+        return tree
+
+    def combination_parameters(self, combination):
+        """Returns a copy of the base parameters with the values of a
+        combination"""
+
+        parameters = deepcopy(self.parameters)
+
+        for name, value in combination.items():
+            setattr(getattr(parameters, self.sections[name]), name, value)
+
+        return parameters
+
+    def run(self, phase_path, donor_path, acceptor_path, fret_path,
+            fret_manager=None, workers=None, classifier=None):
+        """Runs every combination of the grid and returns a table, a list of
+        dicts with the parameter values, the cell counts and, if a
+        fret_manager with the autofluorescence, correction factors and G
+        already computed is given, the FRET efficiencies of the selected
+        cells. The channel and septum of the cells of each combination are
+        assigned with classifier, a CellClassifier by default, and E is
+        computed for the cells classified as both. The leaves of the tree
+        run in parallel in workers processes"""
+
+        if classifier is None:
+            classifier = CellClassifier()
+
+        images = OrderedDict([("Phase", imread(phase_path)),
+                              ("Donor", imread(donor_path)),
+                              ("Acceptor", imread(acceptor_path)),
+                              ("FRET", imread(fret_path))])
+
+        tree = self.build_tree()
+        nodes = []
+        tasks = []
+        combinations = []
+
+        for mask_values, regions in tree.items():
+            first = regions.values()[0][0]
+            params = self.combination_parameters(first).imageloaderparams
+
+            set_precision(params.compute_precision)
+            image_manager = ImageManager()
+            image_manager.set_phase_image(images["Phase"], params.border)
+            image_manager.compute_mask(params)
+            for channel in ["Donor", "Acceptor", "FRET"]:
+                image_manager.set_fluor_image(channel, images[channel], params)
+
+            for region_values, leaves in regions.items():
+                params = self.combination_parameters(leaves[0])
+
+                segments_manager = SegmentsManager()
+                segments_manager.compute_segments(params.imageprocessingparams,
+                                                  image_manager)
+                nodes.append((image_manager, segments_manager))
+
+                for combination in leaves:
+                    tasks.append((self.combination_parameters(combination),
+                                  len(nodes) - 1))
+                    combinations.append(combination)
+
+        inputs = {"nodes": nodes, "fret_manager": fret_manager,
+                  "classifier": classifier}
+
+        if workers == 1:
+            set_shared_inputs(inputs)
+            try:
+                results = map(run_leaf, tasks)
+            finally:
+                SHARED_INPUTS.clear()
+        else:
+            pool = multiprocessing.Pool(workers, set_shared_inputs, (inputs,))
+            try:
+                results = pool.map(run_leaf, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        self.table = []
+        for combination, result in zip(combinations, results):
+            row = OrderedDict(combination)
+            row.update(result)
+            self.table.append(row)
+
+        return self.table
+
+    def save_table(self, filename):
+        """Saves the table of the last run as a tab separated file"""
+
+        if len(self.table) == 0:
+            return
+
+        lines = ["\t".join(self.table[0].keys()) + "\n"]
+        for row in self.table:
+            lines.append("\t".join([str(v) for v in row.values()]) + "\n")
+
+        open(filename, "w").writelines(lines)
@@ -0,0 +1,260 @@
+"""Module used to generate synthetic bacterial FRET fields with known ground
+truth, for benchmarks and to check the numerical output of the pipeline.
+The intensities follow the linear model inverted by the FRETManager, so
+that in the absence of noise the correction factors, G and E computed by
+the pipeline match the ones used to generate the images"""
+
+import json
+import os
+import numpy as np
+from collections import OrderedDict
+from skimage.io import imsave
+
+class SyntheticField(object):
+    """Generates a field of rod and coccoid cells placed on a jittered grid,
+    with phase, Donor, Acceptor and FRET images. The fluorescence images are
+    shifted by (shift_x, shift_y) relative to the phase image"""
+
+    def __init__(self, n_cells=100, shape=None, spacing=36, seed=0):
+        self.n_cells = n_cells
+        self.shape = shape
+        self.spacing = spacing
+        self.seed = seed
+
+        # geometry
+        self.margin = 30
+        self.rod_fraction = 0.5
+        self.rod_axes = ((10, 13), (6.5, 7.5))  # (semi long, semi short) ranges
+        self.coccus_radius = (8, 9)
+        self.septum_fraction = 0.3
+        self.septum_thickness = 3
+        self.septum_gain = 1.5
+
+        self.populations = OrderedDict([("wt", 0.2), ("donor", 0.2),
+                                        ("acceptor", 0.2), ("control", 0.2),
+                                        ("both", 0.2)])
+
+        # phase image
+        self.phase_background = 0.75
+        self.phase_cell = 0.25
+        self.phase_noise = 0.02
+
+        # fluorescence, in camera counts
+        self.shift_x = 3
+        self.shift_y = -2
+        self.baseline = OrderedDict([("Donor", 200.0), ("Acceptor", 180.0),
+                                     ("FRET", 160.0)])
+        self.autofluorescence = OrderedDict([("Donor", 150.0),
+                                             ("Acceptor", 120.0),
+                                             ("FRET", 100.0)])
+        self.donor_intensity = 3000.0
+        self.acceptor_intensity = 3000.0
+        self.fluor_noise = 5.0
+
+        # FRET model
+        self.fret_a = 0.08
+        self.fret_b = 0.03
+        self.fret_c = 0.1
+        self.fret_d = 0.4
+        self.fret_G = 2.0
+        self.control_E = 0.35
+        self.both_E = 0.25
+
+        self.phase = None
+        self.donor = None
+        self.acceptor = None
+        self.fret = None
+        self.labels = None
+        self.cells = []
+
+    def grid_positions(self, rng):
+        """Returns the centers of the cells, one per grid slot, chosen at
+        random among the slots of the field"""
+
+        if self.shape is None:
+            side = int(np.ceil(np.sqrt(self.n_cells)))
+            size = side * self.spacing + 2 * self.margin
+            self.shape = (size, size)
+
+        rows = (self.shape[0] - 2 * self.margin) // self.spacing
+        cols = (self.shape[1] - 2 * self.margin) // self.spacing
+        slots = rng.permutation(rows * cols)[:self.n_cells]
+        self.n_cells = len(slots)
+
+        centers = []
+        for slot in np.sort(slots):
+            r, c = divmod(slot, cols)
+            centers.append((self.margin + (r + 0.5) * self.spacing,
+                            self.margin + (c + 0.5) * self.spacing))
+
+        return centers
+
+    def cell_signals(self, population):
+        """Returns the true (Idd, Iaa, Fc) of a cell of a population"""
+
+        donor = self.donor_intensity
+        acceptor = self.acceptor_intensity
+
+        if population == "wt":
+            return 0.0, 0.0, 0.0
+        elif population == "donor":
+            return donor, 0.0, 0.0
+        elif population == "acceptor":
+            return 0.0, acceptor, 0.0
+        elif population == "control":
+            e = self.control_E
+        else:
+            e = self.both_E
+
+        return donor * (1 - e), acceptor, self.fret_G * e * donor
+
+    def measured_signals(self, idd, iaa, fc):
+        """Returns the Donor, Acceptor and FRET channel intensities for the
+        true Idd, Iaa and Fc of a pixel"""
+
+        a, b, c, d = self.fret_a, self.fret_b, self.fret_c, self.fret_d
+
+        donor = idd + b * iaa + (b / a) * fc
+        acceptor = c * idd + iaa + (c / d) * fc
+        fret = d * idd + a * iaa + fc
+
+        return donor, acceptor, fret
+
+    def generate(self):
+        """Generates the images and the ground truth of the field"""
+
+        rng = np.random.RandomState(self.seed)
+        centers = self.grid_positions(rng)
+        phase = np.ones(self.shape) * self.phase_background
+        labels = np.zeros(self.shape, dtype=np.int32)
+        signals = np.zeros((3,) + self.shape)
+
+        names = list(self.populations.keys())
+        probs = np.array(self.populations.values(), dtype=float)
+        probs /= np.sum(probs)
+
+        self.cells = []
+
+        for ix, center in enumerate(centers):
+            jitter = (self.spacing - 2 * self.rod_axes[0][1]) / 4.0
+            cx = center[0] + rng.uniform(-jitter, jitter)
+            cy = center[1] + rng.uniform(-jitter, jitter)
+
+            if rng.uniform() < self.rod_fraction:
+                kind = "rod"
+                long_axis = rng.uniform(*self.rod_axes[0])
+                short_axis = rng.uniform(*self.rod_axes[1])
+                angle = rng.uniform(0, np.pi)
+            else:
+                kind = "coccus"
+                long_axis = short_axis = rng.uniform(*self.coccus_radius)
+                angle = rng.uniform(0, np.pi)
+
+            population = names[rng.choice(len(names), p=probs)]
+            has_septum = bool(rng.uniform() < self.septum_fraction)
+
+            r = int(np.ceil(long_axis)) + 1
+            x0, x1 = int(cx) - r, int(cx) + r + 1
+            y0, y1 = int(cy) - r, int(cy) + r + 1
+            xx, yy = np.mgrid[x0:x1, y0:y1]
+            u = (xx - cx) * np.cos(angle) + (yy - cy) * np.sin(angle)
+            v = -(xx - cx) * np.sin(angle) + (yy - cy) * np.cos(angle)
+            inside = (u / long_axis) ** 2 + (v / short_axis) ** 2 <= 1
+
+            gain = inside.astype(float)
+            if has_septum:
+                gain[inside & (np.abs(u) <= self.septum_thickness / 2.0)] = \
+                    self.septum_gain
+
+            label = ix + 1
+            labels[x0:x1, y0:y1][inside] = label
+            phase[x0:x1, y0:y1][inside] = self.phase_cell
+
+            idd, iaa, fc = self.cell_signals(population)
+            for channel, value in enumerate(self.measured_signals(idd, iaa, fc)):
+                signals[channel, x0:x1, y0:y1] += gain * value
+
+            truth_e = None
+            if population == "control":
+                truth_e = self.control_E
+            elif population == "both":
+                truth_e = self.both_E
+
+            self.cells.append(OrderedDict([("label", label),
+                                           ("center", (cx, cy)),
+                                           ("kind", kind),
+                                           ("long_axis", long_axis),
+                                           ("short_axis", short_axis),
+                                           ("angle", angle),
+                                           ("channel", population),
+                                           ("has_septum", has_septum),
+                                           ("E", truth_e)]))
+
+        phase += rng.normal(0, self.phase_noise, self.shape)
+        self.phase = np.clip(phase, 0, 1)
+        self.labels = labels
+
+        inside = labels > 0
+        images = []
+        for channel, name in enumerate(["Donor", "Acceptor", "FRET"]):
+            img = signals[channel] + self.baseline[name] + \
+                self.autofluorescence[name] * inside
+            if self.fluor_noise > 0:
+                img += rng.normal(0, self.fluor_noise, self.shape)
+            # fluorescence is shifted relative to the phase image
+            img = np.roll(np.roll(img, self.shift_x, axis=0), self.shift_y,
+                          axis=1)
+            images.append(np.clip(np.round(img), 0, 65535).astype(np.uint16))
+
+        self.donor, self.acceptor, self.fret = images
+
+        return self
+
+    def truth(self):
+        """Returns a dict with the ground truth of the field"""
+
+        return OrderedDict([("shape", list(self.shape)),
+                            ("n_cells", self.n_cells),
+                            ("shift", [self.shift_x, self.shift_y]),
+                            ("baseline", self.baseline),
+                            ("autofluorescence", self.autofluorescence),
+                            ("fret_a", self.fret_a),
+                            ("fret_b", self.fret_b),
+                            ("fret_c", self.fret_c),
+                            ("fret_d", self.fret_d),
+                            ("fret_G", self.fret_G),
+                            ("control_E", self.control_E),
+                            ("both_E", self.both_E),
+                            ("cells", self.cells)])
+
+    def population_at(self, x, y):
+        """Returns the ground truth of the cell at pixel (x, y) of the phase
+        image, or None if it is background"""
+
+        label = self.labels[int(x), int(y)]
+        if label == 0:
+            return None
+
+        return self.cells[label - 1]
+
+    def save(self, path):
+        """Saves the images as 16 bit tiffs, the ground truth labels as a npy
+        file and the remaining ground truth as json. Returns a dict with the
+        filename of each image"""
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        filenames = OrderedDict()
+        phase = np.round(self.phase * 65535).astype(np.uint16)
+
+        for name, img in [("Phase", phase), ("Donor", self.donor),
+                          ("Acceptor", self.acceptor), ("FRET", self.fret)]:
+            filenames[name] = path + os.sep + name.lower() + ".tif"
+            imsave(filenames[name], img)
+
+        np.save(path + os.sep + "labels.npy", self.labels)
+        with open(path + os.sep + "truth.json", "w") as f:
+            json.dump(self.truth(), f, indent=2)
+
+        return filenames
@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+from fretmanager import FRETManager
+from calibration import CALIBRATION_VALUES, calibration_record
+
+
+def calibrated_fret_manager():
+    fret_manager = FRETManager()
+    rng = np.random.RandomState(0)
+
+    for ix, (name, attribute) in enumerate(CALIBRATION_VALUES):
+        fret_manager.cell_averages[name] = list(rng.normal(ix + 1, 0.1, 20))
+        setattr(fret_manager, attribute, np.median(fret_manager.cell_averages[name]))
+
+    return fret_manager
+
+
+class CalibrationRecordTest(unittest.TestCase):
+
+    def test_intervals_of_the_report(self):
+        fret_manager = calibrated_fret_manager()
+        fret_manager.compute_confidence_intervals(alpha=0.1, seed=3)
+        record = calibration_record(fret_manager)
+
+        self.assertAlmostEqual(record["confidence_level"], 0.9)
+        for name, attribute in CALIBRATION_VALUES:
+            self.assertEqual(tuple(record["confidence_intervals"][name]),
+                             tuple(fret_manager.confidence_intervals[name]))
+
+    def test_missing_intervals_are_computed(self):
+        fret_manager = calibrated_fret_manager()
+        record = calibration_record(fret_manager)
+
+        self.assertAlmostEqual(record["confidence_level"], 0.95)
+        for name, attribute in CALIBRATION_VALUES:
+            low, high = record["confidence_intervals"][name]
+            self.assertEqual((low, high), tuple(fret_manager.confidence_intervals[name]))
+            self.assertLessEqual(low, getattr(fret_manager, attribute))
+            self.assertGreaterEqual(high, getattr(fret_manager, attribute))
+
+
+if __name__ == "__main__":
+    unittest.main()
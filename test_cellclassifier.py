@@ -0,0 +1,80 @@
+import unittest
+import numpy as np
+from collections import OrderedDict
+from parameters import ParametersManager
+from imagemanager import ImageManager
+from segmentsmanager import SegmentsManager
+from cellsmanager import CellsManager
+from fretmanager import FRETManager
+from cellclassifier import CellClassifier
+from syntheticdata import SyntheticField
+
+
+def field_cells(populations):
+    """Generates a field with the given population fractions and returns
+    its image and cells managers"""
+
+    field = SyntheticField(n_cells=30, seed=2)
+    field.populations = OrderedDict(populations)
+    field.generate()
+
+    params = ParametersManager()
+    image_manager = ImageManager()
+    image_manager.set_phase_image(np.round(field.phase * 65535).astype(np.uint16),
+                                  params.imageloaderparams.border)
+    image_manager.compute_mask(params.imageloaderparams)
+    for channel, img in [("Donor", field.donor), ("Acceptor", field.acceptor),
+                         ("FRET", field.fret)]:
+        image_manager.set_fluor_image(channel, img, params.imageloaderparams)
+
+    segments_manager = SegmentsManager()
+    segments_manager.compute_segments(params.imageprocessingparams,
+                                      image_manager)
+    cells_manager = CellsManager(params)
+    cells_manager.compute_cells(params.cellprocessingparams, image_manager,
+                                segments_manager)
+    cells_manager.process_cells(params.cellprocessingparams, image_manager)
+
+    return image_manager, cells_manager
+
+
+class CellClassifierTest(unittest.TestCase):
+
+    def test_mixed_populations(self):
+        image_manager, cells_manager = field_cells(
+            [("wt", 0.25), ("donor", 0.25), ("acceptor", 0.25), ("both", 0.25)])
+
+        ambiguous = CellClassifier().classify(image_manager, cells_manager)
+        channels = set([c.channel for c in cells_manager.cells.values()])
+
+        self.assertLess(len(ambiguous), len(cells_manager.cells) / 2)
+        self.assertEqual(channels, set(["wt", "donor", "acceptor", "both"]))
+
+    def test_single_population_is_ambiguous(self):
+        image_manager, cells_manager = field_cells([("both", 1.0)])
+
+        fret_manager = FRETManager()
+        ambiguous = fret_manager.classify_channels(image_manager, cells_manager,
+                                                   pick_ambiguous=False)
+
+        self.assertEqual(len(ambiguous), len(cells_manager.cells))
+        self.assertEqual(len(fret_manager.both_cells), 0)
+        self.assertEqual(len(fret_manager.donor_cells), 0)
+        self.assertEqual(len(fret_manager.acceptor_cells), 0)
+        self.assertEqual(len(fret_manager.wt_cells), 0)
+
+    def test_single_population_with_thresholds(self):
+        image_manager, cells_manager = field_cells([("both", 1.0)])
+
+        classifier = CellClassifier()
+        classifier.donor_threshold = 1000
+        classifier.acceptor_threshold = 1000
+        ambiguous = classifier.classify(image_manager, cells_manager)
+
+        self.assertEqual(len(ambiguous), 0)
+        self.assertTrue(all([c.channel == "both" for c in
+                             cells_manager.cells.values()]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import numpy as np
+from copy import deepcopy
+import cellprocessing as cp
+from parameters import ParametersManager
+from imagemanager import ImageManager
+from segmentsmanager import SegmentsManager
+from cellsmanager import Cell, CellsManager
+
+
+def square_cell(label, x, y, size=5):
+    cell = Cell(label)
+    cell.lines = [(y + i, x, x + size - 1) for i in range(size)]
+
+    return cell
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cells_manager = CellsManager(ParametersManager())
+        self.cells_manager.cells = {"1": square_cell(1, 10, 10),
+                                    "2": square_cell(2, 40, 40),
+                                    "3": Cell(3)}
+
+    def test_nearest_cells(self):
+        keys, distances = self.cells_manager.nearest_cells(12, 12, k=3)
+
+        self.assertEqual(keys, ["1", "2"])
+        self.assertAlmostEqual(distances[0], 0)
+
+    def test_cells_in_box(self):
+        self.assertEqual(self.cells_manager.cells_in_box(0, 0, 20, 20), ["1"])
+        self.assertEqual(self.cells_manager.cells_in_box(0, 0, 50, 50),
+                         ["1", "2"])
+
+    def test_cell_without_lines(self):
+        # lines of a degenerate cell loaded from the stage cache
+        self.cells_manager.cells["3"].lines = np.zeros(0)
+        self.cells_manager.index_dirty = True
+
+        self.assertEqual(self.cells_manager.cells_in_box(0, 0, 50, 50),
+                         ["1", "2"])
+        self.assertNotIn("3", self.cells_manager.index_keys)
+
+
+def grid_labels(n, size=10):
+    """Label image of n x n touching square cells"""
+
+    labels = np.zeros((n * size + 2, n * size + 2), dtype=int)
+    for i in range(n):
+        for j in range(n):
+            labels[1 + i * size:1 + (i + 1) * size,
+                   1 + j * size:1 + (j + 1) * size] = i * n + j + 1
+
+    return labels
+
+
+class RecolourTest(unittest.TestCase):
+
+    def setUp(self):
+        self.params = ParametersManager()
+        labels = grid_labels(6)
+
+        self.segments_manager = SegmentsManager()
+        self.segments_manager.labels = labels
+        self.image_manager = ImageManager()
+        self.image_manager.mask = (labels == 0).astype(float)
+
+        cells_manager = CellsManager(self.params)
+        cells_manager.cell_regions_from_labels(labels)
+        cells_manager.original_cells = deepcopy(cells_manager.cells)
+        cells_manager.aliases = {}
+        cells_manager.merged_labels = labels.copy()
+        cp.color_cells(cells_manager.cells, len(cells_manager.cell_colors),
+                       original_cells=cells_manager.original_cells,
+                       aliases=cells_manager.aliases)
+        self.cells_manager = cells_manager
+
+    def conflicts(self):
+        labels = self.cells_manager.merged_labels
+        cells = self.cells_manager.cells
+        pairs = set()
+        for a, b in [(labels[:-1], labels[1:]), (labels[:, :-1], labels[:, 1:])]:
+            edge = (a != b) & (a > 0) & (b > 0)
+            pairs |= set(zip(a[edge], b[edge]))
+
+        return [(a, b) for a, b in pairs
+                if cells[str(a)].color_i == cells[str(b)].color_i]
+
+    def merge(self, label_c1, label_c2):
+        self.cells_manager.merge_cells(label_c1, label_c2,
+                                       self.params.cellprocessingparams,
+                                       self.segments_manager,
+                                       self.image_manager)
+
+    def test_merge_and_split(self):
+        aliases = self.cells_manager.aliases
+        self.merge(8, 9)
+        self.merge(9, 10)
+        self.merge(15, 10)
+
+        self.assertEqual(aliases, {"8": "9", "9": "10", "15": "10"})
+        self.assertEqual(self.conflicts(), [])
+
+        self.cells_manager.split_cells(10, self.params.cellprocessingparams,
+                                       self.segments_manager,
+                                       self.image_manager)
+
+        self.assertIs(self.cells_manager.aliases, aliases)
+        self.assertEqual(aliases, {"8": "9"})
+        self.assertEqual(self.conflicts(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
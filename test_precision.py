@@ -0,0 +1,28 @@
+import shutil
+import tempfile
+import unittest
+from benchmark import run_benchmark, precision_checks
+from precision import set_precision
+
+
+class PrecisionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+        set_precision("float64")
+
+    def test_float32_e_matches_float64(self):
+        result = run_benchmark(30, self.workdir, seed=1)
+        float32_result = run_benchmark(30, self.workdir, seed=1,
+                                       precision="float32")
+
+        for name, check in precision_checks(result, float32_result,
+                                            1e-3).items():
+            self.assertTrue(check["passed"], name + ": " + str(check))
+
+
+if __name__ == "__main__":
+    unittest.main()
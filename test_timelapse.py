@@ -0,0 +1,84 @@
+import unittest
+import numpy as np
+from collections import OrderedDict
+from parameters import ParametersManager
+from fretmanager import FRETManager
+from syntheticdata import SyntheticField
+from timelapse import TimeLapse
+
+
+def field_pages(field):
+    return {"Phase": np.round(field.phase * 65535).astype(np.uint16),
+            "Donor": field.donor, "Acceptor": field.acceptor,
+            "FRET": field.fret}
+
+
+def blank_pages(field):
+    """Pages of a frame with only the background of the field and its noise"""
+
+    rng = np.random.RandomState(0)
+    phase = field.phase_background + rng.normal(0, field.phase_noise,
+                                                field.phase.shape)
+    pages = {"Phase": np.round(phase * 65535).astype(np.uint16)}
+    for channel in ["Donor", "Acceptor", "FRET"]:
+        img = field.baseline[channel] + rng.normal(0, field.fluor_noise,
+                                                   field.phase.shape)
+        pages[channel] = np.round(img).astype(np.uint16)
+
+    return pages
+
+
+def field_calibration(field):
+    calibration = FRETManager()
+    calibration.autofluorescence_donor = field.autofluorescence["Donor"]
+    calibration.autofluorescence_acceptor = field.autofluorescence["Acceptor"]
+    calibration.autofluorescence_fret = field.autofluorescence["FRET"]
+    calibration.fret_a = field.fret_a
+    calibration.fret_b = field.fret_b
+    calibration.fret_c = field.fret_c
+    calibration.fret_d = field.fret_d
+    calibration.fret_G = field.fret_G
+    calibration.fret_E = field.control_E
+
+    return calibration
+
+
+class TimeLapseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.field = SyntheticField(n_cells=30, seed=1)
+        self.field.populations = OrderedDict([("wt", 0.25), ("donor", 0.25),
+                                              ("acceptor", 0.25), ("both", 0.25)])
+        self.field.generate()
+        self.time_lapse = TimeLapse(ParametersManager(),
+                                    field_calibration(self.field))
+
+    def test_frames_are_classified(self):
+        summary, cell_rows = self.time_lapse.process_frame(
+            0, field_pages(self.field))
+
+        self.assertGreater(summary["Both"], 0)
+        self.assertLess(summary["Both"], summary["Selected"])
+        self.assertGreater(summary["Septa"], 0)
+        self.assertAlmostEqual(summary["Cell E"], self.field.both_E, delta=0.01)
+        self.assertFalse(np.isnan(summary["Septum E"]))
+        self.assertEqual(len(cell_rows), summary["Both"])
+        self.assertEqual(sum([row["Has Septum"] for row in cell_rows]),
+                         summary["Septa"])
+
+    def test_empty_frame(self):
+        frames = [field_pages(self.field), blank_pages(self.field),
+                  field_pages(self.field)]
+        results = list(self.time_lapse.run(frames))
+
+        self.assertEqual(results[1][0]["Cells"], 0)
+        self.assertEqual(len(results[1][1]), 0)
+        self.assertEqual(results[2][0]["Both"], results[0][0]["Both"])
+
+        first = set([row["Track"] for row in results[0][1]])
+        last = set([row["Track"] for row in results[2][1]])
+        self.assertEqual(len(first & last), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
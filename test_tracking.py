@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+from tracking import CellTracker
+
+
+def square_labels(squares, shape=(60, 60)):
+    """Label image with a square of side 10 for each (label, x, y)"""
+
+    labels = np.zeros(shape, dtype=int)
+    for label, x, y in squares:
+        labels[x:x + 10, y:y + 10] = label
+
+    return labels
+
+
+class CellTrackerTest(unittest.TestCase):
+
+    def test_overlapping_cells_keep_their_track(self):
+        tracker = CellTracker(0.3, 20)
+        first = tracker.update(square_labels([(1, 5, 5), (2, 30, 30)]))
+        second = tracker.update(square_labels([(7, 7, 6), (4, 31, 29)]))
+
+        self.assertEqual(second[7], first[1])
+        self.assertEqual(second[4], first[2])
+
+    def test_cell_without_overlap_is_linked_by_distance(self):
+        tracker = CellTracker(0.3, 20)
+        first = tracker.update(square_labels([(1, 5, 5)]))
+        second = tracker.update(square_labels([(1, 20, 5)]))
+
+        self.assertEqual(second[1], first[1])
+
+    def test_cell_too_far_starts_a_new_track(self):
+        tracker = CellTracker(0.3, 10)
+        first = tracker.update(square_labels([(1, 5, 5)]))
+        second = tracker.update(square_labels([(1, 45, 45)]))
+
+        self.assertNotEqual(second[1], first[1])
+
+    def test_empty_frames(self):
+        tracker = CellTracker(0.3, 20)
+        first = tracker.update(square_labels([(1, 5, 5)]))
+
+        self.assertEqual(len(tracker.update(square_labels([]))), 0)
+
+        third = tracker.update(square_labels([(1, 5, 5)]))
+        self.assertEqual(len(third), 1)
+        self.assertNotEqual(third[1], first[1])
+
+    def test_division(self):
+        tracker = CellTracker(0.3, 20)
+        labels = np.zeros((60, 60), dtype=int)
+        labels[30:40, 30:50] = 2
+        first = tracker.update(labels)
+
+        labels = np.zeros((60, 60), dtype=int)
+        labels[30:40, 30:39] = 4
+        labels[30:40, 41:50] = 5
+        second = tracker.update(labels)
+
+        self.assertNotEqual(second[4], first[2])
+        self.assertNotEqual(second[5], first[2])
+        self.assertEqual(tracker.parents[second[4]], first[2])
+        self.assertEqual(tracker.parents[second[5]], first[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
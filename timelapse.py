@@ -0,0 +1,218 @@
+"""Module used to process time-lapse movies. The frames are read one at a
+time by a generator, each frame goes through the mask, segments, cells and
+FRET efficiency stages with the calibration of a FRETManager and the results
+are yielded frame by frame to a writer, so that the memory used does not
+grow with the number of frames"""
+
+import os
+import numpy as np
+from collections import OrderedDict
+from skimage.external.tifffile import TiffFile
+from imagemanager import ImageManager, read_image, stack_pages
+from segmentsmanager import SegmentsManager
+from cellsmanager import CellsManager
+from fretmanager import FRETManager
+from cellclassifier import CellClassifier
+from calibration import CALIBRATION_VALUES
+from precision import set_precision
+from tracking import CellTracker
+
+
+def stack_frames(path, channels):
+    """Yields the frames of a time-lapse stack file, each a dict of channel
+    to image. The pages are ordered by frame and then by channel, as in
+    channels, or each page has the channels in its last axis. npy files have
+    the frames in the first axis and are memory mapped; the pages of a tiff
+    are read one frame at a time"""
+
+    if os.path.splitext(path)[1].lower() == ".npy":
+        stack = np.load(path, mmap_mode="r")
+        if stack.ndim == 3:
+            stack = stack.reshape((-1, len(channels)) + stack.shape[1:])
+
+        for frame in range(stack.shape[0]):
+            yield stack_pages(stack, channels, frame)
+
+        return
+
+    with TiffFile(path) as tiff:
+        n_pages = len(tiff.pages)
+
+        if tiff.asarray(key=0).ndim == 3:
+            for frame in range(n_pages):
+                yield stack_pages(tiff.asarray(key=frame), channels)
+
+        else:
+            for frame in range(n_pages // len(channels)):
+                pages = tiff.asarray(key=range(frame * len(channels),
+                                               (frame + 1) * len(channels)))
+                yield stack_pages(pages, channels)
+
+
+def file_frames(filenames, lazy=False):
+    """Yields the frames of a time-lapse saved as one file per channel and
+    frame. filenames is a list with a dict of channel to path for each
+    frame"""
+
+    for frame_files in filenames:
+        yield dict([(channel, read_image(path, lazy)) for channel, path in
+                    frame_files.items()])
+
+
+class TimeLapse(object):
+    """Runs the pipeline on each frame of a time-lapse with the calibration
+    of a FRETManager and follows the cells from frame to frame"""
+
+    def __init__(self, parameters, calibration, alignment_cache=None,
+                 alignment_setup="default", classifier=None):
+        self.parameters = parameters
+        self.calibration = calibration
+        self.classifier = classifier
+        if classifier is None:
+            self.classifier = CellClassifier()
+        self.alignment_cache = alignment_cache
+        self.alignment_setup = alignment_setup
+        self.previous_labels = None
+        self.tracker = self.new_tracker()
+
+    def new_tracker(self):
+        params = self.parameters.cellprocessingparams
+
+        return CellTracker(params.track_min_overlap, params.track_max_distance)
+
+    def frame_fret_manager(self):
+        """Returns a new FRETManager with the calibration values"""
+
+        fret_manager = FRETManager()
+
+        for name, attribute in CALIBRATION_VALUES:
+            setattr(fret_manager, attribute,
+                    getattr(self.calibration, attribute))
+        fret_manager.fret_E = self.calibration.fret_E
+
+        return fret_manager
+
+    def process_frame(self, frame, pages):
+        """Computes the cells and E of a frame. Returns the frame summary and
+        a row with the track and the stats of each selected cell"""
+
+        params = self.parameters
+        set_precision(params.imageloaderparams.compute_precision)
+
+        image_manager = ImageManager()
+        image_manager.alignment_cache = self.alignment_cache
+        image_manager.alignment_setup = self.alignment_setup
+        image_manager.acquisition_time = frame
+        image_manager.set_phase_image(pages["Phase"],
+                                      params.imageloaderparams.border)
+        image_manager.compute_mask(params.imageloaderparams)
+        for channel in ["Donor", "Acceptor", "FRET"]:
+            image_manager.set_fluor_image(channel, pages[channel],
+                                          params.imageloaderparams)
+
+        previous_labels = None
+        if params.imageprocessingparams.warm_start:
+            previous_labels = self.previous_labels
+
+        segments_manager = SegmentsManager()
+        segments_manager.compute_segments(params.imageprocessingparams,
+                                          image_manager, previous_labels)
+        self.previous_labels = segments_manager.labels
+
+        cells_manager = CellsManager(params)
+        cells_manager.compute_cells(params.cellprocessingparams,
+                                    image_manager, segments_manager)
+        cells_manager.process_cells(params.cellprocessingparams,
+                                    image_manager)
+        tracks = self.tracker.update(cells_manager.merged_labels)
+
+        selected = [k for k in cells_manager.cells.keys()
+                    if cells_manager.cells[k].selection_state == 1]
+
+        fret_manager = self.frame_fret_manager()
+        fret_manager.classify_channels(image_manager, cells_manager,
+                                       self.classifier, pick_ambiguous=False)
+        fret_manager.both_cells = sorted([k for k in fret_manager.both_cells
+                                          if k in selected], key=int)
+
+        if len(fret_manager.both_cells) > 0:
+            fret_manager.compute_fret_efficiency(image_manager, cells_manager)
+
+        summary = OrderedDict()
+        summary["Frame"] = frame
+        summary["Cells"] = len(cells_manager.cells)
+        summary["Selected"] = len(selected)
+        summary["Both"] = len(fret_manager.both_cells)
+        summary["Septa"] = len([k for k in fret_manager.both_cells
+                                if cells_manager.cells[k].has_septum])
+        summary["Cell E"] = fret_manager.cell_E
+        summary["Membrane E"] = fret_manager.membrane_E
+        summary["Cytoplasm E"] = fret_manager.cyto_E
+        summary["Septum E"] = fret_manager.septum_E
+        summary["MembSept E"] = fret_manager.membsept_E
+
+        cell_rows = []
+        for key in fret_manager.both_cells:
+            track = tracks[int(key)]
+            row = OrderedDict([("Frame", frame), ("Label", key),
+                               ("Track", track),
+                               ("Parent Track", self.tracker.parents.get(track, ""))])
+            row.update(cells_manager.cells[key].stats)
+            cell_rows.append(row)
+
+        return summary, cell_rows
+
+    def run(self, frames):
+        """Generator of the (summary, cell rows) of each frame of an iterable
+        of frames, such as stack_frames or file_frames. Nothing of a frame
+        is kept after its results are yielded, except its labels for the
+        warm start of the next one"""
+
+        self.previous_labels = None
+        self.tracker = self.new_tracker()
+        for frame, pages in enumerate(frames):
+            yield self.process_frame(frame, pages)
+            print "Frame " + str(frame) + " Finished"
+
+
+class TimeLapseWriter(object):
+    """Writes the results of a time-lapse as they are computed, the summary
+    of each frame to <prefix>_frames.txt and the stats of each cell to
+    <prefix>_cells.txt, both tab separated"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.files = {}
+        self.columns = {}
+
+    def write_row(self, name, row):
+        if name not in self.files:
+            self.files[name] = open(self.prefix + "_" + name + ".txt", "w")
+            self.columns[name] = row.keys()
+            self.files[name].write("\t".join(self.columns[name]) + "\n")
+
+        self.files[name].write("\t".join([str(row.get(c, "")) for c in
+                                          self.columns[name]]) + "\n")
+
+    def write(self, summary, cell_rows):
+        self.write_row("frames", summary)
+        for row in cell_rows:
+            self.write_row("cells", row)
+
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def write_all(self, results):
+        """Writes every frame of a TimeLapse.run generator and closes the
+        files"""
+
+        try:
+            for summary, cell_rows in results:
+                self.write(summary, cell_rows)
+        finally:
+            self.close()
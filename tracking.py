@@ -0,0 +1,155 @@
+"""Module used to follow the cells of a time-lapse from frame to frame. The
+cells of consecutive frames are linked by the overlap of their label
+images, counted for every pair of labels at once with bincount, and the
+cells that do not overlap any cell of the previous frame by the nearest
+centroid, found with a KD-tree. Two cells linked to the same cell of the
+previous frame are a division: both start new tracks, with the track of
+the mother cell as parent"""
+
+import numpy as np
+from collections import OrderedDict
+from scipy.spatial import cKDTree
+
+
+def label_overlaps(previous_labels, labels):
+    """Returns the previous label, the label and the number of pixels of
+    each pair of overlapping labels of two label images"""
+
+    previous_labels = np.asarray(previous_labels).astype(np.int64).ravel()
+    labels = np.asarray(labels).astype(np.int64).ravel()
+
+    both = (previous_labels > 0) & (labels > 0)
+    n_labels = np.max(labels) + 1
+    counts = np.bincount(previous_labels[both] * n_labels + labels[both])
+    pairs = np.nonzero(counts)[0]
+
+    return pairs // n_labels, pairs % n_labels, counts[pairs]
+
+
+def label_centroids(labels):
+    """Returns the labels present in a label image, the (x, y) centroid and
+    the area of each"""
+
+    labels = np.asarray(labels).astype(np.int64)
+    x, y = np.indices(labels.shape)
+
+    area = np.bincount(labels.ravel())
+    present = np.nonzero(area)[0]
+    present = present[present > 0]
+
+    cx = np.bincount(labels.ravel(), weights=x.ravel())[present] / area[present]
+    cy = np.bincount(labels.ravel(), weights=y.ravel())[present] / area[present]
+
+    return present, np.column_stack((cx, cy)), area[present]
+
+
+class CellTracker(object):
+    """Gives a track id to the cells of each frame of a time-lapse, the id
+    of the cell they come from in the previous frame. A cell is linked to
+    the previous cell it overlaps most if the overlap is at least
+    min_overlap of its area; otherwise to the nearest previous cell not yet
+    linked, if its centroid is closer than max_distance"""
+
+    def __init__(self, min_overlap=0.3, max_distance=20):
+        self.min_overlap = min_overlap
+        self.max_distance = max_distance
+
+        self.previous_labels = None
+        self.previous_cells = np.zeros(0, dtype=np.int64)
+        self.previous_centroids = np.zeros((0, 2))
+        self.previous_tracks = {}
+
+        self.next_track = 1
+        # parent track of the tracks started by a division
+        self.parents = {}
+
+    def new_track(self, parent=None):
+        track = self.next_track
+        self.next_track += 1
+
+        if parent is not None:
+            self.parents[track] = parent
+
+        return track
+
+    def overlap_matches(self, labels, cells, areas):
+        """Returns a dict of cell label to the previous cell it overlaps
+        most, for the cells that overlap enough"""
+
+        previous, current, counts = label_overlaps(self.previous_labels, labels)
+        if len(current) == 0:
+            return {}
+
+        # largest overlap of each cell first
+        order = np.lexsort((-counts, current))
+        previous, current, counts = previous[order], current[order], counts[order]
+        first = np.concatenate(([True], current[1:] != current[:-1]))
+
+        area = dict(zip(cells, areas))
+
+        return dict([(c, p) for c, p, n in zip(current[first], previous[first],
+                                                counts[first])
+                     if n >= self.min_overlap * area[c]])
+
+    def distance_matches(self, matches, cells, centroids):
+        """Adds to matches the cells without overlap, linked to the nearest
+        previous cell not linked yet, closest pairs first"""
+
+        unmatched = [ix for ix, c in enumerate(cells) if c not in matches]
+        if len(unmatched) == 0 or len(self.previous_cells) == 0:
+            return matches
+
+        k = min(4, len(self.previous_cells))
+        distances, ixs = cKDTree(self.previous_centroids).query(
+            centroids[unmatched], k=k, distance_upper_bound=self.max_distance)
+        distances = distances.reshape((len(unmatched), k))
+        ixs = ixs.reshape((len(unmatched), k))
+
+        used = set(matches.values())
+        candidates = sorted([(distances[i, j], cells[ix], ixs[i, j])
+                             for i, ix in enumerate(unmatched) for j in range(k)
+                             if np.isfinite(distances[i, j])])
+
+        for distance, cell, ix in candidates:
+            previous = self.previous_cells[ix]
+            if cell not in matches and previous not in used:
+                matches[cell] = previous
+                used.add(previous)
+
+        return matches
+
+    def update(self, labels):
+        """Links the cells of the label image of a frame, e.g. the
+        merged_labels of a CellsManager, to the cells of the previous frame.
+        Returns an OrderedDict of cell label to track id"""
+
+        labels = np.asarray(labels).astype(np.int64)
+        cells, centroids, areas = label_centroids(labels)
+
+        matches = {}
+        if self.previous_labels is not None and self.previous_labels.shape == labels.shape:
+            matches = self.overlap_matches(labels, cells, areas)
+        matches = self.distance_matches(matches, cells, centroids)
+
+        daughters = {}
+        for cell in cells:
+            if cell in matches:
+                daughters.setdefault(matches[cell], []).append(cell)
+
+        tracks = OrderedDict()
+        for cell in cells:
+            previous = matches.get(cell)
+
+            if previous is None:
+                tracks[cell] = self.new_track()
+            elif len(daughters[previous]) > 1:
+                tracks[cell] = self.new_track(self.previous_tracks[previous])
+            else:
+                tracks[cell] = self.previous_tracks[previous]
+
+        self.previous_labels = labels
+        self.previous_cells = cells
+        self.previous_centroids = centroids
+        self.previous_tracks = tracks
+
+        return tracks